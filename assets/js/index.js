@@ -1,22 +1,158 @@
-const DANCER_CHUNK_SIZE = 20;
+const __artifacts = {};
 
-const getDatabase = async () => {
-  const response = await fetch("assets/database.txt");
-  return await MessagePack.decodeAsync(response.body);
+// Fetches and decodes a msgpack artifact once per page, later calls share the same promise
+const __loadArtifact = (path) => {
+  if (!(path in __artifacts)) {
+    __artifacts[path] = fetch(path)
+      .then(response => MessagePack.decodeAsync(response.body));
+  }
+  return __artifacts[path];
 };
 
-const getEventsDatabase = async () => {
-  const response = await fetch("assets/events.txt");
-  return await MessagePack.decodeAsync(response.body);
+// Page scoped artifacts, see points/page_artifacts.py for their formats
+const getStats = () => __loadArtifact("assets/stats.txt");
+const getLeaderboards = () => __loadArtifact("assets/leaderboards.txt");
+const getEventsDatabase = () => __loadArtifact("assets/events.txt");
+
+// An event's competitors by date
+const getEventCompetitors = (eventId) => __loadArtifact(`assets/event_competitors/${eventId}.txt`);
+
+// Chunk id bounds plus role and division names for the ids used in chunks
+const getChunkIndex = () => __loadArtifact("assets/chunk_index.txt");
+
+// Letters NFKD does not split into a base letter and a mark, the same as points/search_index.py
+const __foldedLetters = {"ø": "o", "æ": "ae", "œ": "oe", "ß": "ss", "ł": "l", "đ": "d", "ð": "d", "þ": "th", "ı": "i"};
+
+const __foldSearchText = (text) => Array.from(text.toLowerCase().normalize("NFKD").replace(/\p{M}/gu, ""))
+  .map(c => __foldedLetters[c] || c)
+  .join("");
+
+const __searchTokens = (text) => __foldSearchText(text).split(/[^\p{L}\p{N}]+/u).filter(token => token.length > 0);
+
+const __searchShardName = (prefix) => /^[a-z0-9]+$/.test(prefix)
+  ? prefix
+  : "_" + Array.from(new TextEncoder().encode(prefix), byte => byte.toString(16).padStart(2, "0")).join("");
+
+const __lowerBound = (sorted, value) => {
+  let low = 0;
+  let high = sorted.length;
+  while (low < high) {
+    const middle = (low + high) >> 1;
+    if (sorted[middle] < value) {
+      low = middle + 1;
+    } else {
+      high = middle;
+    }
+  }
+  return low;
+};
+
+// [[id, name]], highest id first, of dancers with a name word or id starting with every word of
+// the query. Only the index shards for the query's words are fetched, see points/search_index.py.
+const searchDancers = async (query, limit = 100) => {
+  const searchIndex = await __loadArtifact("assets/search/index.txt");
+  const prefixLength = searchIndex.prefix_length;
+  const queryTokens = __searchTokens(query);
+  const longTokens = queryTokens.filter(token => Array.from(token).length >= prefixLength);
+  const shortTokens = queryTokens.filter(token => Array.from(token).length < prefixLength);
+  // A query of only short words looks each up in its own short prefix shard
+  const lookupTokens = longTokens.length > 0 ? longTokens : shortTokens;
+  if (lookupTokens.length < 1) {
+    return [];
+  }
+  const prefixes = lookupTokens.map(token => Array.from(token).slice(0, prefixLength).join(""));
+  if (prefixes.some(prefix => !searchIndex.shards.includes(prefix))) {
+    return [];
+  }
+  const shards = await Promise.all(prefixes.map(prefix => __loadArtifact(`assets/search/${__searchShardName(prefix)}.txt`)));
+  let matches = null;
+  const names = {};
+  lookupTokens.forEach((token, i) => {
+    const shard = shards[i];
+    Object.assign(names, shard.names);
+    const tokenMatches = new Set();
+    for (let t = __lowerBound(shard.tokens, token); t < shard.tokens.length && shard.tokens[t].startsWith(token); t++) {
+      shard.postings[t].forEach(id => tokenMatches.add(id));
+    }
+    matches = matches === null ? tokenMatches : new Set([...matches].filter(id => tokenMatches.has(id)));
+  });
+  const results = [];
+  for (const id of [...matches].sort((a, b) => b - a)) {
+    const tokens = __searchTokens(names[id]).concat([String(id)]);
+    if (shortTokens.every(short => tokens.some(token => token.startsWith(short)))) {
+      results.push([id, names[id]]);
+      if (results.length >= limit) {
+        break;
+      }
+    }
+  }
+  return results;
+};
+
+// Binary search for the chunk i with bounds[i] <= id < bounds[i + 1], see points/chunk_writer.py
+const __findChunkFile = (bounds, id) => {
+  let low = 0;
+  let high = bounds.length - 2;
+  if (id < bounds[0] || id >= bounds[bounds.length - 1]) {
+    return null;
+  }
+  while (low < high) {
+    const middle = Math.ceil((low + high) / 2);
+    if (bounds[middle] <= id) {
+      low = middle;
+    } else {
+      high = middle - 1;
+    }
+  }
+  return `dancers_${bounds[low]}-${bounds[low + 1]}.txt`;
+};
+
+// Each chunk file is fetched once per page, so dancers sharing a chunk share the request
+const __getChunk = (file) => __loadArtifact("assets/chunks/"+file);
+
+const __monthToDate = (month) => {
+  const monthOfYear = String(month % 12 + 1).padStart(2, '0');
+  return `${Math.floor(month / 12)}-${monthOfYear}-01`;
+};
+
+// Expands a version 2 chunk dancer, see points/chunk_writer.py for the format
+const __decodeChunkDancer = (chunk, chunkIndex, encodedDancer) => {
+  const [id, name, primaryRole, divisions, placements] = encodedDancer;
+  return {
+    id: id,
+    primary_role: chunkIndex.roles[primaryRole],
+    name: name,
+    placements: placements.map(([event, month, division, role, result, points]) => ({
+      role: chunkIndex.roles[role],
+      result: result,
+      points: points,
+      event: {
+        id: chunk.events[event][0],
+        name: chunk.events[event][1],
+        location: chunk.events[event][2],
+      },
+      date: __monthToDate(month),
+      division: chunkIndex.divisions[division],
+    })),
+    divisions: Object.fromEntries(divisions.map(([role, roleDivisions]) => [
+      chunkIndex.roles[role],
+      roleDivisions.map(division => chunkIndex.divisions[division]),
+    ])),
+  };
 };
 
 const getDancer = async (id) => {
-  const bottom = Math.floor(id / DANCER_CHUNK_SIZE) * DANCER_CHUNK_SIZE;
-  const top = bottom + DANCER_CHUNK_SIZE;
-  const file = `dancers_${bottom}-${top}.txt`;
-  const response = await fetch("assets/chunks/"+file);
-  const dancers = (await MessagePack.decodeAsync(response.body)).dancers;
-  return dancers.find(dancer => dancer.id === id);
+  const chunkIndex = await getChunkIndex();
+  const file = __findChunkFile(chunkIndex.bounds, id);
+  if (file === null) {
+    return undefined;
+  }
+  const chunk = await __getChunk(file);
+  const encodedDancer = chunk.dancers.find(dancer => dancer[0] === id);
+  if (encodedDancer === undefined) {
+    return undefined;
+  }
+  return __decodeChunkDancer(chunk, chunkIndex, encodedDancer);
 };
 
 const __getLocalStore = () => {
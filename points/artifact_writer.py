@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+
+ARTIFACT_ROOT = ".."
+ARTIFACT_MANIFEST_FILE = "assets/manifest.json"
+
+def content_hash(data: bytes):
+  return hashlib.sha256(data).hexdigest()[:16]
+
+def remove_if_exists(path: str):
+  if os.path.exists(path):
+    os.remove(path)
+
+class ArtifactFile:
+  # Streams to a temporary file while hashing, then either replaces the artifact or, when the
+  # bytes match the manifest, throws the temporary file away so the artifact is never touched
+  def __init__(self, artifacts, relative_path: str):
+    self.artifacts = artifacts
+    self.relative_path = relative_path
+    self.temporary_path = artifacts.path(relative_path) + ".tmp"
+    self.file = open(self.temporary_path, 'wb')
+    self.hash = hashlib.sha256()
+
+  def write(self, data: bytes):
+    self.hash.update(data)
+    self.file.write(data)
+
+  def close(self):
+    self.file.close()
+    self.artifacts._commit(self.relative_path, self.hash.hexdigest()[:16], self.temporary_path)
+
+  def discard(self):
+    # Leaves the artifact as it was, for a build that failed before the file was finished
+    self.file.close()
+    remove_if_exists(self.temporary_path)
+
+class ArtifactWriter:
+  # Every build artifact goes through here. manifest.json maps each artifact's path, relative to
+  # the site root, to a hash of its bytes; it is published with the site for service-worker.js.
+  def __init__(self, root: str = ARTIFACT_ROOT, manifest_file: str = ARTIFACT_MANIFEST_FILE):
+    self.root = root
+    self.manifest_file = manifest_file
+    self.previous_files = {}
+    if os.path.exists(self.path(manifest_file)):
+      with open(self.path(manifest_file), "r") as f:
+        self.previous_files = json.load(f)["files"]
+    self.files = {}
+    self.open_files = {} # temporary path: ArtifactFile
+    self.lock = threading.Lock()
+    self.written = 0
+    self.unchanged = 0
+    self.removed = 0
+
+  def path(self, relative_path: str):
+    return os.path.join(self.root, relative_path)
+
+  def _is_unchanged(self, relative_path: str, h: str):
+    return self.previous_files.get(relative_path) == h and os.path.exists(self.path(relative_path))
+
+  def _commit(self, relative_path: str, h: str, temporary_path: str):
+    with self.lock:
+      self.open_files.pop(temporary_path, None)
+      self.files[relative_path] = h
+      if self._is_unchanged(relative_path, h):
+        os.remove(temporary_path)
+        self.unchanged += 1
+      else:
+        os.replace(temporary_path, self.path(relative_path))
+        self.written += 1
+
+  def open(self, relative_path: str):
+    artifact_file = ArtifactFile(self, relative_path)
+    with self.lock:
+      self.open_files[artifact_file.temporary_path] = artifact_file
+    return artifact_file
+
+  def write_bytes(self, relative_path: str, data: bytes):
+    h = content_hash(data)
+    with self.lock:
+      self.files[relative_path] = h
+      if self._is_unchanged(relative_path, h):
+        self.unchanged += 1
+        return False
+    # Written beside the artifact and moved over it, so a failed write never leaves half a file
+    temporary_path = self.path(relative_path) + ".tmp"
+    try:
+      with open(temporary_path, 'wb') as f:
+        f.write(data)
+      os.replace(temporary_path, self.path(relative_path))
+    except BaseException:
+      remove_if_exists(temporary_path)
+      raise
+    with self.lock:
+      self.written += 1
+    return True
+
+  def remove(self, relative_path: str):
+    # Deletes an artifact that this build did not write, if it is there
+    if relative_path not in self.files and os.path.exists(self.path(relative_path)):
+      os.remove(self.path(relative_path))
+      self.removed += 1
+
+  def remove_orphans(self, relative_directory: str):
+    # Deletes files in the directory that this build did not write
+    for name in os.listdir(self.path(relative_directory)):
+      self.remove("{}/{}".format(relative_directory, name))
+
+  def discard(self):
+    # Removes the temporary files of artifacts that were opened but never closed. The manifest is
+    # not written, so it still describes the previous build.
+    with self.lock:
+      for artifact_file in self.open_files.values():
+        artifact_file.discard()
+      self.open_files.clear()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    # close is left to the build, which reports the counts; a failed build only cleans up
+    if exc_type is not None:
+      self.discard()
+    return False
+
+  def close(self):
+    # Artifacts the previous build wrote and this one didn't are removed wherever they are
+    for relative_path in self.previous_files:
+      self.remove(relative_path)
+    manifest = {
+      "version": content_hash(json.dumps(self.files, sort_keys=True).encode('utf-8')),
+      "files": dict(sorted(self.files.items())),
+    }
+    manifest_json = json.dumps(manifest, indent=0)
+    previous_json = None
+    if os.path.exists(self.path(self.manifest_file)):
+      with open(self.path(self.manifest_file), 'r') as f:
+        previous_json = f.read()
+    if previous_json != manifest_json:
+      with open(self.path(self.manifest_file), 'w') as f:
+        f.write(manifest_json)
+    print("Wrote {} artifacts, {} unchanged, {} orphans removed".format(self.written, self.unchanged, self.removed))
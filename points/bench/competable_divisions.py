@@ -0,0 +1,222 @@
+# Checks CompetableDivisionRules against the if/elif functions fetch.py used before it, for every
+# combination of points around the limits and for every dancer, then times both, on their own and
+# inside derive_dancer. The dancers are from the raw store, or a synthetic corpus from
+# bench/corpus.py when there is none, so the checks run on a fresh checkout. --check only checks.
+# Each timing is the best of RUNS, with a new CompetableDivisionRules, so an empty memo, every run.
+# Run from points/: python -m bench.competable_divisions [--check] [--dancers 20000]
+import argparse
+import itertools
+import os
+import random
+from raw_store import RawResponseStore, RAW_STORE_FILE
+from competable_divisions import CompetableDivisionRules
+from bench.corpus import generate_corpus
+import fetch
+from bench.placement_query import best_of
+from fetch import SKILL_DIVISION_PROGRESSION, SKILL_DIVISION_LIMITS, CHAMPIONS, ALLSTARS, ADVANCED, INTERMEDIATE, NOVICE, NEWCOMER, LEADER, FOLLOWER, ROLES_MAP_INVERTED
+
+RUNS = 5
+
+# The functions fetch.py used before CompetableDivisionRules, kept as the reference
+def getSecondaryRoleCompetableDivisions(role_id, placements, primary_role_competable_divisons):
+  points_per_division = {}
+  for division in SKILL_DIVISION_PROGRESSION:
+    points_per_division[division] = 0
+  for placement in placements:
+    if placement["role"] != role_id:
+      continue
+    if placement["division"] not in points_per_division:
+      points_per_division[placement["division"]] = 0
+    points_per_division[placement["division"]] += placement["points"]
+  competableDivisions = []
+
+  highest_primary_role_division = primary_role_competable_divisons[0]
+  for division in SKILL_DIVISION_PROGRESSION:
+    if division in primary_role_competable_divisons:
+      highest_primary_role_division = division
+  
+  division_index = SKILL_DIVISION_PROGRESSION.index(highest_primary_role_division)
+  two_down = None
+  one_down = None
+  zero_down = highest_primary_role_division
+  if (division_index - 2) >= 0:
+    two_down = SKILL_DIVISION_PROGRESSION[division_index - 2]
+  if (division_index - 1) >= 0:
+    one_down = SKILL_DIVISION_PROGRESSION[division_index - 1]
+
+  # zero down
+  if points_per_division[zero_down] >= SKILL_DIVISION_LIMITS[zero_down][2] or one_down is None or points_per_division[one_down] >= SKILL_DIVISION_LIMITS[one_down][1]:
+    competableDivisions.append(zero_down)
+
+  # one down
+  if points_per_division[zero_down] < SKILL_DIVISION_LIMITS[zero_down][2]:
+    if one_down is not None and points_per_division[one_down] < SKILL_DIVISION_LIMITS[one_down][1]:
+      competableDivisions.append(one_down)
+
+  # two down
+  if (points_per_division[one_down] < SKILL_DIVISION_LIMITS[one_down][2]) and (points_per_division[zero_down] < SKILL_DIVISION_LIMITS[zero_down][2]):
+    if two_down is not None and points_per_division[two_down] < SKILL_DIVISION_LIMITS[two_down][0]:
+      competableDivisions.append(two_down)
+
+  return competableDivisions
+
+def getCompetableDivisions(role_id, placements, primary_role_competable_divisons = None):
+  is_primary_role = primary_role_competable_divisons is None
+  if not is_primary_role:
+    return getSecondaryRoleCompetableDivisions(role_id, placements, primary_role_competable_divisons)
+  points_per_division = {}
+  for placement in placements:
+    if placement["role"] != role_id:
+      continue
+    if placement["division"] not in points_per_division:
+      points_per_division[placement["division"]] = 0
+    points_per_division[placement["division"]] += placement["points"]
+  competableDivisions = []
+
+  if CHAMPIONS in points_per_division:
+    competableDivisions.append(CHAMPIONS)
+    if points_per_division[CHAMPIONS] < SKILL_DIVISION_LIMITS[CHAMPIONS][1]:
+      competableDivisions.append(ALLSTARS)
+
+  elif ALLSTARS in points_per_division:
+    if points_per_division[ALLSTARS] >= SKILL_DIVISION_LIMITS[ALLSTARS][0]:
+      competableDivisions.append(CHAMPIONS)
+    if points_per_division[ALLSTARS] < SKILL_DIVISION_LIMITS[ALLSTARS][1]:
+      competableDivisions.append(ALLSTARS)
+
+  elif ADVANCED in points_per_division:
+    if points_per_division[ADVANCED] >= SKILL_DIVISION_LIMITS[ADVANCED][0]:
+      competableDivisions.append(ALLSTARS)
+    if points_per_division[ADVANCED] < SKILL_DIVISION_LIMITS[ADVANCED][1]:
+      competableDivisions.append(ADVANCED)
+
+  elif INTERMEDIATE in points_per_division:
+    if points_per_division[INTERMEDIATE] >= SKILL_DIVISION_LIMITS[INTERMEDIATE][0]:
+      competableDivisions.append(ADVANCED)
+    if points_per_division[INTERMEDIATE] < SKILL_DIVISION_LIMITS[INTERMEDIATE][1]:
+      competableDivisions.append(INTERMEDIATE)
+
+  elif NOVICE in points_per_division:
+    if points_per_division[NOVICE] >= SKILL_DIVISION_LIMITS[NOVICE][0]:
+      competableDivisions.append(INTERMEDIATE)
+    if points_per_division[NOVICE] < SKILL_DIVISION_LIMITS[NOVICE][1]:
+      competableDivisions.append(NOVICE)
+
+  elif NEWCOMER in points_per_division:
+    competableDivisions.append(NOVICE)
+
+  else:
+    competableDivisions.append(NOVICE)
+    competableDivisions.append(NEWCOMER)
+
+  return competableDivisions
+
+def placements_for(role, points):
+  # Placements giving role the points tuple, None leaving a division without a placement
+  return [{"role": role, "division": division, "points": p} for (division, p) in zip(SKILL_DIVISION_PROGRESSION, points) if p is not None]
+
+def expected_divisions(primary_role, secondary_roles, placements):
+  divisions = {primary_role: getCompetableDivisions(primary_role, placements)}
+  for role in secondary_roles:
+    divisions[role] = getCompetableDivisions(role, placements, divisions[primary_role])
+  return divisions
+
+def check_every_combination(rules):
+  # Points either side of every limit reach every range of every table, lower divisions than the
+  # highest one are filled in at random as they only count for the secondary role
+  values = sorted(set(v for limits in SKILL_DIVISION_LIMITS.values() for limit in limits for v in (limit - 1, limit, limit + 1) if v >= 0) | {0, 500})
+  random.seed(0)
+  checked = 0
+  primary_points = [fetch.COMPETABLE_DIVISIONS.no_points]
+  for highest in range(len(SKILL_DIVISION_PROGRESSION)):
+    for value in values:
+      lower = tuple(random.choice([None] + values) for _ in range(highest))
+      primary_points.append(lower + (value,) + (None,) * (len(SKILL_DIVISION_PROGRESSION) - highest - 1))
+  for points in primary_points:
+    expected = getCompetableDivisions(LEADER, placements_for(LEADER, points))
+    assert list(rules.primary(points)) == expected, "Primary differs for {}".format(points)
+    checked += 1
+  for primary in set(rules.primary(points) for points in primary_points):
+    i = max(SKILL_DIVISION_PROGRESSION.index(d) for d in primary)
+    for (zero, one, two) in itertools.product([None] + values, repeat=3):
+      points = [random.choice([None] + values) for _ in SKILL_DIVISION_PROGRESSION]
+      for (down, p) in enumerate([zero, one, two]):
+        if i - down >= 0:
+          points[i - down] = p
+      points = tuple(points)
+      expected = getCompetableDivisions(FOLLOWER, placements_for(FOLLOWER, points), list(primary))
+      assert list(rules.secondary(points, primary)) == expected, "Secondary differs for {} {}".format(points, primary)
+      checked += 1
+  return checked
+
+def raw_population(dancers: int):
+  # Raw responses from the raw store, or a synthetic corpus of dancers when it is missing or empty
+  if os.path.exists(RAW_STORE_FILE):
+    store = RawResponseStore(RAW_STORE_FILE)
+    raw = [datum for (_, datum) in store.items()]
+    store.close()
+    if len(raw) > 0:
+      return raw
+  print("No raw store, using {} synthetic dancers".format(dancers))
+  return [datum for (_, datum) in generate_corpus(dancers)]
+
+def derive_dancer_with_ladder(datum):
+  # fetch.derive_dancer with the if/elif functions in place of CompetableDivisionRules
+  leader = fetch.placementsToList(datum["leader"]["placements"], datum, [])
+  follower = fetch.placementsToList(datum["follower"]["placements"], datum, [])
+  placements = leader[0] + follower[0]
+  placements.sort(key=lambda p: p["date"], reverse=True)
+  primary_role = ROLES_MAP_INVERTED[datum["short_dominate_role"]]
+  return expected_divisions(primary_role, [r for r in [LEADER, FOLLOWER] if r != primary_role], placements)
+
+def main():
+  parser = argparse.ArgumentParser(description="Check and time CompetableDivisionRules")
+  parser.add_argument("--check", action="store_true", help="only check, don't time")
+  parser.add_argument("--dancers", type=int, default=20000, help="synthetic dancers when there is no raw store")
+  args = parser.parse_args()
+
+  rules = CompetableDivisionRules(SKILL_DIVISION_PROGRESSION, SKILL_DIVISION_LIMITS)
+  print("{} point combinations match".format(check_every_combination(rules)))
+
+  raw = raw_population(args.dancers)
+  dancers = [fetch.derive_dancer(datum, [], {})[0] for datum in raw]
+  population = [(dancer["primary_role"], [r for r in [LEADER, FOLLOWER] if r != dancer["primary_role"]], dancer["placements"]) for dancer in dancers]
+  expected = [expected_divisions(*args) for args in population]
+  for (dancer_args, dancer, e) in zip(population, dancers, expected):
+    assert list(dancer["divisions"].items()) == list(e.items()), "fetch.py divisions differ for dancer {}".format(dancer["id"])
+    assert rules.divisions(*dancer_args) == e, "Divisions differ for dancer {}".format(dancer["id"])
+  print("{} dancers match".format(len(dancers)))
+  if args.check:
+    return
+
+  def timed_rules(f):
+    # f with a new CompetableDivisionRules, in fetch.py too, so each run starts with an empty memo
+    def run():
+      nonlocal rules
+      rules = fetch.COMPETABLE_DIVISIONS = CompetableDivisionRules(SKILL_DIVISION_PROGRESSION, SKILL_DIVISION_LIMITS)
+      return f()
+    return best_of(RUNS, run)
+
+  (_, ladder_seconds) = best_of(RUNS, lambda: [expected_divisions(*args) for args in population])
+  (_, rules_seconds) = timed_rules(lambda: [rules.divisions(*args) for args in population])
+  # The sums as derive_dancer collects them while it lists placements
+  sums = [rules.points_by_role(placements) for (_, _, placements) in population]
+  (_, sums_seconds) = timed_rules(lambda: [rules.divisions_for_points(primary_role, secondary_roles, points) for ((primary_role, secondary_roles, _), points) in zip(population, sums)])
+  keys = [(rules.points_tuple(points.get(primary_role)), tuple(rules.points_tuple(points.get(r)) for r in secondary_roles)) for ((primary_role, secondary_roles, _), points) in zip(population, sums)]
+  (batch, batch_seconds) = timed_rules(lambda: rules.evaluate_batch(keys))
+  for (result, e) in zip(batch, expected):
+    assert [list(result[0])] + [list(d) for d in result[1]] == list(e.values())
+
+  (_, derive_ladder_seconds) = best_of(RUNS, lambda: [derive_dancer_with_ladder(datum) for datum in raw])
+  (_, derive_seconds) = timed_rules(lambda: [fetch.derive_dancer(datum, [], {}) for datum in raw])
+
+  print("{} dancers, {} distinct keys, memo {}".format(len(dancers), len(set(keys)), rules.secondary.cache_info()))
+  print("if/elif functions from placements:     {:.3f}s".format(ladder_seconds))
+  print("CompetableDivisionRules.divisions:      {:.3f}s ({:.1f}x faster)".format(rules_seconds, ladder_seconds / rules_seconds))
+  print("divisions_for_points from summed points: {:.3f}s ({:.1f}x faster)".format(sums_seconds, ladder_seconds / sums_seconds))
+  print("evaluate_batch from points tuples:      {:.3f}s ({:.1f}x faster)".format(batch_seconds, ladder_seconds / batch_seconds))
+  print("derive_dancer with if/elif functions:   {:.3f}s".format(derive_ladder_seconds))
+  print("derive_dancer:                          {:.3f}s ({:.1f}x faster)".format(derive_seconds, derive_ladder_seconds / derive_seconds))
+
+if __name__ == "__main__":
+  main()
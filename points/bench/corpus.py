@@ -0,0 +1,121 @@
+# Synthetic raw WSDC responses, shaped like the ones the crawler stores: a primary role, leader
+# and follower placements under "West Coast Swing" by division, each competition with a role,
+# result, points and an event with a "Month YYYY" date. Dancers mostly work their way up the skill
+# divisions, with a few placements in the other divisions and the other role. The same seed and
+# size always give the same corpus, so a benchmark can stream it twice instead of keeping it.
+import bisect
+import itertools
+import random
+import zlib
+
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+SKILL_DIVISIONS = [("NEW", "Newcomer"), ("NOV", "Novice"), ("INT", "Intermediate"), ("ADV", "Advanced"), ("ALL", "All-Stars"), ("CHA", "Champions")]
+OTHER_DIVISIONS = [("MAS", "Masters"), ("SOP", "Sophisticated"), ("JUN", "Juniors"), ("INV", "Invitational"), ("PRO", "Professional"), ("TEA", "Teacher")]
+# Points for 1st to 5th place by tier, finalists get 1 from tier 2 up
+POINTS_BY_TIER = {1: [3, 2, 1, 0, 0], 2: [6, 4, 3, 2, 1], 3: [10, 8, 6, 4, 2], 4: [15, 12, 10, 8, 6], 5: [20, 16, 14, 12, 10], 6: [25, 22, 18, 15, 12]}
+# Results in roughly the proportions of the real corpus
+RESULTS = ["F"] * 3 + ["1", "2", "3", "4", "5"]
+# Points a dancer moves up a skill division at, roughly where the real limits are
+MOVE_UP_AT = [1, 16, 30, 60, 150]
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Robin", "Jamie", "Kim", "Lee", "Maria", "José", "Zoë", "Łukasz", "Søren", "Aino"]
+LAST_NAMES = ["Smith", "Garcia", "Müller", "Nguyen", "Johansson", "Kowalski", "Dubois", "Rossi", "Tanaka", "O'Brien", "Silva", "Novák", "Virtanen", "Berg"]
+LOCATIONS = ["Phoenix, AZ", "Boston, MA, United States", "Paris, France", "Stockholm, Sweden", "Sydney, Australia", "Toronto, Canada", "Berlin, Germany", "Moscow, Russia"]
+FIRST_YEAR = 1990
+LAST_YEAR = 2026
+
+def generate_events(count: int, rng: random.Random):
+  # [{"id", "name", "location", "url", "month", "first_year", "size"}], size weights how often
+  # an event is picked
+  events = []
+  for event_id in range(1, count + 1):
+    events.append({
+      "id": event_id,
+      "name": "Synthetic Swing {}".format(event_id),
+      "location": rng.choice(LOCATIONS),
+      "url": "https://example.com/{}".format(event_id),
+      "month": rng.choice(MONTHS),
+      "first_year": rng.randint(FIRST_YEAR, LAST_YEAR - 1),
+      "size": rng.choice([1, 1, 1, 2, 3, 5, 8]),
+    })
+  return events
+
+class EventPicker:
+  # Picks an event that had started by a year, weighted by size
+  def __init__(self, events):
+    self.events = sorted(events, key=lambda e: e["first_year"])
+    self.first_years = [e["first_year"] for e in self.events]
+    self.cumulative_weights = list(itertools.accumulate(e["size"] for e in self.events))
+
+  def pick(self, rng: random.Random, year: int):
+    started = max(1, bisect.bisect_right(self.first_years, year))
+    return self.events[bisect.bisect_right(self.cumulative_weights, rng.random() * self.cumulative_weights[started - 1])]
+
+def tier_for(event_id: int, year: int, division: str, role: str, seed: int):
+  # The same event, year, division and role always has the same tier, as first places agree on it
+  return zlib.crc32("{}-{}-{}-{}-{}".format(seed, event_id, year, division, role).encode('utf-8')) % 6 + 1
+
+def competition(rng: random.Random, events: EventPicker, year: int, division: str, role: str, seed: int):
+  event = events.pick(rng, year)
+  result = rng.choice(RESULTS)
+  tier = tier_for(event["id"], year, division, role, seed)
+  points = (1 if tier > 1 else 0) if result == "F" else POINTS_BY_TIER[tier][int(result) - 1]
+  return {
+    "role": role,
+    "result": result,
+    "points": points,
+    "event": {
+      "id": event["id"],
+      "name": event["name"],
+      "location": event["location"],
+      "url": event["url"],
+      "date": "{} {}".format(event["month"], year),
+    },
+  }
+
+def role_placements(rng: random.Random, events: EventPicker, role: str, count: int, start_year: int, seed: int):
+  # {"West Coast Swing": {abbreviation: {"division", "competitions"}}} for count competitions,
+  # moving up the skill divisions as points add up, or [] for none
+  if count == 0:
+    return []
+  style = {}
+  level = rng.choice([0, 0, 1])
+  points_in_level = 0
+  year = start_year
+  for _ in range(count):
+    year = min(LAST_YEAR, year + rng.choice([0, 0, 1]))
+    if rng.random() < 0.07:
+      (abbreviation, name) = rng.choice(OTHER_DIVISIONS)
+    else:
+      (abbreviation, name) = SKILL_DIVISIONS[level]
+    c = competition(rng, events, year, name, role, seed)
+    division = style.setdefault(abbreviation, {"division": {"id": 0, "name": name, "abbreviation": abbreviation}, "competitions": []})
+    division["competitions"].append(c)
+    if (abbreviation, name) == SKILL_DIVISIONS[level]:
+      points_in_level += c["points"]
+      if level < len(MOVE_UP_AT) and points_in_level >= MOVE_UP_AT[level] and rng.random() < 0.8:
+        level += 1
+        points_in_level = 0
+  return {"West Coast Swing": style}
+
+def generate_corpus(dancers: int, seed: int = 0):
+  # Yields (str(wsdc id), raw response) for ids 1 to dancers
+  rng = random.Random(seed)
+  events = EventPicker(generate_events(max(50, dancers // 75), rng))
+  for wsdc_id in range(1, dancers + 1):
+    primary = rng.choice(["leader", "follower"])
+    secondary = "follower" if primary == "leader" else "leader"
+    start_year = rng.randint(FIRST_YEAR, LAST_YEAR)
+    primary_count = min(300, 1 + int(rng.expovariate(1 / 6)))
+    secondary_count = min(50, int(rng.expovariate(1 / 4))) if rng.random() < 0.15 else 0
+    placements = {
+      primary: role_placements(rng, events, primary, primary_count, start_year, seed),
+      secondary: role_placements(rng, events, secondary, secondary_count, start_year, seed),
+    }
+    yield (str(wsdc_id), {
+      "dancer_wsdcid": wsdc_id,
+      "dancer_first": rng.choice(FIRST_NAMES),
+      "dancer_last": rng.choice(LAST_NAMES),
+      "short_dominate_role": primary.title(),
+      "leader": {"placements": placements["leader"]},
+      "follower": {"placements": placements["follower"]},
+    })
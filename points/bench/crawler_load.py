@@ -0,0 +1,105 @@
+# Runs the dancer crawler against the local WSDC stand-in in bench/wsdc_stub.py and reports its
+# throughput, retries and whether it stored exactly the dancers the stand-in serves.
+#   full: probe_and_get_all_dancers from id 1 into an empty store, as a FETCHALL run does
+#   refresh: get_dancers_abbreviated on a store missing the newest --new dancers, as a normal run does
+# A run of unused ids just before the newest dancers, which the crawler has to slide past:
+#   python -m bench.crawler_load --mode refresh --max-id 2000 --gap 1921-1950 --new 50
+# Run from points/: python -m bench.crawler_load [--mode full] [--max-id 2000] [--latency 0.02] ...
+import argparse
+import json
+import os
+import tempfile
+import time
+from bench.wsdc_stub import StubConfig, WsdcStub, load_raw_responses, parse_gap
+from http_client import HttpClient
+from raw_store import RawResponseStore
+from refresh_scheduler import load_refresh_state
+import dancer_repository
+
+def compare(raw_response_dancers, expected):
+  # Counts of served dancers the crawl is missing, stored differently, or stored without being served
+  stored = {int(k): v for (k, v) in raw_response_dancers.items()}
+  return {
+    "expected": len(expected),
+    "stored": len(stored),
+    "missing": len([i for i in expected if i not in stored]),
+    "mismatched": len([i for i in expected if i in stored and stored[i] != expected[i]]),
+    "unexpected": len([i for i in stored if i not in expected]),
+  }
+
+def run(mode: str, stub: WsdcStub, workers: int, requests_per_second: float, new_dancers: int, budget: int):
+  expected = stub.expected()
+  client = HttpClient(pool_size=workers, requests_per_second=requests_per_second)
+  with tempfile.TemporaryDirectory() as directory:
+    # State files and the raw store go to a scratch directory instead of the working tree
+    dancer_repository.EMPTY_RANGES_FILE = os.path.join(directory, "empty_ranges.json")
+    dancer_repository.API_URL = stub.url("/lookup2020/find")
+    if mode != "full":
+      # The refresh state is kept in the raw store, so a refresh crawl starts from a scratch store
+      newest = sorted(expected)[-new_dancers:] if new_dancers > 0 else []
+      raw_response_dancers = RawResponseStore(os.path.join(directory, "raw_responses.sqlite"))
+      for (i, response) in expected.items():
+        if i not in newest:
+          raw_response_dancers[str(i)] = response
+      raw_response_dancers.commit()
+    start = time.perf_counter()
+    if mode == "full":
+      (requests_made, raw_response_dancers) = dancer_repository.probe_and_get_all_dancers(1, {}, client, workers)
+    else:
+      (requests_made, raw_response_dancers) = dancer_repository.get_dancers_abbreviated(raw_response_dancers, client, workers, load_refresh_state(raw_response_dancers), [], budget)
+    seconds = time.perf_counter() - start
+    correctness = compare(raw_response_dancers, expected)
+    if mode != "full":
+      raw_response_dancers.close()
+  return {
+    "mode": mode,
+    "workers": workers,
+    "requests_per_second_limit": requests_per_second,
+    "seconds": round(seconds, 3),
+    "requests": client.requests,
+    "requests_per_second": round(client.requests / seconds, 1),
+    "retries": client.retries,
+    "crawler_requests_made": requests_made,
+    "stub": dict(stub.stats.counts),
+    "correctness": correctness,
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description="Load test the dancer crawler against a local WSDC stand-in")
+  parser.add_argument("--mode", choices=["full", "refresh"], default="full")
+  parser.add_argument("--source", default=None, help="raw_responses.json.gz, the raw_responses/ shards or a raw store, the raw store by default")
+  parser.add_argument("--max-id", type=int, default=2000, help="only dancers up to this id are served")
+  parser.add_argument("--workers", type=int, default=dancer_repository.DEFAULT_CRAWLER_WORKERS)
+  parser.add_argument("--requests-per-second", type=float, default=0, help="the crawler's own limit, 0 for none")
+  parser.add_argument("--new", type=int, default=50, help="refresh mode: newest dancers left out of the store")
+  parser.add_argument("--budget", type=int, default=dancer_repository.DEFAULT_REFRESH_REQUEST_BUDGET)
+  parser.add_argument("--latency", type=float, default=0.02)
+  parser.add_argument("--jitter", type=float, default=0.01)
+  parser.add_argument("--error-rate", type=float, default=0)
+  parser.add_argument("--throttle", type=float, default=0)
+  parser.add_argument("--gap-rate", type=float, default=0)
+  parser.add_argument("--gap", type=parse_gap, action="append", default=[], help="START-END, ids served as unused, can be repeated")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--json", default=None, help="also write the report to this file")
+  args = parser.parse_args()
+
+  config = StubConfig(args.latency, args.jitter, args.error_rate, args.throttle, args.gap_rate, args.max_id, args.seed, args.gap)
+  stub = WsdcStub(load_raw_responses(args.source), config).start()
+  try:
+    report = run(args.mode, stub, args.workers, args.requests_per_second, args.new, args.budget)
+  finally:
+    stub.close()
+  report["stub_config"] = vars(config)
+
+  correctness = report["correctness"]
+  print("{} crawl, {} workers: {} requests in {:.2f}s, {} requests/s, {} retries".format(report["mode"], report["workers"], report["requests"], report["seconds"], report["requests_per_second"], report["retries"]))
+  print("Stand-in answered {}".format(", ".join("{} {}".format(v, k) for (k, v) in report["stub"].items() if v > 0)))
+  print("Stored {} of {} served dancers, {} missing, {} mismatched, {} unexpected".format(correctness["stored"], correctness["expected"], correctness["missing"], correctness["mismatched"], correctness["unexpected"]))
+  if args.json is not None:
+    with open(args.json, "w") as f:
+      json.dump(report, f, indent=2)
+  if correctness["missing"] > 0 or correctness["mismatched"] > 0 or correctness["unexpected"] > 0:
+    raise SystemExit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,67 @@
+# Compares the BeautifulSoup parse of the events page with the streaming table parser, on the
+# stored raw_events.html.gz, and times the cached path that only hashes the page.
+# Run from points/: python -m bench.events_page
+import datetime
+import gzip
+import hashlib
+import re
+from bs4 import BeautifulSoup
+from bench.placement_query import best_of
+from event_repository import RAW_EVENTS_RESPONSE_FILE, _parse_events
+
+RUNS = 5
+
+# The parse event_repository.py used before the streaming parser, without the geocoding, kept as
+# the reference
+def parse_events_with_beautifulsoup(html):
+  soup = BeautifulSoup(html, 'html.parser')
+  rows = soup.find("table").find_all("tr")[1:]
+  ret = []
+
+  for row in rows:
+    tds = row.find_all('td')
+    date = tds[0].get_text()
+    location = tds[2].get_text()
+    name = tds[1].find("div", class_="event_name").get_text().strip()
+    url = tds[1].find("a")['href']
+    event_type = tds[1].find("div", class_="event_type").get_text()
+
+    year = re.findall(r'\d{4}', date)[0]
+    month = re.findall('[a-zA-Z]{3}', date)[0]
+    day = re.findall(r'\d{1,2}', date)[0]
+    month = datetime.datetime.strptime(month, '%b').month
+    start_date = datetime.datetime(int(year), month, int(day)).isoformat()
+
+    year = re.findall(r'\d{4}', date)[-1]
+    month = re.findall('[a-zA-Z]{3}', date)[-1]
+    day = re.findall(r'\s(\d{1,2})[,\s]', date)[-1]
+    month = datetime.datetime.strptime(month, '%b').month
+    end_date = datetime.datetime(int(year), month, int(day)).isoformat()
+    ret.append({
+      "name": name,
+      "location": location,
+      "latitude": None,
+      "longitude": None,
+      "url": url,
+      "type": event_type,
+      "end_date": end_date,
+      "start_date": start_date
+    })
+  return ret
+
+def main():
+  with open(RAW_EVENTS_RESPONSE_FILE, "rb") as f:
+    html = gzip.decompress(f.read()).decode('utf-8')
+
+  (expected, soup_seconds) = best_of(RUNS, lambda: parse_events_with_beautifulsoup(html))
+  (events, streaming_seconds) = best_of(RUNS, lambda: _parse_events(html))
+  assert events == expected, "The streaming parser differs from BeautifulSoup"
+  (_, hash_seconds) = best_of(RUNS, lambda: hashlib.sha1(html.encode('utf-8')).hexdigest())
+
+  print("{} events in a {} KB page".format(len(events), len(html) // 1024))
+  print("BeautifulSoup:              {:.4f}s".format(soup_seconds))
+  print("Streaming table parser:     {:.4f}s ({:.1f}x faster)".format(streaming_seconds, soup_seconds / streaming_seconds))
+  print("Unchanged page, hash only:  {:.4f}s ({:.0f}x faster)".format(hash_seconds, soup_seconds / hash_seconds))
+
+if __name__ == "__main__":
+  main()
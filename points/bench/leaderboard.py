@@ -0,0 +1,100 @@
+# Compares the Leaderboard heaps with the add_recent_points dicts and full sorts they replaced,
+# for several windows, on the dancers in the raw store.
+# Run from points/: python -m bench.leaderboard
+import datetime
+import time
+from raw_store import RawResponseStore, RAW_STORE_FILE
+from derived_cache import DerivedDancerCache
+from leaderboard import Leaderboard, Leaderboards, window_start
+import fetch
+
+WINDOWS = [30, 90, 365]
+FROM_EACH_GROUP = 5
+
+# The dict accumulation and sort fetch.py used before Leaderboard, kept as the reference
+def add_recent_points(divisions, dancer, min_date):
+  # divisions is [novice/beginner/advanced][leader/follower] = {wscid: points}
+  for placement in dancer["placements"]:
+      if datetime.date.fromisoformat(placement["date"]) < min_date:
+          continue
+      _points = placement["points"]
+      _division = placement["division"]
+      _role = placement["role"]
+      if _division not in divisions:
+          divisions[_division] = {}
+      if _role not in divisions[_division]:
+          divisions[_division][_role] = {}
+      if dancer['id'] not in divisions[_division][_role]:
+          divisions[_division][_role][dancer['id']] = 0
+      divisions[_division][_role][dancer['id']] += _points
+  return divisions
+
+def get_top_dancers_by_points_gained_recently(divisions, from_each_group):
+  sorted_divisions = {}
+  for division in divisions:
+      sorted_divisions[division] = {}
+      for role in divisions[division]:
+          chunked_sorted = sorted(divisions[division][role].items(), key=lambda item: item[1], reverse=True)[0:from_each_group]
+          sorted_divisions[division][role] = {d[0]: d[1] for d in chunked_sorted}
+
+  unkeyed_by_division = []
+  for division in sorted_divisions:
+    unkeyed_division = {
+      'division': division,
+      'roles': [],
+    }
+    for role in sorted_divisions[division]:
+      unkeyed_role = {
+        'role': role,
+        'dancers': [],
+      }
+      for dancer_id in sorted_divisions[division][role]:
+        unkeyed_dancer = {
+          'points': sorted_divisions[division][role][dancer_id],
+          'wscdid': dancer_id,
+        }
+        unkeyed_role['dancers'].append(unkeyed_dancer)
+      unkeyed_role['dancers'] = sorted(unkeyed_role['dancers'], key=lambda dancer: dancer['points'], reverse=True)
+      unkeyed_division['roles'].append(unkeyed_role)
+    unkeyed_division['roles'] = sorted(unkeyed_division['roles'], key=lambda role: role['role'])
+    unkeyed_by_division.append(unkeyed_division)
+  return sorted(unkeyed_by_division, key=lambda division: fetch.DIVISIONS_IN_SORT_ORDER.index(division['division']), reverse=False)
+
+def derived_dancers():
+  # The dancers with placements the build reads, from the derived dancer cache brought up to date
+  # with the raw store the way the build does it
+  raw_response_dancers = RawResponseStore(RAW_STORE_FILE)
+  derived_cache = fetch.update_derived_cache(DerivedDancerCache(fetch.DERIVATION_RULES_VERSION), raw_response_dancers)
+  raw_response_dancers.close()
+  dancers = [dancer for dancer in derived_cache.dancers() if len(dancer["placements"]) > 0]
+  derived_cache.close()
+  return dancers
+
+def main():
+  dancers = derived_dancers()
+  today = datetime.date.today()
+
+  start = time.perf_counter()
+  expected = {}
+  for days in WINDOWS:
+    recent_points = {}
+    for dancer in dancers:
+      recent_points = add_recent_points(recent_points, dancer, window_start(today, days))
+    expected[days] = get_top_dancers_by_points_gained_recently(recent_points, FROM_EACH_GROUP)
+  dict_seconds = time.perf_counter() - start
+
+  start = time.perf_counter()
+  leaderboards = Leaderboards({days: Leaderboard(window_start(today, days), FROM_EACH_GROUP) for days in WINDOWS})
+  for dancer in dancers:
+    leaderboards.add_dancer(dancer)
+  results = {days: fetch.get_top_dancers_by_points_gained_recently(leaderboards[days]) for days in WINDOWS}
+  heap_seconds = time.perf_counter() - start
+
+  for days in WINDOWS:
+    assert results[days] == expected[days], "Leaderboard differs for the {} day window".format(days)
+  print("{} dancers, windows of {} days".format(len(dancers), ", ".join(str(days) for days in WINDOWS)))
+  print("add_recent_points, one pass per window: {:.3f}s".format(dict_seconds))
+  print("Leaderboards, one pass:                 {:.3f}s ({:.1f}x faster)".format(heap_seconds, dict_seconds / heap_seconds))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,204 @@
+# Times each stage of the fetch.py build on synthetic corpora from bench/corpus.py, by default of
+# 10k, 50k and 200k dancers, and reports how each stage's cost per dancer grows with the corpus.
+# --output saves the results as JSON, --baseline compares against saved results and exits
+# non-zero when a stage is more than --threshold slower.
+# Run from points/: python -m bench.pipeline [--sizes 10000 50000] [--output new.json] [--baseline old.json]
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+from artifact_writer import ArtifactWriter
+from chunk_writer import ChunkWriter
+from competable_divisions import CompetableDivisionRules
+from derived_cache import DerivedDancerCache
+from leaderboard import Leaderboard, Leaderboards, window_start
+from page_artifacts import DatabaseJsonWriter, JEKYLL_DANCERS_LIMIT, jekyll_dancer
+from tier_index import TierIndex
+from bench.corpus import generate_corpus
+import fetch
+
+PIPELINE_BENCHMARK_FORMAT_VERSION = 2
+DEFAULT_SIZES = [10000, 50000, 200000]
+DEFAULT_THRESHOLD = 0.25 # A stage regresses when it is this much slower than the baseline
+MIN_REGRESSION_SECONDS = 0.05 # and slower by at least this much, so tiny stages don't flap
+STAGES = [
+  "placements_to_list",
+  "competable_divisions",
+  "derive_dancer",
+  "derived_cache",
+  "event_aggregation",
+  "tiers",
+  "leaderboards",
+  "division_progression",
+  "spill",
+  "serialisation",
+  "chunk_writing",
+]
+
+class NullSink:
+  # A file that only counts what is written to it
+  def __init__(self):
+    self.bytes = 0
+
+  def write(self, data: bytes):
+    self.bytes += len(data)
+
+  def close(self):
+    pass
+
+class StageTimer:
+  def __init__(self):
+    self.seconds = {stage: 0.0 for stage in STAGES}
+
+  def time(self, stage: str, f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    self.seconds[stage] += time.perf_counter() - start
+    return result
+
+def run_corpus(dancers: int, seed: int):
+  # {"dancers", "placements", "generate_seconds", "stages": {stage: seconds}} for one corpus
+  timer = StageTimer()
+  rules = CompetableDivisionRules(fetch.SKILL_DIVISION_PROGRESSION, fetch.SKILL_DIVISION_LIMITS)
+  cache_directory = tempfile.TemporaryDirectory()
+  derived_cache = DerivedDancerCache(fetch.DERIVATION_RULES_VERSION, os.path.join(cache_directory.name, "derived_dancers.sqlite"))
+  leaderboards = Leaderboards({key: Leaderboard(window_start(datetime.date.today(), days), k) for (key, (days, k)) in fetch.LEADERBOARDS.items()})
+  progression = {}
+  spilled_dancers = fetch.SpilledDancers()
+  placements = 0
+
+  # Derivation into the derived dancer cache, then the first pass of the build over the dancers, one
+  # at a time. The corpus is generated inside the same loop, and its time is taken off the total.
+  generate_seconds = 0.0
+  corpus = generate_corpus(dancers, seed)
+  while True:
+    start = time.perf_counter()
+    datum = next(corpus, None)
+    generate_seconds += time.perf_counter() - start
+    if datum is None:
+      break
+    (wsdc_id, datum) = datum
+    timer.time("placements_to_list", lambda: (fetch.placementsToList(datum["leader"]["placements"], datum, []), fetch.placementsToList(datum["follower"]["placements"], datum, [])))
+    contribution = timer.time("derive_dancer", fetch.derive_contribution, datum)
+    dancer = contribution[0]
+    timer.time("competable_divisions", rules.divisions, dancer["primary_role"], [r for r in [fetch.LEADER, fetch.FOLLOWER] if r != dancer["primary_role"]], dancer["placements"])
+    timer.time("derived_cache", derived_cache.put, wsdc_id, "", contribution)
+    if len(dancer["placements"]) == 0:
+      continue
+    placements += len(dancer["placements"])
+    timer.time("leaderboards", leaderboards.add_dancer, dancer)
+    timer.time("spill", spilled_dancers.add, dancer)
+
+  timer.time("derived_cache", derived_cache.commit)
+  events = timer.time("event_aggregation", derived_cache.events)
+  timer.time("event_aggregation", derived_cache.new_dancers_by_date)
+  tier_index = TierIndex()
+  timer.time("tiers", lambda: tier_index.add_entries(derived_cache.first_place_points()))
+  events = timer.time("tiers", tier_index.annotate, events, fetch.DIVISIONS_MAP, fetch.ROLES_MAP)
+  timer.time("division_progression", lambda: fetch.add_division_progression(progression, derived_cache.division_progression_counts()))
+  derived_cache.close()
+  cache_directory.cleanup()
+  for key in fetch.LEADERBOARDS:
+    timer.time("leaderboards", fetch.get_top_dancers_by_points_gained_recently, leaderboards[key])
+  timer.time("division_progression", fetch.get_division_progression, progression)
+
+  # The jekyll json, highest id first, with only the newest dancers
+  json_writer = DatabaseJsonWriter(NullSink(), {"dancers": []})
+  for dancer in spilled_dancers.iter_by_id(reverse=True):
+    if json_writer.dancers_written < JEKYLL_DANCERS_LIMIT:
+      timer.time("serialisation", json_writer.write_dancer, jekyll_dancer(dancer))
+  timer.time("serialisation", json_writer.close)
+
+  # Chunks, lowest id first, into a scratch site root
+  with tempfile.TemporaryDirectory() as root:
+    os.makedirs(os.path.join(root, "assets", "chunks"))
+    artifacts = ArtifactWriter(root, "assets/manifest.json")
+    chunk_writer = ChunkWriter(events, fetch.ROLES_MAP, fetch.DIVISIONS_MAP, artifacts, "assets/chunks", "assets/chunk_index.txt")
+    for dancer in spilled_dancers.iter_by_id():
+      timer.time("chunk_writing", chunk_writer.write_dancer, dancer)
+    timer.time("chunk_writing", chunk_writer.close)
+  spilled_dancers.close()
+
+  return {
+    "dancers": dancers,
+    "placements": placements,
+    "events": len(events),
+    "generate_seconds": round(generate_seconds, 4),
+    "stages": {stage: round(seconds, 4) for (stage, seconds) in timer.seconds.items()},
+  }
+
+def scaling(results):
+  # {stage: microseconds per dancer at each size, smallest first}
+  sizes = sorted(results, key=int)
+  return {stage: [round(results[size]["stages"][stage] / int(size) * 1e6, 2) for size in sizes] for stage in STAGES}
+
+def regressions(results, baseline, threshold: float):
+  # [(size, stage, baseline seconds, seconds)] for stages more than threshold slower than the baseline
+  found = []
+  for (size, result) in results.items():
+    if size not in baseline["results"]:
+      continue
+    for stage in STAGES:
+      before = baseline["results"][size]["stages"].get(stage)
+      after = result["stages"][stage]
+      if before is not None and after > before * (1 + threshold) and after - before >= MIN_REGRESSION_SECONDS:
+        found.append((size, stage, before, after))
+  return found
+
+def main():
+  parser = argparse.ArgumentParser(description="Time each build stage on synthetic corpora")
+  parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--output", default=None, help="write the results to this JSON file")
+  parser.add_argument("--baseline", default=None, help="compare with results saved by an earlier --output")
+  parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+  args = parser.parse_args()
+
+  results = {}
+  for size in args.sizes:
+    start = time.perf_counter()
+    results[str(size)] = run_corpus(size, args.seed)
+    print("{} dancers, {} placements: {:.1f}s".format(size, results[str(size)]["placements"], time.perf_counter() - start))
+
+  sizes = sorted(results, key=int)
+  print("\n{:<22}".format("seconds") + "".join("{:>12}".format(size) for size in sizes))
+  for stage in STAGES:
+    print("{:<22}".format(stage) + "".join("{:>12.3f}".format(results[size]["stages"][stage]) for size in sizes))
+  per_dancer = scaling(results)
+  print("\n{:<22}".format("us per dancer") + "".join("{:>12}".format(size) for size in sizes) + "{:>12}".format("growth"))
+  for stage in STAGES:
+    growth = per_dancer[stage][-1] / per_dancer[stage][0] if per_dancer[stage][0] > 0 else 1.0
+    flag = "  grows faster than the corpus" if len(sizes) > 1 and growth > 1 + args.threshold else ""
+    print("{:<22}".format(stage) + "".join("{:>12.2f}".format(v) for v in per_dancer[stage]) + "{:>11.2f}x{}".format(growth, flag))
+  print("Peak memory: {} MB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+
+  report = {
+    "version": PIPELINE_BENCHMARK_FORMAT_VERSION,
+    "created": datetime.datetime.now().isoformat(),
+    "python": platform.python_version(),
+    "machine": platform.machine(),
+    "cpus": os.cpu_count(),
+    "seed": args.seed,
+    "results": results,
+    "us_per_dancer": per_dancer,
+  }
+  if args.output is not None:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+
+  if args.baseline is not None:
+    with open(args.baseline, "r") as f:
+      baseline = json.load(f)
+    found = regressions(results, baseline, args.threshold)
+    for (size, stage, before, after) in found:
+      print("Regression: {} at {} dancers took {:.3f}s, {:.3f}s in the baseline ({:+.0%})".format(stage, size, after, before, after / before - 1))
+    if len(found) > 0:
+      raise SystemExit(1)
+    print("No stage more than {:.0%} slower than the baseline".format(args.threshold))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,49 @@
+# Compares the placement dict walk in add_recent_points with the same aggregate over the
+# columnar placement table, on the dancers in the raw store. Each side reports its best of RUNS.
+# Run from points/: python -m bench.placement_query
+import datetime
+import tempfile
+import time
+from placement_table import PlacementTableWriter, date_to_ordinal
+from placement_query import PlacementQuery
+from bench.leaderboard import add_recent_points, derived_dancers
+
+RUNS = 5
+
+def best_of(runs, f):
+  best = None
+  for _ in range(runs):
+    start = time.perf_counter()
+    result = f()
+    seconds = time.perf_counter() - start
+    best = seconds if best is None else min(best, seconds)
+  return (result, best)
+
+def main():
+  dancers = derived_dancers()
+  dancers.sort(key=lambda d: d["id"])
+  min_date = datetime.date(2023, 1, 1)
+
+  def walk_dicts():
+    recent_points = {}
+    for dancer in dancers:
+      recent_points = add_recent_points(recent_points, dancer, min_date)
+    return recent_points
+  (recent_points, dict_seconds) = best_of(RUNS, walk_dicts)
+
+  with tempfile.TemporaryDirectory() as directory:
+    writer = PlacementTableWriter(directory)
+    for dancer in dancers:
+      writer.add_dancer(dancer)
+    writer.close()
+    query = PlacementQuery.load(directory)
+    (totals, columnar_seconds) = best_of(RUNS, lambda: query.between("date", low=date_to_ordinal(min_date.isoformat())).group_sum_dict(["division", "role", "dancer_id"], "points"))
+
+  expected = {(division, role, dancer_id): points for (division, roles) in recent_points.items() for (role, dancer_points) in roles.items() for (dancer_id, points) in dancer_points.items()}
+  assert totals == expected, "Columnar recent points differ from add_recent_points"
+  print("{} placements, {} recent (division, role, dancer) groups".format(len(query), len(totals)))
+  print("add_recent_points: {:.3f}s".format(dict_seconds))
+  print("PlacementQuery:    {:.3f}s ({:.0f}x faster)".format(columnar_seconds, dict_seconds / columnar_seconds))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,182 @@
+# Checks SearchIndexReader on an index of a few fixed dancers: accent folding, prefixes, one
+# character words and id lookups, with searchDancers and __foldSearchText from assets/js/index.js
+# run under node on the same index and text. Then checks it against a scan over every dancer's
+# name and times both, on the search index written by the last build and the derived dancers.
+# --check only runs the checks on the fixed dancers, which need no build. The JS checks are
+# skipped when node is not installed.
+# Run from points/: python -m bench.search_index [--check]
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from artifact_writer import ArtifactWriter
+from search_index import SearchIndexReader, SearchIndexWriter, dancer_tokens, fold, tokenize, SEARCH_RESULT_LIMIT
+from bench.leaderboard import derived_dancers
+
+QUERIES = ["jo", "john", "mar", "maria s", "sa", "lopez", "zo", "Ørjan", "jose", "1000", "2", "kyle r", "xx", "cé"]
+
+CHECK_DANCERS = [
+  (1234, "Marie Strauß"),
+  (1000, "Kyle Rivers"),
+  (12, "Zoë Ørjansen"),
+  (9, "José Álvarez"),
+  (8, "Jo Smith"),
+  (7, "Łukasz Nowak"),
+  (5, "Mary-Ann O'Brien"),
+  (3, "Joseph Kim"),
+  (2, "Anne Æsir"),
+]
+
+# (query, ids of the expected results in order)
+CHECK_CASES = [
+  # Accents and letters NFKD leaves alone fold on both sides
+  ("jose", [9, 3]), # and Joseph
+  ("JOSÉ", [9, 3]),
+  ("alvarez", [9]),
+  ("orjansen", [12]),
+  ("Ørjan", [12]),
+  ("zoe", [12]),
+  ("strauss", [1234]),
+  ("Łukasz", [7]),
+  ("aesir", [2]),
+  # Every name word starting with the query word, highest id first
+  ("jo", [9, 8, 3]),
+  ("ma", [1234, 5]),
+  ("mary ann", [5]),
+  ("mary-ann", [5]),
+  # One character words narrow down longer words, and alone are looked up in their own shard
+  ("j", [9, 8, 3]),
+  ("1", [1234, 1000, 12]),
+  ("j s", [8]),
+  ("m o", [5]),
+  ("jo s", [8]),
+  ("k jo", [3]),
+  ("o'brien", [5]),
+  # Ids are tokens too
+  ("1000", [1000]),
+  ("12", [1234, 12]),
+  ("kyle 1000", [1000]),
+  ("9", [9]),
+  ("2", [2]),
+  # Nothing matches
+  ("xyz", []),
+  ("jo xyz", []),
+  ("", []),
+]
+CHECK_LIMIT = ("jo", 2, [9, 8])
+
+# Text for the fold and tokenize parity check beyond the dancers' names
+FOLD_TEXTS = ["İstanbul", "ﬁnn", "１２３", "ΟΔΟΣ", "Ångström", "Dvořák", "Nguyễn", "Þór", "Đorđe", "Œuvre", "  two  spaces ", "o'neil-smith"]
+
+# Loads msgpack and index.js into a node context, with fetch reading the artifacts from disk
+NODE_CHECK = """
+const fs = require("fs");
+const path = require("path");
+const vm = require("vm");
+const input = JSON.parse(fs.readFileSync(0, "utf8"));
+const context = vm.createContext({
+  fetch: async (artifact) => ({ body: new Blob([fs.readFileSync(path.join(input.root, artifact))]).stream() }),
+  TextEncoder,
+  TextDecoder,
+});
+vm.runInContext(fs.readFileSync(input.msgpack, "utf8"), context);
+vm.runInContext(fs.readFileSync(input.index, "utf8"), context);
+context.input = input;
+vm.runInContext(`(async () => ({
+  folded: input.texts.map(__foldSearchText),
+  tokens: input.texts.map(__searchTokens),
+  results: await Promise.all(input.queries.map(([query, limit]) => searchDancers(query, limit))),
+}))()`, context).then(output => console.log(JSON.stringify(output)));
+"""
+
+def scan(dancers, query):
+  query_tokens = tokenize(query)
+  if len(query_tokens) == 0:
+    return []
+  results = []
+  for (dancer_id, name) in dancers:
+    tokens = dancer_tokens(dancer_id, name)
+    if all(any(t.startswith(q) for t in tokens) for q in query_tokens):
+      results.append((dancer_id, name))
+      if len(results) >= SEARCH_RESULT_LIMIT:
+        break
+  return results
+
+def write_check_index(root: str):
+  artifacts = ArtifactWriter(root)
+  writer = SearchIndexWriter(artifacts, "assets/search")
+  for (dancer_id, name) in CHECK_DANCERS:
+    writer.add_dancer({"id": dancer_id, "name": name})
+  writer.close()
+
+def check_reader(reader):
+  names = dict(CHECK_DANCERS)
+  for (query, ids) in CHECK_CASES:
+    expected = [(dancer_id, names[dancer_id]) for dancer_id in ids]
+    assert reader.search(query) == expected, "Search results for {!r} are {}, not {}".format(query, reader.search(query), expected)
+    assert scan(CHECK_DANCERS, query) == expected, "A scan for {!r} doesn't match the expected results".format(query)
+  (query, limit, ids) = CHECK_LIMIT
+  assert [dancer_id for (dancer_id, _) in reader.search(query, limit)] == ids, "The limit isn't applied to {!r}".format(query)
+  print("{} search cases match".format(len(CHECK_CASES) + 1))
+
+def check_javascript(root: str, reader):
+  # The same folding, tokens and search results from index.js as from search_index.py
+  if shutil.which("node") is None:
+    print("node is not installed, skipping the index.js checks")
+    return
+  texts = [name for (_, name) in CHECK_DANCERS] + FOLD_TEXTS + [query for (query, _) in CHECK_CASES]
+  queries = [[query, SEARCH_RESULT_LIMIT] for (query, _) in CHECK_CASES] + [[CHECK_LIMIT[0], CHECK_LIMIT[1]]]
+  output = subprocess.run(["node", "-e", NODE_CHECK], input=json.dumps({
+    "root": root,
+    "msgpack": "../lib/msgpack.min.js",
+    "index": "../assets/js/index.js",
+    "texts": texts,
+    "queries": queries,
+  }), capture_output=True, text=True, check=True).stdout
+  javascript = json.loads(output)
+  for (text, folded, tokens) in zip(texts, javascript["folded"], javascript["tokens"]):
+    assert folded == fold(text), "__foldSearchText({!r}) is {!r}, fold gives {!r}".format(text, folded, fold(text))
+    assert tokens == tokenize(text), "__searchTokens({!r}) is {}, tokenize gives {}".format(text, tokens, tokenize(text))
+  for ((query, limit), results) in zip(queries, javascript["results"]):
+    expected = [[dancer_id, name] for (dancer_id, name) in reader.search(query, limit)]
+    assert results == expected, "searchDancers({!r}) is {}, SearchIndexReader gives {}".format(query, results, expected)
+  print("index.js folds {} texts and answers {} queries the same".format(len(texts), len(queries)))
+
+def check():
+  with tempfile.TemporaryDirectory() as root:
+    write_check_index(root)
+    reader = SearchIndexReader(os.path.join(root, "assets/search"))
+    check_reader(reader)
+    check_javascript(root, reader)
+
+def main():
+  parser = argparse.ArgumentParser(description="Check and time the dancer search index")
+  parser.add_argument("--check", action="store_true", help="only check the fixed dancers, don't time")
+  args = parser.parse_args()
+
+  check()
+  if args.check:
+    return
+
+  # Highest id first, the order the index returns results in
+  dancers = sorted(((d["id"], d["name"]) for d in derived_dancers()), reverse=True)
+  reader = SearchIndexReader("../assets/search")
+  scan_seconds = 0
+  index_seconds = 0
+  for query in QUERIES:
+    start = time.perf_counter()
+    expected = scan(dancers, query)
+    scan_seconds += time.perf_counter() - start
+    start = time.perf_counter()
+    results = reader.search(query)
+    index_seconds += time.perf_counter() - start
+    assert results == expected, "Search results differ for {!r}".format(query)
+    print("{!r}: {} results".format(query, len(results)))
+  print("Scan over {} dancers: {:.3f}s".format(len(dancers), scan_seconds))
+  print("Search index:        {:.3f}s, {} shards read".format(index_seconds, len(reader.loaded_shards)))
+
+if __name__ == "__main__":
+  main()
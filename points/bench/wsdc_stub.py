@@ -0,0 +1,218 @@
+# A local stand-in for points.worldsdc.com and the worldsdc.com events page, replaying stored
+# responses, so the crawler can be tested and tuned offline. Point the crawler at it with
+# WSDC_API_URL=http://127.0.0.1:8000/lookup2020/find and WSDC_EVENTS_URL=http://127.0.0.1:8000/events/
+# Run from points/: python -m bench.wsdc_stub [--port 8000] [--latency 0.05] [--error-rate 0.01] [--gap 1900-1949] ...
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from raw_store import RawResponseStore, read_raw_response_file, RAW_STORE_FILE
+from event_repository import RAW_EVENTS_RESPONSE_FILE
+from http_client import TokenBucket
+
+EVENTS_LAST_MODIFIED = "Thu, 01 Jan 2026 00:00:00 GMT"
+
+def load_raw_responses(path: str|None = None):
+  # {wsdc id: response} from a raw_responses.json.gz, the raw_responses/ shards or the raw store
+  if path is not None and path.endswith(".gz"):
+    return {int(k): v for (k, v) in read_raw_response_file(path).items()}
+  if path is not None and os.path.isdir(path):
+    responses = {}
+    for name in sorted(os.listdir(path)):
+      if name.endswith(".json.gz"):
+        responses.update({int(k): v for (k, v) in read_raw_response_file(os.path.join(path, name)).items()})
+    return responses
+  store = RawResponseStore(path or RAW_STORE_FILE)
+  responses = {int(k): v for (k, v) in store.items()}
+  store.close()
+  return responses
+
+class StubConfig:
+  # latency: seconds added to every response, plus up to jitter more at random
+  # error_rate: fraction of requests answered with a 500
+  # throttle: requests per second served before answering 429 with Retry-After, 0 for no limit
+  # gap_rate: fraction of stored dancers served as unused ids
+  # max_id: ids above this are unused, None for every stored dancer
+  # gaps: [(start, end)] inclusive ranges of ids served as unused, like a run of deleted ids
+  def __init__(self, latency: float = 0, jitter: float = 0, error_rate: float = 0, throttle: float = 0, gap_rate: float = 0, max_id: int|None = None, seed: int = 0, gaps = None):
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.throttle = throttle
+    self.gap_rate = gap_rate
+    self.max_id = max_id
+    self.seed = seed
+    self.gaps = gaps if gaps is not None else []
+
+  def in_gap(self, wsdc_id: int):
+    return any(start <= wsdc_id <= end for (start, end) in self.gaps)
+
+def parse_gap(text: str):
+  # "START-END" to (start, end) for --gap
+  (start, end) = [int(i) for i in text.split("-")]
+  if end < start:
+    raise ValueError("A gap ends before it starts: {}".format(text))
+  return (start, end)
+
+class StubStats:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.counts = {"requests": 0, "dancers": 0, "empty": 0, "errors": 0, "throttled": 0, "events": 0, "not_modified": 0}
+
+  def count(self, key: str):
+    with self.lock:
+      self.counts["requests"] += 1
+      self.counts[key] += 1
+
+class WsdcStub:
+  # Serves POST /lookup2020/find with form field num, and GET /events/ with ETag and
+  # Last-Modified, from a thread, until close
+  def __init__(self, responses, config: StubConfig, events_html: bytes|None = None, port: int = 0):
+    self.config = config
+    self.random = random.Random(config.seed)
+    self.random_lock = threading.Lock()
+    gaps = random.Random(config.seed)
+    self.served = {
+      wsdc_id: json.dumps(response).encode('utf-8')
+      for (wsdc_id, response) in sorted(responses.items())
+      if (config.max_id is None or wsdc_id <= config.max_id) and gaps.random() >= config.gap_rate and not config.in_gap(wsdc_id)
+    }
+    self.events_html = events_html
+    self.events_etag = '"{}"'.format(hashlib.sha1(events_html).hexdigest()) if events_html is not None else None
+    self.bucket = TokenBucket(config.throttle) if config.throttle > 0 else None
+    self.stats = StubStats()
+    self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+    self.server.daemon_threads = True
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+  def expected(self):
+    # {wsdc id: response} of every dancer the stub serves, as a crawl should store them
+    return {wsdc_id: json.loads(body) for (wsdc_id, body) in self.served.items()}
+
+  def url(self, path: str):
+    return "http://127.0.0.1:{}{}".format(self.server.server_address[1], path)
+
+  def start(self):
+    self.thread.start()
+    return self
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _roll(self):
+    with self.random_lock:
+      return (self.random.random(), self.random.random())
+
+  def _throttled(self):
+    # A non blocking take from the bucket, the stub refuses instead of waiting
+    bucket = self.bucket
+    with bucket.lock:
+      now = time.monotonic()
+      bucket.tokens = min(bucket.capacity, bucket.tokens + (now - bucket.updated_at) * bucket.rate)
+      bucket.updated_at = now
+      if bucket.tokens >= 1:
+        bucket.tokens -= 1
+        return False
+      return True
+
+  def handler(self):
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def log_message(self, format, *args):
+        pass
+
+      def reply(self, status: int, body: bytes = b"", content_type: str = "application/json", headers = {}):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for (name, value) in headers.items():
+          self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+      def delay_or_fail(self):
+        # True when the request was answered with an error or 429 instead
+        (latency_roll, error_roll) = stub._roll()
+        if stub.config.latency > 0 or stub.config.jitter > 0:
+          time.sleep(stub.config.latency + stub.config.jitter * latency_roll)
+        if stub.bucket is not None and stub._throttled():
+          stub.stats.count("throttled")
+          self.reply(429, b"", headers={"Retry-After": "1"})
+          return True
+        if error_roll < stub.config.error_rate:
+          stub.stats.count("errors")
+          self.reply(500, b"")
+          return True
+        return False
+
+      def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode('utf-8')
+        if self.path.rstrip("/") != "/lookup2020/find":
+          self.reply(404)
+          return
+        if self.delay_or_fail():
+          return
+        num = parse_qs(body).get("num", [""])[0]
+        response = stub.served.get(int(num)) if num.isdigit() else None
+        if response is None:
+          stub.stats.count("empty")
+          self.reply(200, b"[]")
+          return
+        stub.stats.count("dancers")
+        self.reply(200, response)
+
+      def do_GET(self):
+        if self.path.rstrip("/") != "/events" or stub.events_html is None:
+          self.reply(404)
+          return
+        if self.delay_or_fail():
+          return
+        if self.headers.get("If-None-Match") == stub.events_etag or self.headers.get("If-Modified-Since") == EVENTS_LAST_MODIFIED:
+          stub.stats.count("not_modified")
+          self.reply(304, headers={"ETag": stub.events_etag})
+          return
+        stub.stats.count("events")
+        self.reply(200, stub.events_html, "text/html; charset=utf-8", {"ETag": stub.events_etag, "Last-Modified": EVENTS_LAST_MODIFIED})
+
+    return Handler
+
+def load_events_html(path: str = RAW_EVENTS_RESPONSE_FILE):
+  if not os.path.exists(path):
+    return None
+  with open(path, "rb") as f:
+    return gzip.decompress(f.read())
+
+def main():
+  parser = argparse.ArgumentParser(description="Serve stored WSDC responses locally")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--source", default=None, help="raw_responses.json.gz, the raw_responses/ shards or a raw store, the raw store by default")
+  parser.add_argument("--latency", type=float, default=0)
+  parser.add_argument("--jitter", type=float, default=0)
+  parser.add_argument("--error-rate", type=float, default=0)
+  parser.add_argument("--throttle", type=float, default=0)
+  parser.add_argument("--gap-rate", type=float, default=0)
+  parser.add_argument("--max-id", type=int, default=None)
+  parser.add_argument("--gap", type=parse_gap, action="append", default=[], help="START-END, ids served as unused, can be repeated")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  config = StubConfig(args.latency, args.jitter, args.error_rate, args.throttle, args.gap_rate, args.max_id, args.seed, args.gap)
+  stub = WsdcStub(load_raw_responses(args.source), config, load_events_html(), args.port)
+  print("Serving {} dancers at {} and the events page at {}".format(len(stub.served), stub.url("/lookup2020/find"), stub.url("/events/")))
+  try:
+    stub.server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  print(json.dumps(stub.stats.counts))
+
+if __name__ == "__main__":
+  main()
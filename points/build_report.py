@@ -0,0 +1,113 @@
+import cProfile
+import datetime
+import json
+import os
+import resource
+import time
+import tracemalloc
+from http_client import HTTP_STATS
+
+BUILD_REPORT_FORMAT_VERSION = 1
+BUILD_REPORT_FILE = './build_report.json'
+BUILD_PROFILE_FILE = './build_profile_{}.prof'
+
+def get_rss_mb():
+  # Current resident memory, or None where /proc is not available
+  try:
+    with open("/proc/self/statm", "r") as f:
+      return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+  except (OSError, ValueError):
+    return None
+
+def get_peak_rss_mb(who = resource.RUSAGE_SELF):
+  # ru_maxrss is in kilobytes on Linux. For RUSAGE_CHILDREN it is the largest child, such as a
+  # derivation worker, once that child has exited.
+  return resource.getrusage(who).ru_maxrss // 1024
+
+def get_children_cpu_seconds():
+  usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+  return usage.ru_utime + usage.ru_stime
+
+class Stage:
+  # One timed step of the build. The build adds item counts to items as it goes.
+  def __init__(self, report, name: str):
+    self.report = report
+    self.name = name
+    self.items = {}
+    self.profile = None
+
+  def __enter__(self):
+    HTTP_STATS.take() # Requests made between stages aren't attributed to this one
+    if self.report.trace_memory:
+      tracemalloc.reset_peak()
+    if self.report.profile_stage == self.name:
+      self.profile = cProfile.Profile()
+      self.profile.enable()
+    self.start_wall = time.perf_counter()
+    self.start_cpu = time.process_time()
+    self.start_children_cpu = get_children_cpu_seconds()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    wall_seconds = time.perf_counter() - self.start_wall
+    cpu_seconds = time.process_time() - self.start_cpu
+    children_cpu_seconds = get_children_cpu_seconds() - self.start_children_cpu
+    if self.profile is not None:
+      self.profile.disable()
+      path = BUILD_PROFILE_FILE.format(self.name)
+      self.profile.dump_stats(path)
+      print("Wrote a profile of {} to {}".format(self.name, path))
+    result = {
+      "name": self.name,
+      "wall_seconds": round(wall_seconds, 3),
+      "cpu_seconds": round(cpu_seconds, 3),
+      "children_cpu_seconds": round(children_cpu_seconds, 3),
+      "rss_mb": get_rss_mb(),
+      "peak_rss_mb": get_peak_rss_mb(),
+      "children_peak_rss_mb": get_peak_rss_mb(resource.RUSAGE_CHILDREN),
+      "items": self.items,
+      "http": HTTP_STATS.take(),
+    }
+    if self.report.trace_memory:
+      result["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+    self.report.stages.append(result)
+    if exc_type is not None:
+      # A failed build still leaves a report of how far it got
+      result["failed"] = exc_type.__name__
+      self.report.write()
+    print("{} took {:.1f}s, {:.1f}s cpu, peak memory {} MB".format(self.name, wall_seconds, cpu_seconds + children_cpu_seconds, result["peak_rss_mb"]))
+    return False
+
+class BuildReport:
+  # Wall time, cpu time, memory, item counts and HTTP stats for each stage of a build, written as
+  # json so a slow run can be attributed to a stage after the fact. tracemalloc is only started
+  # when trace_memory is set as it slows the build down by about half again, and profile_stage
+  # names a stage to run under cProfile.
+  def __init__(self, path: str = BUILD_REPORT_FILE, trace_memory: bool = False, profile_stage: str|None = None, settings = None):
+    self.path = path
+    self.trace_memory = trace_memory
+    self.profile_stage = profile_stage
+    self.settings = {} if settings is None else settings
+    self.stages = []
+    self.started = datetime.datetime.now()
+    self.start_wall = time.perf_counter()
+    if trace_memory:
+      tracemalloc.start()
+
+  def stage(self, name: str):
+    return Stage(self, name)
+
+  def write(self):
+    report = {
+      "version": BUILD_REPORT_FORMAT_VERSION,
+      "started": self.started.isoformat(),
+      "wall_seconds": round(time.perf_counter() - self.start_wall, 3),
+      "cpu_seconds": round(time.process_time() + get_children_cpu_seconds(), 3),
+      "peak_rss_mb": get_peak_rss_mb(),
+      "children_peak_rss_mb": get_peak_rss_mb(resource.RUSAGE_CHILDREN),
+      "settings": self.settings,
+      "stages": self.stages,
+    }
+    with open(self.path, "w") as f:
+      json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,122 @@
+import msgpack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+DEFAULT_CHUNK_WRITER_WORKERS = 4
+CHUNK_FORMAT_VERSION = 2
+# A chunk is cut at the first id boundary (a multiple of CHUNK_BOUNDARY_ALIGNMENT) after it
+# reaches CHUNK_MIN_BYTES, or straight away at CHUNK_MAX_BYTES. Aligned boundaries mean a
+# dancer's record growing only moves the boundaries next to it, so most chunks keep their bytes.
+CHUNK_MIN_BYTES = 16 * 1024
+CHUNK_MAX_BYTES = 64 * 1024
+CHUNK_BOUNDARY_ALIGNMENT = 16
+
+# Chunk format version 2, decoded by getDancer in assets/js/index.js:
+# {
+#   "version": 2,
+#   "events": [[event id, name, location], ...], every event the chunk's placements refer to
+#   "dancers": [[id, name, primary role, [[role, [division, ...]], ...], placements], ...],
+# }
+# with each placement as [index into events, month, division, role, result, points].
+# Roles and divisions are ids from the chunk index, and month is year * 12 + month - 1.
+# Version 1 chunks were {"dancers": [...]} with names and a full event dict on every placement.
+#
+# The chunk index is {"version": 2, "roles": {...}, "divisions": {...}, "bounds": [0, b1, ..., bn]}
+# where chunk i holds ids from bounds[i] up to but not including bounds[i + 1] and is named
+# dancers_{bounds[i]}-{bounds[i + 1]}.txt.
+
+def date_to_month(date: str):
+  return int(date[0:4]) * 12 + int(date[5:7]) - 1
+
+class Chunk:
+  def __init__(self, start: int):
+    self.start = start
+    self.events = []
+    self.event_references = {}
+    self.dancers = []
+    self.size = 0
+
+  def to_dict(self):
+    return {"version": CHUNK_FORMAT_VERSION, "events": self.events, "dancers": self.dancers}
+
+class ChunkWriter:
+  # Packs dancers into chunks of roughly CHUNK_MIN_BYTES to CHUNK_MAX_BYTES and writes them,
+  # with the chunk index, through the ArtifactWriter, removing any other chunk files.
+  # Dancers must arrive by id, lowest first, so new dancers only ever change the last chunk.
+  # Placement events come from an id index built once, and every dancer is encoded into new
+  # lists, so nothing passed in is modified.
+  def __init__(self, events, roles, divisions, artifacts, chunks_directory: str, index_path: str, workers: int = DEFAULT_CHUNK_WRITER_WORKERS):
+    self.event_index = {e["id"]: [e["id"], e["name"], e["location"]] for e in events}
+    self.roles = roles
+    self.divisions = divisions
+    self.artifacts = artifacts
+    self.chunks_directory = chunks_directory
+    self.index_path = index_path
+    self.workers = workers
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+    self.pending = set()
+    self.bounds = [0]
+    self.chunk = Chunk(0)
+
+  def chunk_path(self, start: int, end: int):
+    return "{}/dancers_{}-{}.txt".format(self.chunks_directory, start, end)
+
+  def encode_dancer(self, chunk: Chunk, dancer):
+    placements = []
+    for placement in dancer["placements"]:
+      if placement["event"] not in chunk.event_references:
+        chunk.event_references[placement["event"]] = len(chunk.events)
+        chunk.events.append(self.event_index[placement["event"]])
+        chunk.size += len(msgpack.packb(self.event_index[placement["event"]]))
+      placements.append([
+        chunk.event_references[placement["event"]],
+        date_to_month(placement["date"]),
+        placement["division"],
+        placement["role"],
+        placement["result"],
+        placement["points"],
+      ])
+    encoded_dancer = [
+      dancer["id"],
+      dancer["name"],
+      dancer["primary_role"],
+      [[role, list(divisions)] for (role, divisions) in dancer["divisions"].items()],
+      placements,
+    ]
+    chunk.dancers.append(encoded_dancer)
+    chunk.size += len(msgpack.packb(encoded_dancer))
+
+  def _write_file(self, path, chunk: Chunk):
+    self.artifacts.write_bytes(path, msgpack.packb(chunk.to_dict()))
+
+  def _cut(self, end: int):
+    # Bounds the number of finished chunks waiting on a writer thread
+    if len(self.pending) >= self.workers * 4:
+      (done, self.pending) = wait(self.pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        future.result()
+    self.pending.add(self.executor.submit(self._write_file, self.chunk_path(self.chunk.start, end), self.chunk))
+    self.bounds.append(end)
+    self.chunk = Chunk(end)
+
+  def write_dancer(self, dancer):
+    boundary = (dancer["id"] // CHUNK_BOUNDARY_ALIGNMENT) * CHUNK_BOUNDARY_ALIGNMENT
+    if self.chunk.size >= CHUNK_MIN_BYTES and boundary > self.chunk.start and len(self.chunk.dancers) > 0 and self.chunk.dancers[-1][0] < boundary:
+      self._cut(boundary)
+    self.encode_dancer(self.chunk, dancer)
+    if self.chunk.size >= CHUNK_MAX_BYTES:
+      self._cut(dancer["id"] + 1)
+
+  def close(self):
+    if len(self.chunk.dancers) > 0:
+      self._cut(self.chunk.dancers[-1][0] + 1)
+    for future in self.pending:
+      future.result()
+    self.executor.shutdown()
+    self.artifacts.remove_orphans(self.chunks_directory)
+    self.artifacts.write_bytes(self.index_path, msgpack.packb({
+      "version": CHUNK_FORMAT_VERSION,
+      "roles": self.roles,
+      "divisions": self.divisions,
+      "bounds": self.bounds,
+    }))
+    print("Wrote {} dancer chunks".format(len(self.bounds) - 1))
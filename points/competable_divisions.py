@@ -0,0 +1,159 @@
+import bisect
+from functools import lru_cache
+
+class CompetableDivisionRules:
+  # Which skill divisions a dancer can compete in for a role, from their points in each skill
+  # division. progression is lowest division first and limits is
+  # {division: (can move up at, must move up at, secondary role stays at)}.
+  #
+  # A role's points are a tuple with an entry for each division of the progression, None where the
+  # role has no placement in it. Every rule only compares points against limits, so each rule is
+  # compiled into a table: the limits it compares against, sorted, and its result for every range
+  # between them. Results are also memoised by points tuple, since most dancers share a few.
+  def __init__(self, progression, limits):
+    self.progression = progression
+    self.limits = limits
+    self.division_index = {division: i for (i, division) in enumerate(progression)}
+    self.no_points = (None,) * len(progression)
+    self.primary_table = {i: self.compile_primary(i) for i in range(-1, len(progression))}
+    self.secondary_table = {i: self.compile_secondary(i) for i in range(len(progression))}
+    # The index of the highest division in each primary result, which picks the secondary table
+    self.highest_index = {result: max(self.division_index[division] for division in result) for (_, results) in self.primary_table.values() for result in results}
+    self.primary = lru_cache(maxsize=None)(self.evaluate_primary)
+    self.secondary = lru_cache(maxsize=None)(self.evaluate_secondary)
+
+  def primary_rule(self, i, points):
+    # Divisions for the primary role whose highest division with a placement is progression[i], or
+    # -1 for none: moving up from it at its first limit and staying in it below its second. The
+    # top division can always be danced and keeps the one below it while under its second limit,
+    # the bottom division always moves up.
+    progression = self.progression
+    if i < 0:
+      return (progression[1], progression[0])
+    division = progression[i]
+    if i == 0:
+      return (progression[1],)
+    if i == len(progression) - 1:
+      return (division,) + ((progression[i - 1],) if points < self.limits[division][1] else ())
+    (can_move_up, must_move_up, _) = self.limits[division]
+    return ((progression[i + 1],) if points >= can_move_up else ()) + ((division,) if points < must_move_up else ())
+
+  def secondary_rule(self, i, zero, one, two):
+    # Divisions for a secondary role, when the primary role's highest division is progression[i].
+    # zero, one and two are the role's points in that division and the two below it.
+    limits = self.limits
+    zero_down = self.progression[i]
+    one_down = self.progression[i - 1] if i >= 1 else None
+    two_down = self.progression[i - 2] if i >= 2 else None
+    divisions = ()
+    if zero >= limits[zero_down][2] or one_down is None or one >= limits[one_down][1]:
+      divisions += (zero_down,)
+    if zero < limits[zero_down][2] and one_down is not None and one < limits[one_down][1]:
+      divisions += (one_down,)
+    if one_down is not None and one < limits[one_down][2] and zero < limits[zero_down][2]:
+      if two_down is not None and two < limits[two_down][0]:
+        divisions += (two_down,)
+    return divisions
+
+  def compile_primary(self, i):
+    # ([limits], [result below the first limit, result from the first limit, ...])
+    thresholds = sorted(set(self.limits[self.progression[i]][:2])) if i >= 0 else []
+    return (thresholds, [self.primary_rule(i, points) for points in representatives(thresholds)])
+
+  def compile_secondary(self, i):
+    # ([[limits] for zero, one and two down], {(range of zero, range of one, range of two): result})
+    thresholds = []
+    for down in range(3):
+      if i - down >= 0:
+        thresholds.append(sorted(set(self.limits[self.progression[i - down]])))
+      else:
+        thresholds.append([])
+    table = {}
+    for (a, zero) in enumerate(representatives(thresholds[0])):
+      for (b, one) in enumerate(representatives(thresholds[1])):
+        for (c, two) in enumerate(representatives(thresholds[2])):
+          table[(a, b, c)] = self.secondary_rule(i, zero, one, two)
+    return (thresholds, table)
+
+  def points_by_role(self, placements):
+    # {role: {division: points}}, in one pass over the placements. fetch.py collects the same
+    # sums while it lists a dancer's placements.
+    sums = {}
+    for placement in placements:
+      role_sums = sums.get(placement["role"])
+      if role_sums is None:
+        role_sums = sums[placement["role"]] = {}
+      division = placement["division"]
+      role_sums[division] = role_sums.get(division, 0) + placement["points"]
+    return sums
+
+  def points_tuple(self, division_points):
+    # {division: points} as a points tuple
+    if division_points is None:
+      return self.no_points
+    return tuple(division_points.get(division) for division in self.progression)
+
+  def evaluate_primary(self, points):
+    highest = -1
+    for i in range(len(points) - 1, -1, -1):
+      if points[i] is not None:
+        highest = i
+        break
+    (thresholds, results) = self.primary_table[highest]
+    if highest < 0:
+      return results[0]
+    return results[bisect.bisect_right(thresholds, points[highest])]
+
+  def evaluate_secondary(self, points, primary_divisions):
+    i = max(self.division_index[division] for division in primary_divisions)
+    ((zero_at, one_at, two_at), table) = self.secondary_table[i]
+    return table[(
+      bisect.bisect_right(zero_at, points[i] or 0),
+      bisect.bisect_right(one_at, points[i - 1] or 0) if i >= 1 else 0,
+      bisect.bisect_right(two_at, points[i - 2] or 0) if i >= 2 else 0,
+    )]
+
+  def divisions_for_points(self, primary_role, secondary_roles, points_by_role):
+    # {role: [division]}, the primary role first, as a dancer's "divisions", from
+    # {role: {division: points}}. The tables are read straight from the sums, which is cheaper than
+    # building points tuples to look up in the memo.
+    progression = self.progression
+    primary_points = points_by_role.get(primary_role) or {}
+    highest = -1
+    for i in range(len(progression) - 1, -1, -1):
+      if progression[i] in primary_points:
+        highest = i
+        break
+    (thresholds, results) = self.primary_table[highest]
+    primary = results[bisect.bisect_right(thresholds, primary_points[progression[highest]])] if highest >= 0 else results[0]
+    divisions = {primary_role: list(primary)}
+    i = self.highest_index[primary]
+    ((zero_at, one_at, two_at), table) = self.secondary_table[i]
+    for role in secondary_roles:
+      points = points_by_role.get(role) or {}
+      divisions[role] = list(table[(
+        bisect.bisect_right(zero_at, points.get(progression[i]) or 0),
+        bisect.bisect_right(one_at, points.get(progression[i - 1]) or 0) if i >= 1 else 0,
+        bisect.bisect_right(two_at, points.get(progression[i - 2]) or 0) if i >= 2 else 0,
+      )])
+    return divisions
+
+  def divisions(self, primary_role, secondary_roles, placements):
+    # The same from a dancer's placements
+    return self.divisions_for_points(primary_role, secondary_roles, self.points_by_role(placements))
+
+  def evaluate_batch(self, keys):
+    # [(primary divisions, [secondary divisions])] for [(primary points, (secondary points, ...))],
+    # each distinct key evaluated once
+    results = {}
+    for key in keys:
+      if key not in results:
+        (primary_points, secondary_points) = key
+        primary = self.primary(primary_points)
+        results[key] = (primary, [self.secondary(p, primary) for p in secondary_points])
+    return [results[key] for key in keys]
+
+def representatives(thresholds):
+  # A whole number in each range bisect_right gives an index for: below the first threshold, then
+  # from each threshold up to the next
+  return [thresholds[0] - 1 if len(thresholds) > 0 else 0] + list(thresholds)
@@ -1,28 +1,48 @@
-import requests
 import json
 import datetime
 from dateutil.relativedelta import relativedelta
-import gzip
+import os
+import bisect
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from http_client import HttpClient
+from raw_store import RawResponseStore, import_raw_response_file, import_raw_response_shards, export_raw_response_shards, RAW_STORE_FILE, RAW_RESPONSE_DIRECTORY
+from refresh_scheduler import load_refresh_state, save_refresh_state, schedule_refresh, record_refresh
 
 COMPETITION_RECENCY_LIMIT_IN_MONTHS = 15
 API_URL = "https://points.worldsdc.com/lookup2020/find"
+if "WSDC_API_URL" in os.environ: # e.g. the local stand-in in bench/wsdc_stub.py
+  API_URL = os.environ["WSDC_API_URL"]
 NONE_SLIDE_LIMIT = 200
-RAW_RESPONSE_FILE = './raw_responses.json.gz'
+PROBE_WIDTH = 5 # Consecutive empty ids needed before a probe counts as past the end
+CONFIRM_SLIDE_LIMIT = 20 # The none slide past a probed upper bound, longer gaps are found by probe_past_gap
+EMPTY_RANGES_FILE = './empty_ranges.json'
+EMPTY_RANGE_TTL_DAYS = 180
+RAW_RESPONSE_FILE = './raw_responses.json.gz' # Replaced by the shards in raw_responses/, imported once
 LIMIT_TO_DANCE_STYLE = 'West Coast Swing'
+DEFAULT_CRAWLER_WORKERS = 4
+DEFAULT_CRAWLER_REQUESTS_PER_SECOND = 4
+DEFAULT_REFRESH_REQUEST_BUDGET = 1500
 
-def get_dancer(wsdc_id: str):
-  r = requests.post(API_URL, data = {'num': wsdc_id})
+def lookup_dancer(wsdc_id: str, client: HttpClient):
+  # Returns (json, is_empty) so a genuinely unused id can be told apart from a failed request
+  r = client.post(API_URL, data = {'num': wsdc_id})
+  if r is None:
+    print("No response for {}".format(wsdc_id))
+    return (None, False)
   if r.status_code != 200:
     print("Bad status code: {}".format(r.status_code))
-    return None
+    return (None, False)
   json = r.json()
   if not json:
     print("Received no json but no 404")
-    return None
-  return json
+    return (None, True)
+  return (json, False)
 
-def fetch_and_save_dancer(wsdc_id, raw_response_dancers):
-  res = get_dancer("{}".format(wsdc_id))
+def get_dancer(wsdc_id: str, client: HttpClient):
+  return lookup_dancer(wsdc_id, client)[0]
+
+def save_dancer(wsdc_id, res, raw_response_dancers):
   if res is None:
     print("Empty result on {}".format(wsdc_id))
     return (False, raw_response_dancers)
@@ -30,25 +50,200 @@ def fetch_and_save_dancer(wsdc_id, raw_response_dancers):
     raw_response_dancers[str(wsdc_id)] = res
     return (True, raw_response_dancers)
 
-def get_all_dancers(starting_wsdc_id, raw_response_dancers):
-    requests_made = 0
-    current_wsdc_id = starting_wsdc_id
-    none_slide = 0
+def fetch_and_save_dancer(wsdc_id, raw_response_dancers, client: HttpClient):
+  res = get_dancer("{}".format(wsdc_id), client)
+  return save_dancer(wsdc_id, res, raw_response_dancers)
 
-    while True:
-      if current_wsdc_id % 500 == 0:
-        print("Getting", current_wsdc_id)
-      (success, raw_response_dancers) = fetch_and_save_dancer(current_wsdc_id, raw_response_dancers)
+def fetch_and_save_dancers(wsdc_ids, raw_response_dancers, client: HttpClient, workers: int):
+  # Responses are merged in the order of wsdc_ids regardless of which request finishes first.
+  # Returns (requests made, raw_response_dancers, the ids that were fetched and saved)
+  requests_made = 0
+  saved_wsdc_ids = []
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    results = executor.map(lambda wsdc_id: get_dancer("{}".format(wsdc_id), client), wsdc_ids)
+    for (wsdc_id, res) in zip(wsdc_ids, results):
+      (success, raw_response_dancers) = save_dancer(wsdc_id, res, raw_response_dancers)
       requests_made += 1
       if success:
-        none_slide = 0
-      else:
-        none_slide += 1
-        if none_slide >= NONE_SLIDE_LIMIT:
-          print("Quitting")
-          break
-      current_wsdc_id += 1
-    return (requests_made, raw_response_dancers)
+        saved_wsdc_ids.append(wsdc_id)
+  return (requests_made, raw_response_dancers, saved_wsdc_ids)
+
+def load_empty_ranges():
+  # [[first_wsdc_id, last_wsdc_id, date_checked], ...] sorted by first_wsdc_id, expired ranges dropped
+  if not os.path.exists(EMPTY_RANGES_FILE):
+    return []
+  with open(EMPTY_RANGES_FILE, "r") as f:
+    empty_ranges = json.load(f)
+  cutoff = (datetime.date.today() - datetime.timedelta(days=EMPTY_RANGE_TTL_DAYS)).isoformat()
+  return sorted([r for r in empty_ranges if r[2] >= cutoff], key=lambda r: r[0])
+
+def save_empty_ranges(empty_ranges, empty_wsdc_ids):
+  today = datetime.date.today().isoformat()
+  new_ranges = []
+  for wsdc_id in sorted(empty_wsdc_ids):
+    if len(new_ranges) > 0 and new_ranges[-1][1] == wsdc_id - 1:
+      new_ranges[-1][1] = wsdc_id
+    else:
+      new_ranges.append([wsdc_id, wsdc_id, today])
+  with open(EMPTY_RANGES_FILE, "w") as f:
+    json.dump(sorted(empty_ranges + new_ranges, key=lambda r: r[0]), f)
+
+def is_known_empty(wsdc_id, empty_ranges):
+  i = bisect.bisect_right(empty_ranges, wsdc_id, key=lambda r: r[0]) - 1
+  return i >= 0 and empty_ranges[i][0] <= wsdc_id <= empty_ranges[i][1]
+
+def probe_wsdc_id(wsdc_id, raw_response_dancers, client: HttpClient, empty_ranges, checked_wsdc_ids):
+  # A probe is live if any of PROBE_WIDTH consecutive ids (known empty ids skipped) has a dancer.
+  # Returns (live wsdc_id or None, requests made, raw_response_dancers)
+  requests_made = 0
+  probed = 0
+  while probed < PROBE_WIDTH:
+    if is_known_empty(wsdc_id, empty_ranges):
+      wsdc_id += 1
+      continue
+    if wsdc_id not in checked_wsdc_ids:
+      (res, is_empty) = lookup_dancer("{}".format(wsdc_id), client)
+      requests_made += 1
+      (success, raw_response_dancers) = save_dancer(wsdc_id, res, raw_response_dancers)
+      checked_wsdc_ids[wsdc_id] = (success, is_empty)
+    if checked_wsdc_ids[wsdc_id][0]:
+      return (wsdc_id, requests_made, raw_response_dancers)
+    probed += 1
+    wsdc_id += 1
+  return (None, requests_made, raw_response_dancers)
+
+def find_upper_bound(starting_wsdc_id, raw_response_dancers, client: HttpClient, empty_ranges, checked_wsdc_ids):
+  # Gallop forward in doubling steps until a probe is dead, then bisect between the last live
+  # and first dead probe. Returns (upper_bound, requests made, raw_response_dancers)
+  requests_made = 0
+  low = starting_wsdc_id - 1
+  high = None
+  step = 1
+  while high is None:
+    (live_wsdc_id, probe_requests, raw_response_dancers) = probe_wsdc_id(low + step, raw_response_dancers, client, empty_ranges, checked_wsdc_ids)
+    requests_made += probe_requests
+    if live_wsdc_id is None:
+      high = low + step
+    else:
+      low = live_wsdc_id
+      step *= 2
+  while high - low > PROBE_WIDTH:
+    mid = (low + high) // 2
+    (live_wsdc_id, probe_requests, raw_response_dancers) = probe_wsdc_id(mid, raw_response_dancers, client, empty_ranges, checked_wsdc_ids)
+    requests_made += probe_requests
+    if live_wsdc_id is None:
+      high = mid
+    else:
+      low = max(low, live_wsdc_id)
+  return (low, requests_made, raw_response_dancers)
+
+def _wsdc_ids_to_crawl(starting_wsdc_id, upper_bound, empty_ranges):
+  wsdc_id = starting_wsdc_id
+  while True:
+    if upper_bound is None or wsdc_id > upper_bound or not is_known_empty(wsdc_id, empty_ranges):
+      yield wsdc_id
+    wsdc_id += 1
+
+def get_all_dancers(starting_wsdc_id, raw_response_dancers, client: HttpClient, workers: int, upper_bound = None, empty_ranges = None, checked_wsdc_ids = None, slide_limit: int = NONE_SLIDE_LIMIT):
+    # Up to workers * 2 ids are in flight at once, but results are consumed strictly in id order,
+    # so the none slide counts the same ids it would in a serial crawl.
+    # With an upper bound, known empty ids below it are skipped and the none slide only starts past it.
+    # Returns (requests made, raw_response_dancers, empty ids found at or below the upper bound,
+    # the last id of the none slide)
+    if empty_ranges is None:
+      empty_ranges = []
+    if checked_wsdc_ids is None:
+      checked_wsdc_ids = {}
+    requests_made = 0
+    none_slide = 0
+    empty_wsdc_ids = []
+    wsdc_ids = _wsdc_ids_to_crawl(starting_wsdc_id, upper_bound, empty_ranges)
+    in_flight = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      while True:
+        while len(in_flight) < workers * 2:
+          wsdc_id = next(wsdc_ids)
+          future = None
+          if wsdc_id not in checked_wsdc_ids:
+            future = executor.submit(lookup_dancer, "{}".format(wsdc_id), client)
+          in_flight.append((wsdc_id, future))
+        (current_wsdc_id, future) = in_flight.popleft()
+        if current_wsdc_id % 500 == 0:
+          print("Getting", current_wsdc_id)
+        if future is None:
+          (success, is_empty) = checked_wsdc_ids[current_wsdc_id]
+        else:
+          (res, is_empty) = future.result()
+          (success, raw_response_dancers) = save_dancer(current_wsdc_id, res, raw_response_dancers)
+          requests_made += 1
+        if is_empty and upper_bound is not None and current_wsdc_id <= upper_bound:
+          empty_wsdc_ids.append(current_wsdc_id)
+        if success:
+          none_slide = 0
+        elif upper_bound is None or current_wsdc_id > upper_bound:
+          none_slide += 1
+          if none_slide >= slide_limit:
+            print("Quitting")
+            break
+
+      # Anything past the stopping point is discarded so the result matches a serial crawl
+      for (_, future) in in_flight:
+        if future is not None and not future.cancel():
+          future.result()
+          requests_made += 1
+    return (requests_made, raw_response_dancers, empty_wsdc_ids, current_wsdc_id)
+
+def probe_past_gap(last_wsdc_id, raw_response_dancers, client: HttpClient, empty_ranges, checked_wsdc_ids):
+  # Probes at doubling offsets past the end of a short none slide, so dancers behind a gap of up to
+  # about NONE_SLIDE_LIMIT empty ids are found with a few probes instead of a request for every id.
+  # A run of fewer than PROBE_WIDTH new dancers between two probes is missed until it grows.
+  # Returns (live wsdc_id or None, requests made, raw_response_dancers)
+  requests_made = 0
+  offset = CONFIRM_SLIDE_LIMIT
+  while offset < NONE_SLIDE_LIMIT:
+    (live_wsdc_id, probe_requests, raw_response_dancers) = probe_wsdc_id(last_wsdc_id + offset, raw_response_dancers, client, empty_ranges, checked_wsdc_ids)
+    requests_made += probe_requests
+    if live_wsdc_id is not None:
+      return (live_wsdc_id, requests_made, raw_response_dancers)
+    offset *= 2
+  return (None, requests_made, raw_response_dancers)
+
+def probe_and_get_all_dancers(starting_wsdc_id, raw_response_dancers, client: HttpClient, workers: int):
+  # Crawls up to a probed upper bound and CONFIRM_SLIDE_LIMIT past it. When probe_past_gap finds
+  # dancers further on, the bound is probed again from there and the crawl carries on where it stopped.
+  empty_ranges = load_empty_ranges()
+  checked_wsdc_ids = {}
+  max_known_wsdc_id = max([int(k) for k in raw_response_dancers] + [starting_wsdc_id - 1])
+  (upper_bound, probe_requests, raw_response_dancers) = find_upper_bound(max(starting_wsdc_id, max_known_wsdc_id + 1), raw_response_dancers, client, empty_ranges, checked_wsdc_ids)
+  upper_bound = max(upper_bound, max_known_wsdc_id)
+  print("Probed upper bound of {} with {} requests".format(upper_bound, probe_requests))
+  crawl_requests = 0
+  empty_wsdc_ids = []
+  wsdc_id = starting_wsdc_id
+  while True:
+    (requests, raw_response_dancers, empty_ids, last_wsdc_id) = get_all_dancers(wsdc_id, raw_response_dancers, client, workers, upper_bound, empty_ranges, checked_wsdc_ids, CONFIRM_SLIDE_LIMIT)
+    crawl_requests += requests
+    empty_wsdc_ids += empty_ids
+    (live_wsdc_id, gap_requests, raw_response_dancers) = probe_past_gap(last_wsdc_id, raw_response_dancers, client, empty_ranges, checked_wsdc_ids)
+    probe_requests += gap_requests
+    if live_wsdc_id is None:
+      break
+    (gap_upper_bound, bound_requests, raw_response_dancers) = find_upper_bound(live_wsdc_id + 1, raw_response_dancers, client, empty_ranges, checked_wsdc_ids)
+    probe_requests += bound_requests
+    upper_bound = max(gap_upper_bound, live_wsdc_id)
+    print("Found {} past a gap, probed upper bound of {}".format(live_wsdc_id, upper_bound))
+    wsdc_id = last_wsdc_id + 1
+  save_empty_ranges(empty_ranges, empty_wsdc_ids)
+
+  # A linear none slide requests every id up to the last live one, then NONE_SLIDE_LIMIT more
+  requests_made = probe_requests + crawl_requests
+  live_wsdc_ids = [int(k) for k in raw_response_dancers if int(k) >= starting_wsdc_id]
+  linear_requests = NONE_SLIDE_LIMIT
+  if len(live_wsdc_ids) > 0:
+    linear_requests += max(live_wsdc_ids) - starting_wsdc_id + 1
+  print("Probing made {} requests where a linear none slide would have made {}, saving {}".format(requests_made, linear_requests, linear_requests - requests_made))
+  return (requests_made, raw_response_dancers)
 
 def get_max_placement_date(dancer_role):
   placements = dancer_role['placements']
@@ -73,43 +268,57 @@ def get_max_placement_date(dancer_role):
           max_placement_date = max(max_placement_date, competition_date)
   return max_placement_date
 
-def get_dancers_abbreviated(raw_response_dancers):
+def get_dancers_abbreviated(raw_response_dancers, client: HttpClient, workers: int, refresh_state, upcoming_events, refresh_request_budget: int):
   requests_made = 0
   max_wsdc_id = 1
+  refresh_candidates = []
   cutoff_date = datetime.datetime.now() - relativedelta(months=COMPETITION_RECENCY_LIMIT_IN_MONTHS)
-  for wsdc_id in raw_response_dancers:
-    dancer = raw_response_dancers[wsdc_id]
+  for (wsdc_id, dancer) in raw_response_dancers.items():
     max_wsdc_id = max(max_wsdc_id, dancer['dancer_wsdcid'])
     max_date = get_max_placement_date(dancer['leader'])
     max_follower_date = get_max_placement_date(dancer['follower'])
     if max_date is None or (max_follower_date is not None and max_follower_date > max_date):
       max_date = max_follower_date
     if max_date is not None and max_date > cutoff_date:
-      (_, raw_response_dancers) = fetch_and_save_dancer(dancer['dancer_wsdcid'], raw_response_dancers)
-      requests_made += 1
+      refresh_candidates.append((dancer['dancer_wsdcid'], max_date))
+  wsdc_ids_to_refresh = schedule_refresh(refresh_candidates, raw_response_dancers, refresh_state, upcoming_events, refresh_request_budget)
+  (requests_made, raw_response_dancers, refreshed_wsdc_ids) = fetch_and_save_dancers(wsdc_ids_to_refresh, raw_response_dancers, client, workers)
+  # A dancer whose request failed keeps their state, so they are due again next run instead of backing off
+  refresh_state = record_refresh(refresh_state, refreshed_wsdc_ids, raw_response_dancers)
   next_wsdc_id = max_wsdc_id + 1
-  (requests_made_during_get_all_dancers, raw_response_dancers) = get_all_dancers(next_wsdc_id, raw_response_dancers)
+  (requests_made_during_get_all_dancers, raw_response_dancers) = probe_and_get_all_dancers(next_wsdc_id, raw_response_dancers, client, workers)
   requests_made += requests_made_during_get_all_dancers
+  refresh_state = record_refresh(refresh_state, [k for k in raw_response_dancers if int(k) >= next_wsdc_id], raw_response_dancers)
   return (requests_made, raw_response_dancers)
 
-def get_dancers(fetch_remote: bool, fetch_all):
-  # Load raw responses from a json file
-  raw_response_dancers = {} # Keyed by str(wsdc_id)
-  with open(RAW_RESPONSE_FILE, "rb") as f:
-    raw_response_dancers_json = gzip.decompress(f.read()).decode('utf-8')
-    raw_response_dancers = json.loads(raw_response_dancers_json)
+def open_raw_responses():
+  # Raw responses live in an indexed store keyed by str(wsdc_id), only changed records are written back
+  raw_response_dancers = RawResponseStore(RAW_STORE_FILE)
+  if os.path.exists(RAW_RESPONSE_FILE) and not os.path.isdir(RAW_RESPONSE_DIRECTORY):
+    # One time move to the sharded record log, the single file goes with the commit that adds the shards
+    import_raw_response_file(raw_response_dancers, RAW_RESPONSE_FILE)
+    print("Wrote {} raw response shards to {}".format(export_raw_response_shards(raw_response_dancers, RAW_RESPONSE_DIRECTORY), RAW_RESPONSE_DIRECTORY))
+    os.remove(RAW_RESPONSE_FILE)
+  return import_raw_response_shards(raw_response_dancers, RAW_RESPONSE_DIRECTORY)
 
+def get_dancers(raw_response_dancers, fetch_remote: bool, fetch_all, workers: int = DEFAULT_CRAWLER_WORKERS, requests_per_second: float = DEFAULT_CRAWLER_REQUESTS_PER_SECOND, upcoming_events = None, refresh_request_budget: int = DEFAULT_REFRESH_REQUEST_BUDGET):
+  if upcoming_events is None:
+    upcoming_events = []
   number_of_requests_to_wsdc = 0
   if fetch_remote:
+    client = HttpClient(pool_size=workers, requests_per_second=requests_per_second)
+    refresh_state = load_refresh_state(raw_response_dancers)
     if fetch_all:
-      (number_of_requests_to_wsdc, raw_response_dancers) = get_all_dancers(1, raw_response_dancers)
+      (number_of_requests_to_wsdc, raw_response_dancers) = probe_and_get_all_dancers(1, raw_response_dancers, client, workers)
+      refresh_state = record_refresh(refresh_state, list(raw_response_dancers), raw_response_dancers)
     else:
-      (number_of_requests_to_wsdc, raw_response_dancers) = get_dancers_abbreviated(raw_response_dancers)
+      (number_of_requests_to_wsdc, raw_response_dancers) = get_dancers_abbreviated(raw_response_dancers, client, workers, refresh_state, upcoming_events, refresh_request_budget)
+    save_refresh_state(raw_response_dancers, refresh_state, upcoming_events)
+    print("Retried {} requests to WSDC".format(client.retries))
   print("Made {} requests to WSDC".format(number_of_requests_to_wsdc))
 
-  raw_response_dancers = dict(sorted(raw_response_dancers.items()))
-  with open(RAW_RESPONSE_FILE, 'wb') as f:
-    raw_response_dancers_json = json.dumps(raw_response_dancers)
-    raw_response_dancers_json_compressed = gzip.compress(bytes(raw_response_dancers_json, 'utf-8'))
-    f.write(raw_response_dancers_json_compressed)
+  raw_response_dancers.commit()
+  print("Wrote {} changed raw responses".format(raw_response_dancers.records_written))
+  if fetch_remote:
+    print("Updated {} raw response shards in {}".format(export_raw_response_shards(raw_response_dancers, RAW_RESPONSE_DIRECTORY), RAW_RESPONSE_DIRECTORY))
   return raw_response_dancers
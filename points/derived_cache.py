@@ -0,0 +1,122 @@
+import sqlite3
+import msgpack
+import zlib
+
+DERIVED_CACHE_FILE = './derived_dancers.sqlite'
+COMMIT_EVERY = 500
+
+class DerivedDancerCache:
+  # Each dancer's derived record, keyed by str(wsdc_id) like the raw store and tagged with the hash
+  # of the raw response it came from and the version of the rules that derived it, stored as zlib
+  # compressed msgpack.
+  # What each dancer adds to the global aggregates is kept alongside as rows, which put replaces
+  # when the dancer is derived again, so events, tiers, new dancers by date and division progression
+  # are queried instead of folded from every dancer. Where the fold let a later dancer win, in str(wsdc_id) order, the
+  # queries take the row with the highest wsdc_id.
+  def __init__(self, rules_version: str, path: str = DERIVED_CACHE_FILE):
+    self.rules_version = rules_version
+    self.connection = sqlite3.connect(path)
+    columns = [row[1] for row in self.connection.execute("PRAGMA table_info(derived)")]
+    if len(columns) > 0 and "dancer" not in columns: # A cache of whole contributions, from before the aggregate tables
+      self.connection.execute("DROP TABLE derived")
+    self.connection.execute("CREATE TABLE IF NOT EXISTS derived (wsdc_id TEXT PRIMARY KEY, raw_hash TEXT NOT NULL, rules_version TEXT NOT NULL, dancer BLOB NOT NULL) WITHOUT ROWID")
+    # The last occurrence of each event date in the dancer's placements
+    self.connection.execute("CREATE TABLE IF NOT EXISTS event_dates (event_id INTEGER NOT NULL, date TEXT NOT NULL, wsdc_id TEXT NOT NULL, name TEXT, location TEXT, url TEXT, PRIMARY KEY (event_id, date, wsdc_id)) WITHOUT ROWID")
+    self.connection.execute("CREATE INDEX IF NOT EXISTS event_dates_by_dancer ON event_dates (wsdc_id)")
+    # The dancer's last first place points for each event, date, division and role
+    self.connection.execute("CREATE TABLE IF NOT EXISTS first_places (event_id INTEGER NOT NULL, date TEXT NOT NULL, division INTEGER NOT NULL, role INTEGER NOT NULL, wsdc_id TEXT NOT NULL, points, PRIMARY KEY (event_id, date, division, role, wsdc_id)) WITHOUT ROWID")
+    self.connection.execute("CREATE INDEX IF NOT EXISTS first_places_by_dancer ON first_places (wsdc_id)")
+    self.connection.execute("CREATE TABLE IF NOT EXISTS new_dancer_dates (wsdc_id TEXT NOT NULL, date TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (wsdc_id, date)) WITHOUT ROWID")
+    # Days the dancer took to move on from each division in their primary role
+    self.connection.execute("CREATE TABLE IF NOT EXISTS progressions (wsdc_id TEXT NOT NULL, from_division INTEGER NOT NULL, role INTEGER NOT NULL, year INTEGER NOT NULL, days INTEGER NOT NULL, PRIMARY KEY (wsdc_id, from_division)) WITHOUT ROWID")
+    self.uncommitted = 0
+    self.records_written = 0
+
+  def clear(self):
+    for table in ["derived", "event_dates", "first_places", "new_dancer_dates", "progressions"]:
+      self.connection.execute("DELETE FROM {}".format(table))
+    self.commit()
+
+  def _delete_aggregates(self, wsdc_id: str):
+    for table in ["event_dates", "first_places", "new_dancer_dates", "progressions"]:
+      self.connection.execute("DELETE FROM {} WHERE wsdc_id = ?".format(table), (wsdc_id,))
+
+  def stale_ids(self, raw_hashes):
+    # raw_hashes is [(wsdc_id, hash)] from the raw store. Returns {wsdc_id: hash} for the dancers that
+    # need deriving, in the order given, and drops dancers no longer in the raw store.
+    cached = {}
+    for (wsdc_id, raw_hash, rules_version) in self.connection.execute("SELECT wsdc_id, raw_hash, rules_version FROM derived"):
+      cached[wsdc_id] = (raw_hash, rules_version)
+    stale = {}
+    for (wsdc_id, raw_hash) in raw_hashes:
+      if cached.pop(wsdc_id, None) != (raw_hash, self.rules_version):
+        stale[wsdc_id] = raw_hash
+    for wsdc_id in cached:
+      self.connection.execute("DELETE FROM derived WHERE wsdc_id = ?", (wsdc_id,))
+      self._delete_aggregates(wsdc_id)
+    return stale
+
+  def put(self, wsdc_id, raw_hash: str, contribution):
+    # contribution is [dancer, leader events, follower events, first place points, new dancers by date, division progression rows]
+    (dancer, leader_events, follower_events, first_place_points, new_dancers_by_date, progression_rows) = contribution
+    wsdc_id = str(wsdc_id)
+    self.connection.execute("INSERT OR REPLACE INTO derived (wsdc_id, raw_hash, rules_version, dancer) VALUES (?, ?, ?, ?)", (wsdc_id, raw_hash, self.rules_version, zlib.compress(msgpack.packb(dancer))))
+    self._delete_aggregates(wsdc_id)
+    if len(dancer["placements"]) > 0: # The build only adds the events of dancers with placements
+      event_dates = {(e["id"], e["date"]): (e["name"], e["location"], e["url"]) for e in leader_events + follower_events}
+      self.connection.executemany("INSERT INTO event_dates (event_id, date, wsdc_id, name, location, url) VALUES (?, ?, ?, ?, ?, ?)", [(event_id, date, wsdc_id) + event for ((event_id, date), event) in event_dates.items()])
+    first_places = {(event_id, date, division, role): points for (event_id, date, division, role, points) in first_place_points}
+    self.connection.executemany("INSERT INTO first_places (event_id, date, division, role, wsdc_id, points) VALUES (?, ?, ?, ?, ?, ?)", [key + (wsdc_id, points) for (key, points) in first_places.items()])
+    self.connection.executemany("INSERT INTO new_dancer_dates (wsdc_id, date, count) VALUES (?, ?, ?)", [(wsdc_id, date, count) for (date, count) in new_dancers_by_date.items()])
+    self.connection.executemany("INSERT INTO progressions (wsdc_id, from_division, role, year, days) VALUES (?, ?, ?, ?, ?)", [(wsdc_id, from_division, dancer["primary_role"], year, days) for (from_division, days, year) in progression_rows])
+    self.records_written += 1
+    self.uncommitted += 1
+    if self.uncommitted >= COMMIT_EVERY:
+      self.commit()
+
+  def dancers(self):
+    # Streams every dancer in str(wsdc_id) order, the order the raw store iterates in
+    for row in self.connection.execute("SELECT dancer FROM derived ORDER BY wsdc_id"):
+      yield msgpack.unpackb(zlib.decompress(row[0]), strict_map_key=False)
+
+  def events(self):
+    # Highest id first, each with its dates newest first, the shape TierIndex.annotate takes. The
+    # name, location and url are from the event's oldest date, the highest wsdc_id winning ties.
+    dates = {}
+    for (event_id, date) in self.connection.execute("SELECT DISTINCT event_id, date FROM event_dates"):
+      dates.setdefault(event_id, []).append(date)
+    oldest = self.connection.execute("""
+      SELECT e.event_id, e.name, e.location, e.url FROM event_dates e
+      JOIN (SELECT event_id, MIN(date) AS date FROM event_dates GROUP BY event_id) o ON e.event_id = o.event_id AND e.date = o.date
+      WHERE e.wsdc_id = (SELECT MAX(wsdc_id) FROM event_dates t WHERE t.event_id = e.event_id AND t.date = e.date)
+    """)
+    return [{
+      "id": event_id,
+      "name": name,
+      "location": location,
+      "url": url,
+      "dates": sorted(dates[event_id], reverse=True),
+    } for (event_id, name, location, url) in sorted(oldest, key=lambda row: row[0], reverse=True)]
+
+  def first_place_points(self):
+    # [[event id, date, division, role, points]] with the highest wsdc_id's points for each key,
+    # as TierIndex.add_entries takes them
+    return [list(row) for row in self.connection.execute("""
+      SELECT event_id, date, division, role, points FROM first_places f
+      WHERE wsdc_id = (SELECT MAX(wsdc_id) FROM first_places t WHERE t.event_id = f.event_id AND t.date = f.date AND t.division = f.division AND t.role = f.role)
+    """)]
+
+  def new_dancers_by_date(self):
+    return dict(self.connection.execute("SELECT date, SUM(count) FROM new_dancer_dates GROUP BY date"))
+
+  def division_progression_counts(self):
+    # [(from division, primary role, year, days, dancers)], as add_division_progression takes them
+    return self.connection.execute("SELECT from_division, role, year, days, COUNT(*) FROM progressions GROUP BY from_division, role, year, days").fetchall()
+
+  def commit(self):
+    self.connection.commit()
+    self.uncommitted = 0
+
+  def close(self):
+    self.commit()
+    self.connection.close()
@@ -0,0 +1,90 @@
+import math
+
+BOXPLOT_WHISKER_COEF = 1.5 # the default coef of chartjs-chart-boxplot
+HISTOGRAM_BINS = 20
+MAX_OUTLIERS = 50
+
+class Distribution:
+  # Counts of each whole number value. Memory depends on how many distinct values there are, not
+  # on how many were added, and two distributions merge by adding their counts.
+  def __init__(self):
+    self.counts = {}
+    self.count = 0
+    self.total = 0
+
+  def add(self, value: int, count: int = 1):
+    self.counts[value] = self.counts.get(value, 0) + count
+    self.count += count
+    self.total += value * count
+
+  def merge(self, other):
+    for (value, count) in other.counts.items():
+      self.add(value, count)
+    return self
+
+  def values(self):
+    return sorted(self.counts)
+
+  def kth(self, k: int):
+    # The kth smallest value, counting from 0
+    seen = 0
+    for value in self.values():
+      seen += self.counts[value]
+      if k < seen:
+        return value
+    raise IndexError(k)
+
+  def quantile(self, q: float):
+    # Type 7 quantile, linear between the two nearest ranks, like R's quantile and numpy's default
+    h = (self.count - 1) * q
+    low = math.floor(h)
+    low_value = self.kth(low)
+    if h == low:
+      return low_value
+    return low_value + (h - low) * (self.kth(low + 1) - low_value)
+
+  def quantiles(self):
+    # None when nothing was added, as for every summary
+    if self.count == 0:
+      return None
+    values = self.values()
+    return {
+      "count": self.count,
+      "min": values[0],
+      "q1": self.quantile(0.25),
+      "median": self.quantile(0.5),
+      "q3": self.quantile(0.75),
+      "max": values[-1],
+      "mean": self.total / self.count,
+    }
+
+  def boxplot(self):
+    # quantiles plus the whiskers and outliers chartjs-chart-boxplot would work out from the raw
+    # values: whiskers at the nearest values within coef times the interquartile range of the box.
+    # Outliers are listed once per distinct value, and spread out to MAX_OUTLIERS at most.
+    stats = self.quantiles()
+    if stats is None:
+      return None
+    iqr = stats["q3"] - stats["q1"]
+    low_fence = max(stats["min"], stats["q1"] - BOXPLOT_WHISKER_COEF * iqr)
+    high_fence = min(stats["max"], stats["q3"] + BOXPLOT_WHISKER_COEF * iqr)
+    values = self.values()
+    stats["whiskerMin"] = next(v for v in values if v >= low_fence)
+    stats["whiskerMax"] = next(v for v in reversed(values) if v <= high_fence)
+    outliers = [v for v in values if v < stats["whiskerMin"] or v > stats["whiskerMax"]]
+    if len(outliers) > MAX_OUTLIERS:
+      outliers = [outliers[round(i * (len(outliers) - 1) / (MAX_OUTLIERS - 1))] for i in range(MAX_OUTLIERS)]
+    stats["outliers"] = outliers
+    return stats
+
+  def histogram(self, bins: int = HISTOGRAM_BINS):
+    # bins equal width bins from the lowest to the highest value, the last one including the highest
+    if self.count == 0:
+      return None
+    values = self.values()
+    low = values[0]
+    width = max(1, math.ceil((values[-1] - low + 1) / bins))
+    counts = [0] * bins
+    for value in values:
+      counts[min(bins - 1, (value - low) // width)] += self.counts[value]
+    return {"edges": [low + i * width for i in range(bins + 1)], "counts": counts}
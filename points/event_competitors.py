@@ -0,0 +1,61 @@
+import os
+import tempfile
+import msgpack
+
+EVENT_COMPETITORS_FORMAT_VERSION = 1
+EVENT_SPILL_BUCKETS = 64
+
+# One file per event, {event id}.txt, read by getEventCompetitors in assets/js/index.js:
+# {
+#   "version": 1,
+#   "roles": {...}, "divisions": {...},
+#   "dates": {date: [[dancer id, name, division, role, result, points], ...]},
+# }
+# Each date lists its competitors in the order event-competitors.html shows them: highest
+# division and role first, then highest dancer id first, then the dancer's own placement order.
+
+class EventCompetitorWriter:
+  # Inverts dancers' placements into per event competitor lists as dancers stream past, then
+  # writes every event's file through the ArtifactWriter, removing any other files in the directory.
+  # Dancers must arrive by id, highest first.
+  # Entries are spilled in arrival order to one of EVENT_SPILL_BUCKETS temporary files by event id,
+  # and close groups one bucket at a time, so memory holds a bucket's events rather than every placement.
+  def __init__(self, roles, divisions, artifacts, directory: str, buckets: int = EVENT_SPILL_BUCKETS):
+    self.roles = roles
+    self.divisions = divisions
+    self.artifacts = artifacts
+    self.directory = directory
+    os.makedirs(artifacts.path(directory), exist_ok=True)
+    self.buckets = [tempfile.TemporaryFile() for _ in range(buckets)]
+
+  def add_dancer(self, dancer):
+    for placement in dancer["placements"]:
+      self.buckets[placement["event"] % len(self.buckets)].write(msgpack.packb([placement["event"], placement["date"], [
+        dancer["id"],
+        dancer["name"],
+        placement["division"],
+        placement["role"],
+        placement["result"],
+        placement["points"],
+      ]]))
+
+  def close(self):
+    events_written = 0
+    for bucket in self.buckets:
+      bucket.seek(0)
+      events = {} # event id: {date: [entry]}
+      for (event_id, date, entry) in msgpack.Unpacker(bucket):
+        events.setdefault(event_id, {}).setdefault(date, []).append(entry)
+      bucket.close()
+      for (event_id, dates) in events.items():
+        for entries in dates.values():
+          entries.sort(key=lambda e: (e[2], e[3]), reverse=True)
+        self.artifacts.write_bytes("{}/{}.txt".format(self.directory, event_id), msgpack.packb({
+          "version": EVENT_COMPETITORS_FORMAT_VERSION,
+          "roles": self.roles,
+          "divisions": self.divisions,
+          "dates": dates,
+        }))
+      events_written += len(events)
+    self.artifacts.remove_orphans(self.directory)
+    print("Wrote competitors for {} events".format(events_written))
@@ -1,10 +1,12 @@
-import requests
-from bs4 import BeautifulSoup
 import json
 import re
 import datetime
 import gzip
-import time
+import hashlib
+import os
+from html.parser import HTMLParser
+from http_client import HttpClient
+from geocoder import Geocoder, LocationCache, normalize_location
 
 # Why do you do this to us, WSDC?
 LOCATION_PATCHES = {
@@ -12,107 +14,192 @@ LOCATION_PATCHES = {
    "Monterey Swing Fest": "Monterey, CA"
 }
 
+EVENTS_URL = "https://www.worldsdc.com/events/"
+if "WSDC_EVENTS_URL" in os.environ: # e.g. the local stand-in in bench/wsdc_stub.py
+  EVENTS_URL = os.environ["WSDC_EVENTS_URL"]
 LOCATION_CACHE_FILE = "./locations.json"
 RAW_EVENTS_RESPONSE_FILE = './raw_events.html.gz'
+EVENTS_CACHE_FILE = './raw_events_cache.json'
+EVENTS_CACHE_FORMAT_VERSION = 1
 
-def _get_location(name: str, location: str, location_cache, OPEN_WEATHER_MAP_API_KEY):
+YEAR_PATTERN = re.compile(r'\d{4}')
+MONTH_PATTERN = re.compile(r'[a-zA-Z]{3}')
+DAY_PATTERN = re.compile(r'\d{1,2}')
+END_DAY_PATTERN = re.compile(r'\s(\d{1,2})[,\s]')
+MONTHS = {datetime.date(2000, m, 1).strftime('%b').lower(): m for m in range(1, 13)}
+
+# The events cache, so an unchanged page is neither downloaded nor parsed again:
+# {
+#   "version": 1,
+#   "etag": ETag of the stored page or None, "last_modified": its Last-Modified or None,
+#   "page_hash": sha1 of the stored page,
+#   "events": the page's events, before their locations are resolved
+# }
+
+class EventTableParser(HTMLParser):
+  # Walks the first table of the events page and nothing else, collecting each row's cells as
+  # {"text", "name", "type", "href"}: the cell's text, the text of its event_name and event_type
+  # divs, and the href of its first link
+  def __init__(self):
+    super().__init__(convert_charrefs=True)
+    self.rows = []
+    self.table_depth = 0
+    self.done = False
+    self.cell = None
+    self.div_depth = 0
+    self.capture = [] # (field, div depth it ends at)
+
+  def handle_starttag(self, tag, attrs):
+    if self.done:
+      return
+    if tag == "table":
+      self.table_depth += 1
+      return
+    if self.table_depth == 0:
+      return
+    if tag == "tr":
+      self.rows.append([])
+      self.cell = None
+    elif tag == "td" and len(self.rows) > 0:
+      self.cell = {"text": [], "name": [], "type": [], "href": None}
+      self.rows[-1].append(self.cell)
+      self.div_depth = 0
+      self.capture = []
+    elif self.cell is None:
+      return
+    elif tag == "div":
+      self.div_depth += 1
+      classes = (dict(attrs).get("class") or "").split()
+      for (field, css_class) in [("name", "event_name"), ("type", "event_type")]:
+        if css_class in classes:
+          self.capture.append((field, self.div_depth))
+    elif tag == "a" and self.cell["href"] is None:
+      self.cell["href"] = dict(attrs).get("href")
+
+  def handle_endtag(self, tag):
+    if self.done or self.table_depth == 0:
+      return
+    if tag == "table":
+      self.table_depth -= 1
+      self.done = self.table_depth == 0
+    elif tag in ("td", "tr"):
+      self.cell = None
+    elif tag == "div" and self.cell is not None:
+      self.capture = [(field, depth) for (field, depth) in self.capture if depth < self.div_depth]
+      self.div_depth -= 1
+
+  def handle_data(self, data):
+    if self.cell is None:
+      return
+    self.cell["text"].append(data)
+    for (field, _) in self.capture:
+      self.cell[field].append(data)
+
+def extract_event_rows(html: str):
+  # [[cell]] for the rows of the events table with cells, see EventTableParser
+  start = html.find("<table")
+  if start < 0:
+    return []
+  parser = EventTableParser()
+  parser.feed(html[start:])
+  return [row for row in parser.rows if len(row) > 0]
+
+def _parse_date(date: str, first: bool):
+  if first:
+    (year, month, day) = (YEAR_PATTERN.findall(date)[0], MONTH_PATTERN.findall(date)[0], DAY_PATTERN.findall(date)[0])
+  else:
+    (year, month, day) = (YEAR_PATTERN.findall(date)[-1], MONTH_PATTERN.findall(date)[-1], END_DAY_PATTERN.findall(date)[-1])
+  return datetime.datetime(int(year), MONTHS[month.lower()], int(day)).isoformat()
+
+def _parse_events(html):
+  # The page's events, in page order, with no coordinates yet
+  ret = []
+  for cells in extract_event_rows(html):
+    date = "".join(cells[0]["text"])
+    ret.append({
+      "name": "".join(cells[1]["name"]).strip(),
+      "location": "".join(cells[2]["text"]),
+      "latitude": None,
+      "longitude": None,
+      "url": cells[1]["href"],
+      "type": "".join(cells[1]["type"]),
+      "end_date": _parse_date(date, False),
+      "start_date": _parse_date(date, True),
+    })
+  return ret
+
+def _patched_location(name: str, location: str):
   if (location == "" or location is None) and name not in LOCATION_PATCHES:
      print("Location patch miss for '{}'".format(name))
   if (location == "" or location is None) and name in LOCATION_PATCHES:
      location = LOCATION_PATCHES[name]
-  if location in location_cache:
-     return (location_cache[location], location_cache)
-  time.sleep(1.1)
-  splits = [s.strip() for s in location.split(",")]
-  if len(splits) > 1 and len(splits[1]) == 2 and splits[1].isupper() and splits[1] != "UK":
-    if len(splits) < 3:
-      splits.append("US")
-    else:
-      splits[2] = "US"
-  requestable_location = ",".join(splits)
-  url = "http://api.openweathermap.org/geo/1.0/direct?q={}&limit=1&appid={}".format(requestable_location, OPEN_WEATHER_MAP_API_KEY)
-  r = requests.get(url)
-  if not r.ok:
-    print("No results for location {}".format(location))
-    location_cache[location] = []
-    return ([], location_cache)
-  jsonResult = r.json()
-  if len(jsonResult) < 1:
-    print("No results for location {}".format(location))
-    location_cache[location] = []
-    return ([], location_cache)
-  ret = None
-  latitude = jsonResult[0]["lat"]
-  longitude = jsonResult[0]["lon"]
-  ret = (latitude, longitude)
-  location_cache[location] = ret
-  return (ret, location_cache)
+  return normalize_location(location)
+
+def _locate_events(events, OPEN_WEATHER_MAP_API_KEY):
+  # Every distinct location is resolved once
+  geocoder = Geocoder(OPEN_WEATHER_MAP_API_KEY, LocationCache(LOCATION_CACHE_FILE))
+  locations = [_patched_location(event["name"], event["location"]) for event in events]
+  resolved = geocoder.resolve(locations)
+  for (event, location) in zip(events, locations):
+    if resolved[location] is not None:
+      (event["latitude"], event["longitude"]) = resolved[location]
+  return events
 
 def _parseEventsFromWsdcEventsPageHtml(html, OPEN_WEATHER_MAP_API_KEY):
-  soup = BeautifulSoup(html, 'html.parser')
-  rows = soup.find("table").find_all("tr")[1:]
-  ret = []
+  return _locate_events(_parse_events(html), OPEN_WEATHER_MAP_API_KEY)
 
-  location_cache = {}
-  with open(LOCATION_CACHE_FILE, "r") as f:
-    location_cache = json.load(f)
-
-  for row in rows:
-    tds = row.find_all('td')
-    date = tds[0].get_text()
-    location = tds[2].get_text()
-    name = tds[1].find("div", class_="event_name").get_text().strip()
-    url = tds[1].find("a")['href']
-    event_type = tds[1].find("div", class_="event_type").get_text()
-
-    start_date = None
-    end_date = None
-
-    try:
-      year = re.findall('\d{4}', date)[0]
-      month = re.findall('[a-zA-Z]{3}', date)[0]
-      day = re.findall('\d{1,2}', date)[0]
-      month = datetime.datetime.strptime(month, '%b').month
-      start_date = datetime.datetime(int(year), month, int(day)).isoformat()
-
-      year = re.findall('\d{4}', date)[-1]
-      month = re.findall('[a-zA-Z]{3}', date)[-1]
-      day = re.findall('\s(\d{1,2})[,\s]', date)[-1]
-      month = datetime.datetime.strptime(month, '%b').month
-      end_date = datetime.datetime(int(year), month, int(day)).isoformat()
-    except Exception as e:
-      raise e
-    (latlon, location_cache) = _get_location(name, location, location_cache, OPEN_WEATHER_MAP_API_KEY)
-    latitude = None
-    longitude = None
-    if len(latlon) >= 2:
-      latitude = latlon[0]
-      longitude = latlon[1]
-    ret.append({
-      "name": name,
-      "location": location,
-      "latitude": latitude,
-      "longitude": longitude,
-      "url": url,
-      "type": event_type,
-      "end_date": end_date,
-      "start_date": start_date
-    })
+def load_events_cache():
+  if os.path.exists(EVENTS_CACHE_FILE):
+    with open(EVENTS_CACHE_FILE, "r") as f:
+      cache = json.load(f)
+    if cache.get("version") == EVENTS_CACHE_FORMAT_VERSION:
+      return cache
+  return {"version": EVENTS_CACHE_FORMAT_VERSION, "etag": None, "last_modified": None, "page_hash": None, "events": []}
 
-  # Write out locations
-  with open(LOCATION_CACHE_FILE, 'w') as f:
-    json.dump(location_cache, f)
+def save_events_cache(cache):
+  temporary_path = EVENTS_CACHE_FILE + ".tmp"
+  with open(temporary_path, "w") as f:
+    json.dump(cache, f)
+  os.replace(temporary_path, EVENTS_CACHE_FILE)
 
-  return ret
+def fetch_events_page(cache, client: HttpClient|None = None):
+  # Downloads the events page into RAW_EVENTS_RESPONSE_FILE unless the server says the stored one
+  # is still current. Returns whether a new page was stored.
+  client = client or HttpClient()
+  headers = {}
+  if cache["etag"] is not None and os.path.exists(RAW_EVENTS_RESPONSE_FILE):
+    headers["If-None-Match"] = cache["etag"]
+  if cache["last_modified"] is not None and os.path.exists(RAW_EVENTS_RESPONSE_FILE):
+    headers["If-Modified-Since"] = cache["last_modified"]
+  eventsPageResponse = client.get(EVENTS_URL, headers=headers)
+  if eventsPageResponse is None:
+    return False
+  if eventsPageResponse.status_code == 304:
+    print("Events page not modified")
+    return False
+  if eventsPageResponse.status_code != 200:
+    return False
+  with open(RAW_EVENTS_RESPONSE_FILE, 'wb') as f:
+    raw_events_html_compressed = gzip.compress(bytes(eventsPageResponse.text, 'utf-8'))
+    f.write(raw_events_html_compressed)
+  cache["etag"] = eventsPageResponse.headers.get("ETag")
+  cache["last_modified"] = eventsPageResponse.headers.get("Last-Modified")
+  return True
 
 def get_events(fetch_remote: bool, OPEN_WEATHER_MAP_API_KEY) -> list[dict]:
+  cache = load_events_cache()
+  changed = False
   if fetch_remote:
-    eventsPageResponse = requests.get("https://www.worldsdc.com/events/")
-    if eventsPageResponse.status_code == 200:
-      with open(RAW_EVENTS_RESPONSE_FILE, 'wb') as f:
-        raw_events_html_compressed = gzip.compress(bytes(eventsPageResponse.text, 'utf-8'))
-        f.write(raw_events_html_compressed)
+    changed = fetch_events_page(cache)
   with open(RAW_EVENTS_RESPONSE_FILE, "rb") as f:
     raw_events_html = gzip.decompress(f.read()).decode('utf-8')
-    eventsFromWsdc = _parseEventsFromWsdcEventsPageHtml(raw_events_html, OPEN_WEATHER_MAP_API_KEY)
-  return eventsFromWsdc
+  # The page is only parsed when it differs from the one the cached events came from
+  page_hash = hashlib.sha1(raw_events_html.encode('utf-8')).hexdigest()
+  if page_hash != cache["page_hash"]:
+    cache["page_hash"] = page_hash
+    cache["events"] = _parse_events(raw_events_html)
+    print("Parsed {} events".format(len(cache["events"])))
+    changed = True
+  if changed:
+    save_events_cache(cache)
+  return _locate_events(cache["events"], OPEN_WEATHER_MAP_API_KEY)
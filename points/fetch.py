@@ -7,9 +7,26 @@ from dateutil.relativedelta import relativedelta
 import msgpack
 import gzip
 from os import environ
+import sys
 import time
+import tempfile
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from event_repository import get_events
-from dancer_repository import get_dancers
+from chunk_writer import ChunkWriter
+from event_competitors import EventCompetitorWriter
+from search_index import SearchIndexWriter
+from page_artifacts import DatabaseJsonWriter, JEKYLL_DANCERS_LIMIT, RETIRED_ARTIFACTS, jekyll_dancer, jekyll_database, leaderboard_dancer_ids, write_page_artifacts
+from artifact_writer import ArtifactWriter, content_hash
+from derived_cache import DerivedDancerCache
+from placement_table import PlacementTableWriter
+from tier_index import TierIndex
+from competable_divisions import CompetableDivisionRules
+from distribution import Distribution
+from leaderboard import Leaderboard, Leaderboards, window_start
+from build_report import BuildReport, BUILD_REPORT_FILE
+from dancer_repository import get_dancers, open_raw_responses, DEFAULT_CRAWLER_WORKERS, DEFAULT_CRAWLER_REQUESTS_PER_SECOND, DEFAULT_REFRESH_REQUEST_BUDGET
 
 FULL_DANCER_CHECK = False
 if "FULLDANCERCHECK" in environ:
@@ -17,8 +34,26 @@ if "FULLDANCERCHECK" in environ:
 SKIP_FETCH = False
 if "SKIPFETCH" in environ:
   SKIP_FETCH = True
-
-CHUNKED_DANCERS_SIZE = 20
+FULL_REBUILD = "--full" in sys.argv # Derive every dancer again instead of reusing cached ones
+
+CRAWLER_WORKERS = DEFAULT_CRAWLER_WORKERS
+if "CRAWLER_WORKERS" in environ:
+  CRAWLER_WORKERS = int(environ["CRAWLER_WORKERS"])
+CRAWLER_REQUESTS_PER_SECOND = DEFAULT_CRAWLER_REQUESTS_PER_SECOND
+if "CRAWLER_REQUESTS_PER_SECOND" in environ:
+  CRAWLER_REQUESTS_PER_SECOND = float(environ["CRAWLER_REQUESTS_PER_SECOND"])
+REFRESH_REQUEST_BUDGET = DEFAULT_REFRESH_REQUEST_BUDGET
+if "REFRESH_REQUEST_BUDGET" in environ:
+  REFRESH_REQUEST_BUDGET = int(environ["REFRESH_REQUEST_BUDGET"])
+
+DERIVATION_WORKERS = os.cpu_count() or 1
+if "DERIVATION_WORKERS" in environ:
+  DERIVATION_WORKERS = int(environ["DERIVATION_WORKERS"])
+DERIVATION_BATCH_SIZE = 500
+
+BUILD_REPORT_FILE = environ.get("BUILD_REPORT_FILE", BUILD_REPORT_FILE)
+BUILD_TRACE_MEMORY = "BUILD_TRACEMALLOC" in environ # Slows the build down by about half again
+BUILD_PROFILE_STAGE = environ.get("BUILD_PROFILE") # A stage name such as derivation, to run under cProfile
 
 OPEN_WEATHER_MAP_API_KEY = ""
 if "OPEN_WEATHER_MAP_API_KEY" in environ:
@@ -86,148 +121,30 @@ NEWCOMER = DIVISIONS_MAP_INVERTED['Newcomer']
 MASTERS = DIVISIONS_MAP_INVERTED['Masters']
 JUNIORS = DIVISIONS_MAP_INVERTED['Juniors']
 
-rule_change_date = datetime.datetime.strptime("January 2020", '%B %Y')
-first_place_points_dict = {}
-eventsFromWsdc = get_events(not SKIP_FETCH, OPEN_WEATHER_MAP_API_KEY)
-raw_response_dancers = get_dancers(not SKIP_FETCH, FULL_DANCER_CHECK)
-
-database = {
-    "last_updated": datetime.datetime.now().isoformat(),
-    'roles': ROLES_MAP,
-    'divisions': DIVISIONS_MAP,
-    'ordered_skill_divisions': SKILL_DIVISION_PROGRESSION,
-    "dancers": [],
-    "dancers_count": 0,
-    "events": [],
-    "events_count": 0,
-    'top_dancers_by_points_gained_recently': {},
-    'upcoming_events': eventsFromWsdc,
-    'new_dancers_over_time': [],
-    'division_progression': {"labels": [], "data": []},
+# Division and role leaderboards, {database key: (window in days, dancers from each group)}.
+# Every leaderboard is filled in the same pass over the dancers.
+LEADERBOARDS = {
+  'top_dancers_by_points_gained_recently': (90, 5),
 }
 
-def addEvents(_events, new_events):
-  for new_event in new_events:
-    event = None
-    for e in _events:
-        if e['id'] == new_event['id']:
-            event = e
-            break
-    if event is None:
-        event = {
-          "id": new_event["id"],
-          "name": new_event['name'],
-          "location": new_event['location'],
-          "url": new_event['url'],
-          'dates': [],
-        }
-        _events.append(event)
-    event['dates'].append(new_event['date'])
-    event['dates'] = list(set(event['dates']))
-    event['dates'].sort(reverse=True)
-    if event['dates'][-1] == new_event['date']:
-        # This is the most recent, so update info
-        event["name"] = new_event['name']
-        event["location"] = new_event['location']
-        event["url"] = new_event['url']
-  return _events
-
-new_dancers_by_date = {}
-
-def getSecondaryRoleCompetableDivisions(role_id, placements, primary_role_competable_divisons):
-  points_per_division = {}
-  for division in SKILL_DIVISION_PROGRESSION:
-    points_per_division[division] = 0
-  for placement in placements:
-    if placement["role"] != role_id:
-      continue
-    if placement["division"] not in points_per_division:
-      points_per_division[placement["division"]] = 0
-    points_per_division[placement["division"]] += placement["points"]
-  competableDivisions = []
-
-  highest_primary_role_division = primary_role_competable_divisons[0]
-  for division in SKILL_DIVISION_PROGRESSION:
-    if division in primary_role_competable_divisons:
-      highest_primary_role_division = division
-  
-  division_index = SKILL_DIVISION_PROGRESSION.index(highest_primary_role_division)
-  two_down = None
-  one_down = None
-  zero_down = highest_primary_role_division
-  if (division_index - 2) >= 0:
-    two_down = SKILL_DIVISION_PROGRESSION[division_index - 2]
-  if (division_index - 1) >= 0:
-    one_down = SKILL_DIVISION_PROGRESSION[division_index - 1]
-
-  # zero down
-  if points_per_division[zero_down] >= SKILL_DIVISION_LIMITS[zero_down][2] or one_down is None or points_per_division[one_down] >= SKILL_DIVISION_LIMITS[one_down][1]:
-    competableDivisions.append(zero_down)
-
-  # one down
-  if points_per_division[zero_down] < SKILL_DIVISION_LIMITS[zero_down][2]:
-    if one_down is not None and points_per_division[one_down] < SKILL_DIVISION_LIMITS[one_down][1]:
-      competableDivisions.append(one_down)
-
-  # two down
-  if (points_per_division[one_down] < SKILL_DIVISION_LIMITS[one_down][2]) and (points_per_division[zero_down] < SKILL_DIVISION_LIMITS[zero_down][2]):
-    if two_down is not None and points_per_division[two_down] < SKILL_DIVISION_LIMITS[two_down][0]:
-      competableDivisions.append(two_down)
-
-  return competableDivisions
-
-def getCompetableDivisions(role_id, placements, primary_role_competable_divisons = None):
-  is_primary_role = primary_role_competable_divisons is None
-  if not is_primary_role:
-    return getSecondaryRoleCompetableDivisions(role_id, placements, primary_role_competable_divisons)
-  points_per_division = {}
-  for placement in placements:
-    if placement["role"] != role_id:
-      continue
-    if placement["division"] not in points_per_division:
-      points_per_division[placement["division"]] = 0
-    points_per_division[placement["division"]] += placement["points"]
-  competableDivisions = []
-
-  if CHAMPIONS in points_per_division:
-    competableDivisions.append(CHAMPIONS)
-    if points_per_division[CHAMPIONS] < SKILL_DIVISION_LIMITS[CHAMPIONS][1]:
-      competableDivisions.append(ALLSTARS)
-
-  elif ALLSTARS in points_per_division:
-    if points_per_division[ALLSTARS] >= SKILL_DIVISION_LIMITS[ALLSTARS][0]:
-      competableDivisions.append(CHAMPIONS)
-    if points_per_division[ALLSTARS] < SKILL_DIVISION_LIMITS[ALLSTARS][1]:
-      competableDivisions.append(ALLSTARS)
-
-  elif ADVANCED in points_per_division:
-    if points_per_division[ADVANCED] >= SKILL_DIVISION_LIMITS[ADVANCED][0]:
-      competableDivisions.append(ALLSTARS)
-    if points_per_division[ADVANCED] < SKILL_DIVISION_LIMITS[ADVANCED][1]:
-      competableDivisions.append(ADVANCED)
-
-  elif INTERMEDIATE in points_per_division:
-    if points_per_division[INTERMEDIATE] >= SKILL_DIVISION_LIMITS[INTERMEDIATE][0]:
-      competableDivisions.append(ADVANCED)
-    if points_per_division[INTERMEDIATE] < SKILL_DIVISION_LIMITS[INTERMEDIATE][1]:
-      competableDivisions.append(INTERMEDIATE)
-
-  elif NOVICE in points_per_division:
-    if points_per_division[NOVICE] >= SKILL_DIVISION_LIMITS[NOVICE][0]:
-      competableDivisions.append(INTERMEDIATE)
-    if points_per_division[NOVICE] < SKILL_DIVISION_LIMITS[NOVICE][1]:
-      competableDivisions.append(NOVICE)
-
-  elif NEWCOMER in points_per_division:
-    competableDivisions.append(NOVICE)
-
-  else:
-    competableDivisions.append(NOVICE)
-    competableDivisions.append(NEWCOMER)
-
-  return competableDivisions
-
-def addEarliestPlacement(dateOne: datetime.datetime|None, dateTwo: datetime.datetime|None):
+rule_change_date = datetime.datetime.strptime("January 2020", '%B %Y')
+
+# Cached derived dancers are rebuilt when the rules change. Bump DERIVATION_CODE_VERSION when a
+# change to the code below changes what a dancer derives to.
+DERIVATION_CODE_VERSION = 3
+DERIVATION_RULES_VERSION = content_hash(json.dumps([
+  DERIVATION_CODE_VERSION,
+  LIMIT_TO_DANCE_STYLE,
+  list(ROLES_MAP.items()),
+  list(DIVISIONS_MAP.items()),
+  SKILL_DIVISION_PROGRESSION,
+  list(SKILL_DIVISION_LIMITS.items()),
+  rule_change_date.isoformat(),
+]).encode('utf-8'))
+
+COMPETABLE_DIVISIONS = CompetableDivisionRules(SKILL_DIVISION_PROGRESSION, SKILL_DIVISION_LIMITS)
+
+def addEarliestPlacement(new_dancers_by_date, dateOne: datetime.datetime|None, dateTwo: datetime.datetime|None):
   if dateOne is None and dateTwo is None:
     return
   d = dateOne
@@ -241,7 +158,10 @@ def addEarliestPlacement(dateOne: datetime.datetime|None, dateTwo: datetime.date
     new_dancers_by_date[date_string] = 0
   new_dancers_by_date[date_string] += 1
 
-def placementsToList(placements, raw_dancer):
+def placementsToList(placements, raw_dancer, first_place_points, points_by_role = None):
+    # points_by_role, when given, collects {role: {division: points}} for CompetableDivisionRules
+    if points_by_role is None:
+      points_by_role = {}
     final_placements = []
     final_events = []
     earliest_event = None
@@ -274,6 +194,10 @@ def placementsToList(placements, raw_dancer):
                 final_events.append(event)
                 role = competition["role"].title()
                 role = ROLES_MAP_INVERTED[role]
+                role_points = points_by_role.get(role)
+                if role_points is None:
+                  role_points = points_by_role[role] = {}
+                role_points[division_id] = role_points.get(division_id, 0) + points
                 final_placements.append({
                     "role": role,
                     "result": competition["result"],
@@ -284,33 +208,22 @@ def placementsToList(placements, raw_dancer):
                 })
 
                 if competition["result"] == "1" and datetime.datetime.fromisoformat(event["date"]) >= rule_change_date:
-                  if event["id"] not in first_place_points_dict:
-                    first_place_points_dict[event["id"]] = {}
-                  if event["date"] not in first_place_points_dict[event["id"]]:
-                    first_place_points_dict[event["id"]][event["date"]] = {}
-                  if division_id not in first_place_points_dict[event["id"]][event["date"]]:
-                    first_place_points_dict[event["id"]][event["date"]][division_id] = {}
-                  first_place_points_dict[event["id"]][event["date"]][division_id][role] = points
+                  first_place_points.append([event["id"], event["date"], division_id, role, points])
                   
     return (final_placements, final_events, earliest_event)
 
-for raw_response_dancer_wsdc_id in raw_response_dancers:
-    datum = raw_response_dancers[raw_response_dancer_wsdc_id]
-    leader = placementsToList(datum["leader"]["placements"], datum)
-    follower = placementsToList(datum["follower"]["placements"], datum)
-    addEarliestPlacement(leader[2], follower[2])
+def derive_dancer(datum, first_place_points, new_dancers_by_date):
+    points_by_role = {}
+    leader = placementsToList(datum["leader"]["placements"], datum, first_place_points, points_by_role)
+    follower = placementsToList(datum["follower"]["placements"], datum, first_place_points, points_by_role)
+    addEarliestPlacement(new_dancers_by_date, leader[2], follower[2])
     dancer_placements = leader[0] + follower[0]
     dancer_placements.sort(key=lambda p: p["date"], reverse=True)
 
     primary_role_id = ROLES_MAP_INVERTED[datum["short_dominate_role"]]
     competable_roles = [LEADER, FOLLOWER]
-    primary_role_competable_divisons = getCompetableDivisions(primary_role_id, dancer_placements)
     competable_roles = [r for r in competable_roles if r != primary_role_id]
-    divisions = {
-      primary_role_id: primary_role_competable_divisons
-    }
-    for cr in competable_roles:
-      divisions[cr] = getCompetableDivisions(cr, dancer_placements, primary_role_competable_divisons)
+    divisions = COMPETABLE_DIVISIONS.divisions_for_points(primary_role_id, competable_roles, points_by_role)
 
     res = {
       'id': datum['dancer_wsdcid'],
@@ -320,120 +233,112 @@ for raw_response_dancer_wsdc_id in raw_response_dancers:
       'placements': dancer_placements,
       'divisions': divisions,
     }
-    if len(res['placements']) > 0:
-        database["dancers"].append(res)
-        database["events"] = addEvents(database["events"], leader[1])
-        database["events"] = addEvents(database["events"], follower[1])
-
-database["events"].sort(key=lambda kv: kv["id"], reverse=True)
-
-# Add tier info to events
-def get_tier(event_object, date_string, division_key, role_key):
-  first_place_points = None
-
-  if event_object["id"] in first_place_points_dict and date_string in first_place_points_dict[event_object["id"]] and division_key in first_place_points_dict[event_object["id"]][date_string] and role_key in first_place_points_dict[event_object["id"]][date_string][division_key]:
-    first_place_points = first_place_points_dict[event_object["id"]][date_string][division_key][role_key]
-
-  if first_place_points is None:
-    return None
-  if first_place_points == 3:
-    return "Tier 1, 5 - 10 competitors"
-  if first_place_points == 6:
-    return "Tier 2, 11 - 19 competitors"
-  if first_place_points == 10:
-    return "Tier 3, 20 - 39 competitors"
-  if first_place_points == 15:
-    return "Tier 4, 40 - 79 competitors"
-  if first_place_points == 20:
-    return "Tier 5, 80 - 129 competitors"
-  if first_place_points == 25:
-    return "Tier 6, 130+ competitors"
-  print("Invalid number of points: {} {} {} {} {}".format(first_place_points, event_object["id"], date_string, division_key, role_key))
-  return None
-
-for event in database["events"]:
-  event["dates"] = [{"date": d, "divisions": {}} for d in event["dates"]]
-  for date_object in event["dates"]:
-    for division_key in DIVISIONS_MAP:
-      division = DIVISIONS_MAP[division_key]
-      for role_key in ROLES_MAP:
-        role = ROLES_MAP[role_key]
-        tier = get_tier(event, date_object["date"], division_key, role_key)
-        if tier is not None:
-          if division not in date_object["divisions"]:
-            date_object["divisions"][division] = {}
-          date_object["divisions"][division][role] = tier
-
+    return (res, leader[1], follower[1])
+
+def derive_contribution(datum):
+  # A dancer's record together with everything it adds to the global aggregates
+  first_place_points = []
+  new_dancers_by_date = {}
+  (dancer, leader_events, follower_events) = derive_dancer(datum, first_place_points, new_dancers_by_date)
+  return [dancer, leader_events, follower_events, first_place_points, new_dancers_by_date, division_progression_rows(dancer)]
+
+def derive_batch(raw_batch):
+  # Runs in a worker process, raw_batch is [(wsdc_id, raw response)]
+  return [(wsdc_id, derive_contribution(datum)) for (wsdc_id, datum) in raw_batch]
+
+def raw_batches(raw_items, batch_size: int):
+  batch = []
+  for item in raw_items:
+    batch.append(item)
+    if len(batch) >= batch_size:
+      yield batch
+      batch = []
+  if len(batch) > 0:
+    yield batch
+
+def derive_batches(batches, workers: int):
+  # Yields derive_batch results in batch order, with at most two batches per worker in flight
+  if workers <= 1:
+    for batch in batches:
+      yield derive_batch(batch)
+    return
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    pending = deque()
+    for batch in batches:
+      pending.append(executor.submit(derive_batch, batch))
+      if len(pending) >= workers * 2:
+        yield pending.popleft().result()
+    while len(pending) > 0:
+      yield pending.popleft().result()
+
+def derive_contributions(raw_items, workers: int = DERIVATION_WORKERS, batch_size: int = DERIVATION_BATCH_SIZE):
+  # Yields (wsdc_id, contribution) in the order of raw_items. Batches are derived in parallel.
+  for derived in derive_batches(raw_batches(raw_items, batch_size), workers):
+    for result in derived:
+      yield result
+
+def update_derived_cache(derived_cache: DerivedDancerCache, raw_response_dancers, workers: int = DERIVATION_WORKERS):
+  # Derives only dancers whose raw response or rules changed since they were cached
+  stale = derived_cache.stale_ids(raw_response_dancers.hashes())
+  stale_items = ((wsdc_id, raw_response_dancers[wsdc_id]) for wsdc_id in stale)
+  for (wsdc_id, contribution) in derive_contributions(stale_items, workers):
+    derived_cache.put(wsdc_id, stale[wsdc_id], contribution)
+  derived_cache.commit()
+  print("Derived {} new or changed dancers".format(len(stale)))
+  return derived_cache
+
+class SpilledDancers:
+  # Derived dancers are packed to a temporary file as they stream past, so later passes can
+  # read them back one at a time in id order without holding every dancer in memory
+  def __init__(self):
+    self.file = tempfile.TemporaryFile()
+    self.offsets = {} # id: (offset, length)
+
+  def add(self, dancer):
+    packed = msgpack.packb(dancer)
+    self.offsets[dancer["id"]] = (self.file.tell(), len(packed))
+    self.file.write(packed)
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def iter_by_id(self, reverse: bool = False):
+    for dancer_id in sorted(self.offsets, reverse=reverse):
+      (offset, length) = self.offsets[dancer_id]
+      self.file.seek(offset)
+      yield msgpack.unpackb(self.file.read(length), strict_map_key=False)
+    self.file.seek(0, 2)
+
+  def close(self):
+    self.file.close()
 
 # Get how many new dancers by month
-new_dancers_over_time = [{'key': k, 'value': new_dancers_by_date[k]} for k in new_dancers_by_date.keys()]
-new_dancers_over_time.sort(key=lambda kv: datetime.date.fromisoformat(kv['key']))
-for kv in new_dancers_over_time:
-  kv['key'] = "{:'%y}".format(datetime.date.fromisoformat(kv['key']))
-database['new_dancers_over_time'] = new_dancers_over_time
-
-# Find "up and coming dancers", top 5 for each role/division by points received in the last 3 months
-
-min_date = (datetime.date.today().replace(day=1) - datetime.timedelta(days=90)).replace(day=1) # 3 months ago
-from_each_group = 5
-
-divisions = {} # [novice/beginner/advanced][leader/follower] = {wscid: int, points: int}[]
-
-for dancer in database["dancers"]:
-    for placement in dancer["placements"]:
-        if datetime.date.fromisoformat(placement["date"]) < min_date:
-            continue
-        _points = placement["points"]
-        _division = placement["division"]
-        _role = placement["role"]
-        if _division not in divisions:
-            divisions[_division] = {}
-        if _role not in divisions[_division]:
-            divisions[_division][_role] = {}
-        if dancer['id'] not in divisions[_division][_role]:
-            divisions[_division][_role][dancer['id']] = 0
-        divisions[_division][_role][dancer['id']] += _points
-
-database["dancers"].sort(key=lambda kv: kv["id"], reverse=True)
-
-sorted_divisions = {}
-for division in divisions:
-    sorted_divisions[division] = {}
-    for role in divisions[division]:
-        chunked_sorted = sorted(divisions[division][role].items(), key=lambda item: item[1], reverse=True)[0:from_each_group]
-        sorted_divisions[division][role] = {d[0]: d[1] for d in chunked_sorted}
-
-unkeyed_by_division = []
-for division in sorted_divisions:
-  unkeyed_division = {
-    'division': division,
-    'roles': [],
-  }
-  for role in sorted_divisions[division]:
-    unkeyed_role = {
+def get_new_dancers_over_time(new_dancers_by_date):
+  new_dancers_over_time = [{'key': k, 'value': new_dancers_by_date[k]} for k in new_dancers_by_date.keys()]
+  new_dancers_over_time.sort(key=lambda kv: datetime.date.fromisoformat(kv['key']))
+  for kv in new_dancers_over_time:
+    kv['key'] = "{:'%y}".format(datetime.date.fromisoformat(kv['key']))
+  return new_dancers_over_time
+
+# Find "up and coming dancers", the top dancers for each role/division by points received recently
+
+def get_top_dancers_by_points_gained_recently(leaderboard: Leaderboard):
+  # Shapes a division and role leaderboard the way dancers-on-the-rise.html reads it
+  roles_by_division = {}
+  for ((division, role), dancers) in leaderboard.top().items():
+    roles_by_division.setdefault(division, []).append({
       'role': role,
-      'dancers': [],
-    }
-    for dancer_id in sorted_divisions[division][role]:
-      unkeyed_dancer = {
-        'points': sorted_divisions[division][role][dancer_id],
-        'wscdid': dancer_id,
-      }
-      unkeyed_role['dancers'].append(unkeyed_dancer)
-    unkeyed_role['dancers'] = sorted(unkeyed_role['dancers'], key=lambda dancer: dancer['points'], reverse=True)
-    unkeyed_division['roles'].append(unkeyed_role)
-  unkeyed_division['roles'] = sorted(unkeyed_division['roles'], key=lambda role: role['role'])
-  unkeyed_by_division.append(unkeyed_division)
-unkeyed_by_division = sorted(unkeyed_by_division, key=lambda division: DIVISIONS_IN_SORT_ORDER.index(division['division']), reverse=False)
-
-database["top_dancers_by_points_gained_recently"] = unkeyed_by_division
-
+      'dancers': [{'points': points, 'wscdid': dancer_id} for (dancer_id, points) in dancers],
+    })
+  return [{
+    'division': division,
+    'roles': sorted(roles_by_division[division], key=lambda role: role['role']),
+  } for division in sorted(roles_by_division, key=lambda division: DIVISIONS_IN_SORT_ORDER.index(division))]
 
 # Division Progression
-divisions_plus_top = database['ordered_skill_divisions']
-data_all_by_key = {}
-
-for dancer in database["dancers"]:
+def division_progression_rows(dancer):
+  # [[from division, days to reach the next division, year the from division was reached]] for
+  # each division the dancer moved on from in their primary role
   earliest_date_by_division = {}
 
   for placement in dancer["placements"]:
@@ -446,60 +351,179 @@ for dancer in database["dancers"]:
     elif placement_date < earliest_date_by_division[placement["division"]]:
         earliest_date_by_division[placement["division"]] = placement_date
 
-  for i in range(1, len(divisions_plus_top)):
-    from_division = divisions_plus_top[i-1]
-    to_division = divisions_plus_top[i]
+  rows = []
+  for i in range(1, len(SKILL_DIVISION_PROGRESSION)):
+    from_division = SKILL_DIVISION_PROGRESSION[i-1]
+    to_division = SKILL_DIVISION_PROGRESSION[i]
     if not (from_division in earliest_date_by_division and to_division in earliest_date_by_division):
       continue
     from_division_date = earliest_date_by_division[from_division]
     to_division_date = earliest_date_by_division[to_division]
-    days = abs((to_division_date - from_division_date).days)
-    if from_division not in data_all_by_key:
-      data_all_by_key[from_division] = []
-    data_all_by_key[from_division].append(days)
-
-for i in range(0, len(divisions_plus_top) - 1):
-  from_division = divisions_plus_top[i]
-  database["division_progression"]["labels"].append(database["divisions"][from_division])
-  database["division_progression"]["data"].append(data_all_by_key[from_division])
+    rows.append([from_division, abs((to_division_date - from_division_date).days), from_division_date.year])
+  return rows
+
+def add_division_progression(progression, counts):
+  # counts is [(from division, primary role, year, days, dancers)]. progression is
+  # {(from division, group): Distribution} of days to reach the next division, for every dancer
+  # under the group "all", by primary role under the role id and by the year they reached the from
+  # division under ("cohort", year)
+  for (from_division, role, year, days, count) in counts:
+    for group in ["all", role, ("cohort", year)]:
+      if (from_division, group) not in progression:
+        progression[(from_division, group)] = Distribution()
+      progression[(from_division, group)].add(days, count)
+  return progression
+
+def get_division_progression(progression):
+  # A fixed size summary for each transition: boxplot stats and a histogram over every dancer,
+  # boxplot stats for each primary role and quantiles for each cohort year
+  from_divisions = SKILL_DIVISION_PROGRESSION[:-1]
+  empty = Distribution()
+  cohort_years = sorted(set(group[1] for (_, group) in progression if type(group) is tuple))
+  return {
+    "labels": [DIVISIONS_MAP[d] for d in from_divisions],
+    "data": [progression.get((d, "all"), empty).boxplot() for d in from_divisions],
+    "histograms": [progression.get((d, "all"), empty).histogram() for d in from_divisions],
+    "roles": {ROLES_MAP[role]: [progression.get((d, role), empty).boxplot() for d in from_divisions] for role in [LEADER, FOLLOWER]},
+    "cohorts": {str(year): [progression.get((d, ("cohort", year)), empty).quantiles() for d in from_divisions] for year in cohort_years},
+  }
 
 # End Division Progression
 
-database["dancers_count"] = len(database["dancers"])
-database["events_count"] = len(database["events"])
-
-# Write to file, leave at bottom of this script
-with open("../assets/database.txt", 'bw') as f:
-    contents = msgpack.packb(database)
-    f.write(contents)
-
-# Write only events to file, leave at bottom of this script
-with open("../assets/events.txt", 'bw') as f:
-    contents = msgpack.packb({ "events": database["events"] })
-    f.write(contents)
-
-# Write to json for jekyll, leave at bottom of this script
-with open("../_data/database.json", 'w') as f:
-    json.dump(database, f)
-
-# Write out chunked dancers # WARNING THIS MODIFIES THE DATABASE OBJECT
-i = 0
-max_wsdc_id = database["dancers"][0]["id"]
-while i <= max_wsdc_id:
-  top = i + CHUNKED_DANCERS_SIZE
-  chunk_ingress = [d for d in database["dancers"] if d["id"] >= i and d["id"] < top]
-  for dancer in chunk_ingress:
-      dancer["primary_role"] = database["roles"][dancer["primary_role"]]
-      for placement in dancer["placements"]:
-        placement["division"] = database["divisions"][placement["division"]]
-        placement["role"] = database["roles"][placement["role"]]
-        placement["event"] = [e for e in database["events"] if e["id"] == placement["event"]][0]
-        if "dates" in placement["event"]:
-          del placement["event"]["dates"]
-        if "url" in placement["event"]:
-          del placement["event"]["url"]
-      dancer["divisions"] = {database["roles"][k]:[database["divisions"][d] for d in v] for k,v in dancer["divisions"].items()}
-  with open("../assets/chunks/dancers_{}-{}.txt".format(i, i+CHUNKED_DANCERS_SIZE), 'bw') as f:
-    contents = msgpack.packb({"dancers": chunk_ingress},)
-    f.write(contents)
-  i += CHUNKED_DANCERS_SIZE
+def main():
+  report = BuildReport(BUILD_REPORT_FILE, BUILD_TRACE_MEMORY, BUILD_PROFILE_STAGE, {
+    "skip_fetch": SKIP_FETCH,
+    "full_dancer_check": FULL_DANCER_CHECK,
+    "full_rebuild": FULL_REBUILD,
+    "crawler_workers": CRAWLER_WORKERS,
+    "crawler_requests_per_second": CRAWLER_REQUESTS_PER_SECOND,
+    "refresh_request_budget": REFRESH_REQUEST_BUDGET,
+    "derivation_workers": DERIVATION_WORKERS,
+  })
+
+  with report.stage("fetch_events") as stage:
+    eventsFromWsdc = get_events(not SKIP_FETCH, OPEN_WEATHER_MAP_API_KEY)
+    stage.items["events"] = len(eventsFromWsdc)
+  with report.stage("raw_load") as stage:
+    raw_response_dancers = open_raw_responses()
+    stage.items["raw_responses"] = len(raw_response_dancers)
+  with report.stage("fetch_dancers") as stage:
+    records_written = raw_response_dancers.records_written
+    raw_response_dancers = get_dancers(raw_response_dancers, not SKIP_FETCH, FULL_DANCER_CHECK, CRAWLER_WORKERS, CRAWLER_REQUESTS_PER_SECOND, eventsFromWsdc, REFRESH_REQUEST_BUDGET)
+    stage.items["raw_responses"] = len(raw_response_dancers)
+    stage.items["raw_responses_written"] = raw_response_dancers.records_written - records_written
+
+  database = {
+      "last_updated": datetime.datetime.now().isoformat(),
+      'roles': ROLES_MAP,
+      'divisions': DIVISIONS_MAP,
+      'ordered_skill_divisions': SKILL_DIVISION_PROGRESSION,
+      "dancers": [],
+      "dancers_count": 0,
+      "events": [],
+      "events_count": 0,
+      'top_dancers_by_points_gained_recently': {},
+      'upcoming_events': eventsFromWsdc,
+      'new_dancers_over_time': [],
+      'division_progression': {"labels": [], "data": [], "histograms": [], "roles": {}, "cohorts": {}},
+  }
+
+  leaderboards = Leaderboards({key: Leaderboard(window_start(datetime.date.today(), days), k) for (key, (days, k)) in LEADERBOARDS.items()})
+  progression = {}
+
+  # Only dancers whose raw response changed are derived again, everyone else comes from the cache
+  with report.stage("derivation") as stage:
+    derived_cache = DerivedDancerCache(DERIVATION_RULES_VERSION)
+    if FULL_REBUILD:
+      derived_cache.clear()
+    update_derived_cache(derived_cache, raw_response_dancers, DERIVATION_WORKERS)
+    raw_response_dancers.close()
+    stage.items["dancers_derived"] = derived_cache.records_written
+
+  # Events, tiers and new dancers by date are kept up to date in the cache as dancers are derived
+  with report.stage("event_aggregation") as stage:
+    events = derived_cache.events()
+    stage.items["events"] = len(events)
+
+  with report.stage("tiers") as stage:
+    tier_index = TierIndex()
+    tier_index.add_entries(derived_cache.first_place_points())
+    database["events"] = tier_index.annotate(events, DIVISIONS_MAP, ROLES_MAP)
+    stage.items["events"] = len(database["events"])
+    stage.items["first_places"] = len(tier_index)
+
+  # First pass: stream each dancer with placements into the leaderboards, which depend on today's
+  # date and so are built fresh, and spill it to disk. Division progression is summed from the cache.
+  with report.stage("analytics") as stage:
+    spilled_dancers = SpilledDancers()
+    for dancer in derived_cache.dancers():
+      if len(dancer['placements']) == 0:
+        continue
+      leaderboards.add_dancer(dancer)
+      spilled_dancers.add(dancer)
+    progression = add_division_progression(progression, derived_cache.division_progression_counts())
+    database['new_dancers_over_time'] = get_new_dancers_over_time(derived_cache.new_dancers_by_date())
+    for key in LEADERBOARDS:
+      database[key] = get_top_dancers_by_points_gained_recently(leaderboards[key])
+    database["division_progression"] = get_division_progression(progression)
+    database["dancers_count"] = len(spilled_dancers)
+    database["events_count"] = len(database["events"])
+    stage.items["dancers"] = len(spilled_dancers)
+    stage.items["leaderboards"] = len(LEADERBOARDS)
+    stage.items["division_progression_groups"] = len(progression)
+
+  # Every artifact goes through the artifact writer, which leaves files with unchanged bytes untouched.
+  # If the build fails part way, the temporary files of unfinished artifacts are removed.
+  with ArtifactWriter() as artifacts:
+    # Write only events to file
+    with report.stage("serialise_events") as stage:
+      artifacts.write_bytes("assets/events.txt", msgpack.packb({ "events": database["events"] }))
+      stage.items["events"] = len(database["events"])
+
+    # Second pass: stream dancers, highest id first, writing the newest into the jekyll json, and
+    # invert their placements into per event competitor lists and search postings
+    with report.stage("serialise_dancers") as stage:
+      json_writer = DatabaseJsonWriter(artifacts.open("_data/database.json"), jekyll_database(database))
+      event_competitors = EventCompetitorWriter(ROLES_MAP, DIVISIONS_MAP, artifacts, "assets/event_competitors")
+      search_index = SearchIndexWriter(artifacts, "assets/search")
+      leaderboard_ids = leaderboard_dancer_ids(database, LEADERBOARDS)
+      leaderboard_names = {}
+      for dancer in spilled_dancers.iter_by_id(reverse=True):
+        if json_writer.dancers_written < JEKYLL_DANCERS_LIMIT:
+          json_writer.write_dancer(jekyll_dancer(dancer))
+        event_competitors.add_dancer(dancer)
+        search_index.add_dancer(dancer)
+        if dancer["id"] in leaderboard_ids:
+          leaderboard_names[dancer["id"]] = dancer["name"]
+      json_writer.close()
+      event_competitors.close()
+      search_index.close()
+      stage.items["dancers"] = len(spilled_dancers)
+
+    with report.stage("serialise_pages"):
+      write_page_artifacts(artifacts, database, LEADERBOARDS, leaderboard_names)
+      for relative_path in RETIRED_ARTIFACTS:
+        artifacts.remove(relative_path)
+
+    # Third pass: chunks are packed lowest id first, so new dancers only change the last chunk.
+    # The columnar placement table for analytics is filled in the same pass.
+    with report.stage("chunk_write") as stage:
+      chunk_writer = ChunkWriter(database["events"], ROLES_MAP, DIVISIONS_MAP, artifacts, "assets/chunks", "assets/chunk_index.txt")
+      placement_table = PlacementTableWriter()
+      for dancer in spilled_dancers.iter_by_id():
+        chunk_writer.write_dancer(dancer)
+        placement_table.add_dancer(dancer)
+      chunk_writer.close()
+      placement_table.close()
+      spilled_dancers.close()
+      derived_cache.close()
+      artifacts.close()
+      stage.items["dancers"] = len(spilled_dancers)
+      stage.items["artifacts_written"] = artifacts.written
+      stage.items["artifacts_unchanged"] = artifacts.unchanged
+
+  build = report.write()
+  print("Build took {:.1f}s, peak memory: {} MB, report in {}".format(build["wall_seconds"], build["peak_rss_mb"], BUILD_REPORT_FILE))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,176 @@
+import datetime
+import json
+import os
+import re
+from http_client import HttpClient
+
+GEOCODE_URL = "http://api.openweathermap.org/geo/1.0/direct"
+GEOCODE_REQUESTS_PER_SECOND = 1 / 1.1 # One lookup every 1.1 seconds, as the lookups were always spaced
+MISSING_LOCATION_TTL_DAYS = 30 # Locations without a result are looked up again after this long
+FLUSH_EVERY_LOOKUPS = 10 # Lookups between writes of the cache file, so a crash loses at most this many
+
+# Last parts of a location that name the same region, for the offline fallback
+REGION_ALIASES = {
+  "usa": "us", "united states": "us", "united states of america": "us",
+  "united kingdom": "uk", "united kindom": "uk", "england": "uk", "scotland": "uk",
+  "deutschland": "germany", "nederland": "netherlands", "the netherlands": "netherlands",
+  "sverige": "sweden", "polska": "poland", "italia": "italy", "belgique": "belgium",
+  "czechia": "czech republic", "korea": "south korea", "isreal": "israel", "finalnd": "finland",
+}
+
+# The location cache file:
+# {
+#   location: [latitude, longitude], for locations with a result, kept for good
+#   location: {"missing": iso date}, for locations without one, until MISSING_LOCATION_TTL_DAYS later
+# }
+# Older files marked locations without a result with [], these are looked up again.
+
+def normalize_location(location: str|None):
+  # Single spaced, and ", " between parts, so spellings that only differ in spacing share an entry
+  if location is None:
+    return ""
+  parts = [re.sub(r"\s+", " ", part).strip() for part in location.split(",")]
+  return ", ".join(part for part in parts if part != "")
+
+def _is_us_state(parts):
+  return len(parts) > 1 and len(parts[1]) == 2 and parts[1].isupper() and parts[1] != "UK"
+
+def requestable_location(location: str):
+  # "City, ST" reads as a US state, which the geocoding API only finds with the country added
+  parts = [part.strip() for part in location.split(",")]
+  if _is_us_state(parts):
+    if len(parts) < 3:
+      parts.append("US")
+    else:
+      parts[2] = "US"
+  return ",".join(parts)
+
+def region_key(location: str):
+  # The region a location is in, its US state or otherwise its last part, or None
+  parts = [part.strip() for part in location.split(",") if part.strip() != ""]
+  if len(parts) == 0:
+    return None
+  if _is_us_state(parts):
+    return "us:" + parts[1]
+  last = parts[-1].casefold().rstrip(".")
+  return REGION_ALIASES.get(last, last)
+
+class LocationCache:
+  # The location cache file, written atomically: to a temporary file, then renamed over the old one
+  def __init__(self, path: str):
+    self.path = path
+    self.entries = {}
+    self.dirty = False
+    if os.path.exists(path):
+      with open(path, "r") as f:
+        for (location, entry) in json.load(f).items():
+          self.entries[normalize_location(location)] = entry
+
+  def get(self, location: str, today: datetime.date):
+    # (True, (latitude, longitude) or None) when the cache has an answer, (False, None) otherwise
+    entry = self.entries.get(location)
+    if type(entry) is list and len(entry) >= 2:
+      return (True, (entry[0], entry[1]))
+    if type(entry) is dict and entry["missing"] > (today - datetime.timedelta(days=MISSING_LOCATION_TTL_DAYS)).isoformat():
+      return (True, None)
+    return (False, None)
+
+  def put(self, location: str, latlon):
+    self.entries[location] = [latlon[0], latlon[1]]
+    self.dirty = True
+
+  def put_missing(self, location: str, today: datetime.date):
+    self.entries[location] = {"missing": today.isoformat()}
+    self.dirty = True
+
+  def regions(self):
+    # {region key: (latitude, longitude)}, the mean of the cached locations in each region. US
+    # states also count towards "us".
+    sums = {}
+    for (location, entry) in self.entries.items():
+      key = region_key(location)
+      if type(entry) is not list or len(entry) < 2 or key is None:
+        continue
+      for k in [key, "us"] if key.startswith("us:") else [key]:
+        total = sums.setdefault(k, [0.0, 0.0, 0])
+        total[0] += entry[0]
+        total[1] += entry[1]
+        total[2] += 1
+    return {k: (latitude / count, longitude / count) for (k, (latitude, longitude, count)) in sums.items()}
+
+  def flush(self):
+    if not self.dirty:
+      return
+    temporary_path = self.path + ".tmp"
+    with open(temporary_path, "w") as f:
+      json.dump(self.entries, f)
+    os.replace(temporary_path, self.path)
+    self.dirty = False
+
+class Geocoder:
+  # Resolves a batch of locations: cached ones straight away, the rest one at a time through a rate
+  # limited client that retries 429/5xx. Once the API fails, or without an API key, the rest fall
+  # back to the mean of the cached locations in their region, which is not cached.
+  def __init__(self, api_key: str, cache: LocationCache, client: HttpClient|None = None):
+    self.api_key = api_key
+    self.cache = cache
+    self.client = client
+    self.available = api_key != ""
+    self.lookups = 0
+
+  def _lookup(self, location: str):
+    # (True, (latitude, longitude) or None) for an answer from the API, (False, None) when it failed
+    if self.client is None:
+      self.client = HttpClient(requests_per_second=GEOCODE_REQUESTS_PER_SECOND)
+    response = self.client.get(GEOCODE_URL, params={"q": requestable_location(location), "limit": 1, "appid": self.api_key})
+    self.lookups += 1
+    if response is None or not response.ok:
+      print("Geocoding failed for location {}: {}".format(location, "no response" if response is None else response.status_code))
+      return (False, None)
+    results = response.json()
+    if len(results) < 1:
+      return (True, None)
+    return (True, (results[0]["lat"], results[0]["lon"]))
+
+  def resolve(self, locations, today: datetime.date|None = None):
+    # {location: (latitude, longitude) or None} for each distinct location, after normalize_location
+    today = today or datetime.date.today()
+    resolved = {}
+    misses = []
+    for location in sorted(set(normalize_location(l) for l in locations)):
+      if location == "":
+        resolved[location] = None
+        continue
+      (hit, latlon) = self.cache.get(location, today)
+      if hit:
+        resolved[location] = latlon
+      else:
+        misses.append(location)
+
+    regions = None
+    for location in misses:
+      if self.available:
+        (answered, latlon) = self._lookup(location)
+        if answered:
+          if latlon is None:
+            print("No results for location {}".format(location))
+            self.cache.put_missing(location, today)
+          else:
+            self.cache.put(location, latlon)
+          resolved[location] = latlon
+          if self.lookups % FLUSH_EVERY_LOOKUPS == 0:
+            self.cache.flush()
+          continue
+        self.available = False
+      if regions is None:
+        regions = self.cache.regions()
+      key = region_key(location)
+      latlon = regions.get(key) if key is not None else None
+      if latlon is None and key is not None and key.startswith("us:"):
+        latlon = regions.get("us")
+      print("Approximated location {} from region {}".format(location, key) if latlon is not None else "No offline region for location {}".format(location))
+      resolved[location] = latlon
+
+    self.cache.flush()
+    print("Resolved {} locations, {} from the cache, {} looked up".format(len(resolved), len(resolved) - len(misses), self.lookups))
+    return resolved
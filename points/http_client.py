@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from distribution import Distribution
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+REQUEST_TIMEOUT_SECONDS = 30
+
+class TokenBucket:
+  # Blocking token bucket shared by every worker thread. A rate of 0 or less disables limiting.
+  def __init__(self, rate: float, capacity: float|None = None):
+    self.rate = rate
+    self.capacity = capacity if capacity is not None else max(1.0, rate)
+    self.tokens = self.capacity
+    self.updated_at = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    if self.rate <= 0:
+      return
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        wait = (1 - self.tokens) / self.rate
+      time.sleep(wait)
+
+class HttpStats:
+  # Requests, retries, bytes received, status codes and latency in milliseconds, shared by every
+  # client in the process so the build report can attribute them to the stage that made them
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    self.requests = 0
+    self.retries = 0
+    self.bytes = 0
+    self.status_codes = {}
+    self.latency_ms = Distribution()
+
+  def record(self, retried: bool, response, seconds: float):
+    status = str(response.status_code) if response is not None else "error"
+    with self.lock:
+      self.requests += 1
+      if retried:
+        self.retries += 1
+      if response is not None:
+        self.bytes += len(response.content)
+      self.status_codes[status] = self.status_codes.get(status, 0) + 1
+      self.latency_ms.add(round(seconds * 1000))
+
+  def take(self):
+    # The stats since the last take, as a dict, and starts counting again
+    with self.lock:
+      latency = self.latency_ms
+      stats = {
+        "requests": self.requests,
+        "retries": self.retries,
+        "bytes": self.bytes,
+        "status_codes": dict(sorted(self.status_codes.items())),
+        "latency_ms": None if latency.count == 0 else {
+          "p50": latency.quantile(0.5),
+          "p90": latency.quantile(0.9),
+          "p99": latency.quantile(0.99),
+          "max": latency.values()[-1],
+          "mean": round(latency.total / latency.count, 1),
+        },
+      }
+      self.reset()
+    return stats
+
+HTTP_STATS = HttpStats()
+
+class HttpClient:
+  # A pooled keep-alive session plus rate limiting and retry with backoff on 429/5xx
+  def __init__(self, pool_size: int = 1, requests_per_second: float = 0):
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+    self.bucket = TokenBucket(requests_per_second)
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.retries = 0
+
+  def _count(self, retried: bool):
+    with self.lock:
+      self.requests += 1
+      if retried:
+        self.retries += 1
+
+  def _backoff(self, attempt: int, response):
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+      delay = min(BACKOFF_MAX_SECONDS, float(response.headers["Retry-After"]))
+    time.sleep(delay * (0.5 + random.random() / 2))
+
+  def request(self, method: str, url: str, **kwargs):
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT_SECONDS)
+    response = None
+    for attempt in range(MAX_RETRIES + 1):
+      self.bucket.acquire()
+      self._count(attempt > 0)
+      start = time.perf_counter()
+      try:
+        response = self.session.request(method, url, **kwargs)
+      except requests.RequestException as e:
+        print("Request to {} failed: {}".format(url, e))
+        response = None
+      HTTP_STATS.record(attempt > 0, response, time.perf_counter() - start)
+      if response is not None and response.status_code not in RETRY_STATUS_CODES:
+        return response
+      if attempt < MAX_RETRIES:
+        self._backoff(attempt, response)
+    return response
+
+  def get(self, url: str, **kwargs):
+    return self.request("GET", url, **kwargs)
+
+  def post(self, url: str, **kwargs):
+    return self.request("POST", url, **kwargs)
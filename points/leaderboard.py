@@ -0,0 +1,64 @@
+import datetime
+import heapq
+
+def window_start(today: datetime.date, days: int):
+  # Placements are dated by month, so a window starts on the first of the month days before this month
+  return (today.replace(day=1) - datetime.timedelta(days=days)).replace(day=1)
+
+def division_and_role(placement):
+  return (placement["division"], placement["role"])
+
+class Leaderboard:
+  # The k dancers with the most points in each group from placements on or after min_date. Each
+  # group keeps a min heap of at most k entries, so memory is groups * k however many dancers
+  # stream past. Dancers on equal points keep the order they arrived in.
+  def __init__(self, min_date: datetime.date, k: int, group_key=division_and_role):
+    self.min_date = min_date.isoformat()
+    self.k = k
+    self.group_key = group_key
+    self.heaps = {}
+    self.sequence = 0
+
+  def add_totals(self, dancer_id, totals):
+    # totals is {group: points} for one dancer and must hold all of their points
+    for (group, points) in totals.items():
+      heap = self.heaps.setdefault(group, [])
+      entry = (points, -self.sequence, dancer_id)
+      self.sequence += 1
+      if len(heap) < self.k:
+        heapq.heappush(heap, entry)
+      elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+
+  def add_dancer(self, dancer):
+    totals = {}
+    for placement in dancer["placements"]:
+      if placement["date"] < self.min_date:
+        continue
+      group = self.group_key(placement)
+      totals[group] = totals.get(group, 0) + placement["points"]
+    self.add_totals(dancer["id"], totals)
+
+  def top(self):
+    # {group: [(dancer id, points)]}, most points first
+    return {group: [(dancer_id, points) for (points, _, dancer_id) in sorted(heap, reverse=True)] for (group, heap) in self.heaps.items()}
+
+class Leaderboards:
+  # Several leaderboards, such as the same ranking over different windows, fed from one walk over
+  # each dancer's placements
+  def __init__(self, leaderboards):
+    self.leaderboards = leaderboards # {name: Leaderboard}
+
+  def add_dancer(self, dancer):
+    totals = {name: {} for name in self.leaderboards}
+    for placement in dancer["placements"]:
+      for (name, leaderboard) in self.leaderboards.items():
+        if placement["date"] < leaderboard.min_date:
+          continue
+        group = leaderboard.group_key(placement)
+        totals[name][group] = totals[name].get(group, 0) + placement["points"]
+    for (name, leaderboard) in self.leaderboards.items():
+      leaderboard.add_totals(dancer["id"], totals[name])
+
+  def __getitem__(self, name):
+    return self.leaderboards[name]
@@ -0,0 +1,86 @@
+import json
+import msgpack
+
+PAGE_ARTIFACTS_FORMAT_VERSION = 1
+
+# Page scoped artifacts, each loaded on its own by assets/js/index.js. Each is a msgpack map with
+# "version": 1 and:
+#   assets/stats.txt: "last_updated", "dancers_count", "events_count", "roles", "divisions",
+#     "ordered_skill_divisions", "new_dancers_over_time", "division_progression", read by
+#     dancers-over-time.html and division-progression.html
+#   assets/leaderboards.txt: "roles", "divisions" and "leaderboards": {name: leaderboard}, each shaped
+#     like top_dancers_by_points_gained_recently with the dancer's "name" beside "wscdid", read by
+#     dancers-on-the-rise.html
+# Events are in assets/events.txt, dancers in assets/chunks and competitors in assets/event_competitors.
+# Upcoming events and the newest dancers are rendered by jekyll from _data/database.json.
+
+STATS_KEYS = ["last_updated", "dancers_count", "events_count", "roles", "divisions", "ordered_skill_divisions", "new_dancers_over_time", "division_progression"]
+
+# What the jekyll templates read from _data/database.json
+JEKYLL_DATABASE_KEYS = ["last_updated", "dancers", "dancers_count", "events", "events_count", "upcoming_events"]
+# pages/dancers.html lists the newest dancers until a search is typed, only those are written
+JEKYLL_DANCERS_LIMIT = 100
+
+# Artifacts earlier builds wrote that no page reads any more, removed by the build if they are still there
+RETIRED_ARTIFACTS = ["assets/database.txt", "assets/dancers.txt", "assets/upcoming_events.txt"]
+
+def jekyll_dancer(dancer):
+  return {"id": dancer["id"], "name": dancer["name"]}
+
+def jekyll_database(database):
+  # The fields of database the templates use, with events cut down to what events.html shows.
+  # Dancers are streamed in by DatabaseJsonWriter through jekyll_dancer.
+  jekyll = {key: database[key] for key in JEKYLL_DATABASE_KEYS}
+  jekyll["events"] = [{"id": e["id"], "name": e["name"], "location": e["location"]} for e in database["events"]]
+  return jekyll
+
+def leaderboard_dancer_ids(database, leaderboard_keys):
+  return set(d["wscdid"] for key in leaderboard_keys for division in database[key] for role in division["roles"] for d in role["dancers"])
+
+def write_page_artifacts(artifacts, database, leaderboard_keys, leaderboard_names):
+  # leaderboard_names is {dancer id: name} for every dancer in the leaderboards
+  artifacts.write_bytes("assets/stats.txt", msgpack.packb({
+    "version": PAGE_ARTIFACTS_FORMAT_VERSION,
+    **{key: database[key] for key in STATS_KEYS},
+  }))
+  artifacts.write_bytes("assets/leaderboards.txt", msgpack.packb({
+    "version": PAGE_ARTIFACTS_FORMAT_VERSION,
+    "roles": database["roles"],
+    "divisions": database["divisions"],
+    "leaderboards": {key: [{
+      "division": division["division"],
+      "roles": [{
+        "role": role["role"],
+        "dancers": [{**d, "name": leaderboard_names[d["wscdid"]]} for d in role["dancers"]],
+      } for role in division["roles"]],
+    } for division in database[key]] for key in leaderboard_keys},
+  }))
+
+class DatabaseJsonWriter:
+  # Writes the same text json.dump(database, f) would, streaming its dancers list in between
+  def __init__(self, file, database):
+    self.file = file
+    self.database = database
+    self.keys = list(database)
+    self.keys_after_dancers = self.keys[self.keys.index("dancers") + 1:]
+    self._write("{")
+    for key in self.keys[:self.keys.index("dancers")]:
+      self._write("{}: {}, ".format(json.dumps(key), json.dumps(database[key])))
+    self._write('"dancers": [')
+    self.dancers_written = 0
+
+  def _write(self, text):
+    self.file.write(text.encode('utf-8'))
+
+  def write_dancer(self, dancer):
+    if self.dancers_written > 0:
+      self._write(", ")
+    self._write(json.dumps(dancer))
+    self.dancers_written += 1
+
+  def close(self):
+    self._write("]")
+    for key in self.keys_after_dancers:
+      self._write(", {}: {}".format(json.dumps(key), json.dumps(self.database[key])))
+    self._write("}")
+    self.file.close()
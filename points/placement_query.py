@@ -0,0 +1,71 @@
+import numpy as np
+from placement_table import load_placement_table, PLACEMENT_TABLE_DIRECTORY
+
+class PlacementQuery:
+  # Filters and group-bys over the columnar placement table. Filters only build a row mask, so
+  # columns are read straight from the memory map and no placement dicts are created.
+  def __init__(self, columns, mask=None):
+    self.columns = columns
+    self.mask = mask
+
+  @classmethod
+  def load(cls, directory: str = PLACEMENT_TABLE_DIRECTORY):
+    return cls(load_placement_table(directory))
+
+  def _and(self, mask):
+    if self.mask is not None:
+      mask = mask & self.mask
+    return PlacementQuery(self.columns, mask)
+
+  def where(self, **equals):
+    # where(role=1, division=4) keeps rows matching every value
+    mask = None
+    for (name, value) in equals.items():
+      column_mask = self.columns[name] == value
+      mask = column_mask if mask is None else mask & column_mask
+    return self._and(mask)
+
+  def between(self, name: str, low=None, high=None):
+    # Keeps rows with low <= column < high, either bound may be left out
+    mask = np.ones(len(self.columns[name]), dtype=bool)
+    if low is not None:
+      mask &= self.columns[name] >= low
+    if high is not None:
+      mask &= self.columns[name] < high
+    return self._and(mask)
+
+  def column(self, name: str):
+    if self.mask is None:
+      return np.asarray(self.columns[name])
+    return self.columns[name][self.mask]
+
+  def __len__(self):
+    if self.mask is None:
+      return len(self.columns["dancer_id"])
+    return int(np.count_nonzero(self.mask))
+
+  def group_by(self, keys, value: str | None = None):
+    # Returns (groups, totals): groups is an array with a row of key values per group, in ascending
+    # order, and totals is the sum of value in each group, or the number of rows when value is None.
+    # The key columns are packed into one int64 so grouping is a single 1d unique.
+    key_columns = [self.column(k).astype(np.int64) for k in keys]
+    lows = [int(c.min()) if len(c) > 0 else 0 for c in key_columns]
+    radixes = [int(c.max()) - low + 1 if len(c) > 0 else 1 for (c, low) in zip(key_columns, lows)]
+    packed = np.zeros(len(key_columns[0]), dtype=np.int64)
+    for (c, low, radix) in zip(key_columns, lows, radixes):
+      packed = packed * radix + (c - low)
+    (packed_groups, inverse) = np.unique(packed, return_inverse=True)
+    groups = np.empty((len(packed_groups), len(keys)), dtype=np.int64)
+    for i in range(len(keys) - 1, -1, -1):
+      (packed_groups, groups[:, i]) = np.divmod(packed_groups, radixes[i])
+      groups[:, i] += lows[i]
+    if value is None:
+      totals = np.bincount(inverse, minlength=len(groups))
+    else:
+      totals = np.bincount(inverse, weights=self.column(value), minlength=len(groups)).astype(np.int64)
+    return (groups, totals)
+
+  def group_sum_dict(self, keys, value: str | None = None):
+    # group_by as {(key values): total}
+    (groups, totals) = self.group_by(keys, value)
+    return dict(zip(map(tuple, groups.tolist()), totals.tolist()))
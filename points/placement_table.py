@@ -0,0 +1,72 @@
+import array
+import datetime
+import io
+import os
+import numpy as np
+
+PLACEMENT_TABLE_DIRECTORY = './placements'
+
+# One .npy file per column, all the same length, one row per placement. Rows are grouped by
+# dancer, lowest id first, in each dancer's placement order. load_placement_table memory maps them.
+# The table is for local analysis and rewritten by every build, so it is gitignored, not committed.
+PLACEMENT_COLUMNS = {
+  "dancer_id": ('i', np.int32),
+  "event_id": ('i', np.int32),
+  "date": ('i', np.int32), # datetime.date.toordinal() of the first of the month
+  "division": ('b', np.int8),
+  "role": ('b', np.int8),
+  "result": ('b', np.int8), # placement, or RESULT_FINALIST
+  "points": ('h', np.int16),
+}
+RESULT_FINALIST = 0
+RESULT_UNKNOWN = -1
+
+def encode_result(result: str):
+  if result == "F":
+    return RESULT_FINALIST
+  try:
+    return int(result)
+  except ValueError:
+    return RESULT_UNKNOWN
+
+def date_to_ordinal(date: str):
+  return datetime.date.fromisoformat(date).toordinal()
+
+class PlacementTableWriter:
+  # Collects placements into typed arrays as dancers stream past, then saves each column. Columns
+  # whose bytes did not change are left alone.
+  def __init__(self, directory: str = PLACEMENT_TABLE_DIRECTORY):
+    self.directory = directory
+    self.columns = {name: array.array(typecode) for (name, (typecode, _)) in PLACEMENT_COLUMNS.items()}
+
+  def add_dancer(self, dancer):
+    for placement in dancer["placements"]:
+      self.columns["dancer_id"].append(dancer["id"])
+      self.columns["event_id"].append(placement["event"])
+      self.columns["date"].append(date_to_ordinal(placement["date"]))
+      self.columns["division"].append(placement["division"])
+      self.columns["role"].append(placement["role"])
+      self.columns["result"].append(encode_result(placement["result"]))
+      self.columns["points"].append(placement["points"])
+
+  def __len__(self):
+    return len(self.columns["dancer_id"])
+
+  def close(self):
+    os.makedirs(self.directory, exist_ok=True)
+    for (name, (_, dtype)) in PLACEMENT_COLUMNS.items():
+      buffer = io.BytesIO()
+      np.save(buffer, np.frombuffer(self.columns[name], dtype=dtype))
+      path = os.path.join(self.directory, name + ".npy")
+      if os.path.exists(path):
+        with open(path, 'rb') as f:
+          if f.read() == buffer.getvalue():
+            continue
+      with open(path + ".tmp", 'wb') as f:
+        f.write(buffer.getvalue())
+      os.replace(path + ".tmp", path)
+    print("Wrote {} placements to {}".format(len(self), self.directory))
+
+def load_placement_table(directory: str = PLACEMENT_TABLE_DIRECTORY):
+  # {column name: read only memory mapped array}
+  return {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode='r') for name in PLACEMENT_COLUMNS}
@@ -0,0 +1,212 @@
+import sqlite3
+import json
+import zlib
+import gzip
+import hashlib
+import os
+from collections.abc import MutableMapping
+
+RAW_STORE_FILE = './raw_responses.sqlite'
+RAW_RESPONSE_DIRECTORY = './raw_responses'
+COMMIT_EVERY = 500
+# wsdc ids per shard of the tracked record log
+SHARD_SIZE = 1000
+
+def shard_of(wsdc_id):
+  return int(wsdc_id) // SHARD_SIZE
+
+def shard_path(directory: str, shard: int):
+  return os.path.join(directory, "{:04d}.json.gz".format(shard))
+
+class RawResponseStore(MutableMapping):
+  # Raw WSDC responses keyed by str(wsdc_id), one zlib compressed json record per dancer.
+  # Iteration is in str(wsdc_id) order, the same order the old raw_responses.json.gz was sorted in,
+  # and streams from a cursor instead of loading every record.
+  # The shards table has the hash of the shard file each shard's records were last read from or
+  # written to, set to NULL in the same transaction that changes one of its records.
+  def __init__(self, path: str = RAW_STORE_FILE):
+    self.connection = sqlite3.connect(path)
+    self.connection.execute("CREATE TABLE IF NOT EXISTS dancers (wsdc_id TEXT PRIMARY KEY, hash TEXT NOT NULL, response BLOB NOT NULL) WITHOUT ROWID")
+    self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID")
+    self.connection.execute("CREATE TABLE IF NOT EXISTS shards (shard INTEGER PRIMARY KEY, hash TEXT)")
+    self.uncommitted = 0
+    self.records_written = 0
+
+  def __getitem__(self, wsdc_id):
+    row = self.connection.execute("SELECT response FROM dancers WHERE wsdc_id = ?", (str(wsdc_id),)).fetchone()
+    if row is None:
+      raise KeyError(wsdc_id)
+    return json.loads(zlib.decompress(row[0]))
+
+  def __setitem__(self, wsdc_id, response):
+    # Only records whose content changed are rewritten
+    response_json = json.dumps(response).encode('utf-8')
+    h = hashlib.sha1(response_json).hexdigest()
+    row = self.connection.execute("SELECT hash FROM dancers WHERE wsdc_id = ?", (str(wsdc_id),)).fetchone()
+    if row is not None and row[0] == h:
+      return
+    self.connection.execute("INSERT OR REPLACE INTO dancers (wsdc_id, hash, response) VALUES (?, ?, ?)", (str(wsdc_id), h, zlib.compress(response_json)))
+    self.mark_changed(wsdc_id)
+    self.records_written += 1
+    self.uncommitted += 1
+    if self.uncommitted >= COMMIT_EVERY:
+      self.commit()
+
+  def __delitem__(self, wsdc_id):
+    if self.connection.execute("DELETE FROM dancers WHERE wsdc_id = ?", (str(wsdc_id),)).rowcount == 0:
+      raise KeyError(wsdc_id)
+    self.mark_changed(wsdc_id)
+    self.uncommitted += 1
+
+  def __contains__(self, wsdc_id):
+    return self.connection.execute("SELECT 1 FROM dancers WHERE wsdc_id = ?", (str(wsdc_id),)).fetchone() is not None
+
+  def __iter__(self):
+    for row in self.connection.execute("SELECT wsdc_id FROM dancers ORDER BY wsdc_id"):
+      yield row[0]
+
+  def __len__(self):
+    return self.connection.execute("SELECT COUNT(*) FROM dancers").fetchone()[0]
+
+  def items(self):
+    for row in self.connection.execute("SELECT wsdc_id, response FROM dancers ORDER BY wsdc_id"):
+      yield (row[0], json.loads(zlib.decompress(row[1])))
+
+  def hashes(self):
+    # (wsdc_id, hash) in iteration order, without reading the responses
+    for row in self.connection.execute("SELECT wsdc_id, hash FROM dancers ORDER BY wsdc_id"):
+      yield (row[0], row[1])
+
+  def json_items(self):
+    # (wsdc_id, response json bytes) in iteration order, without parsing the responses
+    for row in self.connection.execute("SELECT wsdc_id, response FROM dancers ORDER BY wsdc_id"):
+      yield (row[0], zlib.decompress(row[1]))
+
+  def get_hash(self, wsdc_id):
+    # The hash of the stored response json, None when there is none
+    row = self.connection.execute("SELECT hash FROM dancers WHERE wsdc_id = ?", (str(wsdc_id),)).fetchone()
+    return None if row is None else row[0]
+
+  def mark_changed(self, wsdc_id):
+    self.connection.execute("INSERT OR REPLACE INTO shards (shard, hash) VALUES (?, NULL)", (shard_of(wsdc_id),))
+
+  def shard_hashes(self):
+    # {shard: hash of the shard file it matches, None when it changed since}
+    return dict(self.connection.execute("SELECT shard, hash FROM shards"))
+
+  def set_shard_hash(self, shard: int, h):
+    if h is None:
+      self.connection.execute("DELETE FROM shards WHERE shard = ?", (shard,))
+    else:
+      self.connection.execute("INSERT OR REPLACE INTO shards (shard, hash) VALUES (?, ?)", (shard, h))
+
+  def shard_json_items(self, shard: int):
+    # (wsdc_id, response json bytes) of one shard in wsdc id order
+    for row in self.connection.execute("SELECT wsdc_id, response FROM dancers WHERE CAST(wsdc_id AS INTEGER) BETWEEN ? AND ? ORDER BY CAST(wsdc_id AS INTEGER)", (shard * SHARD_SIZE, (shard + 1) * SHARD_SIZE - 1)):
+      yield (row[0], zlib.decompress(row[1]))
+
+  def get_meta(self, key: str):
+    row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return None if row is None else row[0]
+
+  def set_meta(self, key: str, value: str):
+    self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+  def values(self):
+    for (_, response) in self.items():
+      yield response
+
+  def commit(self):
+    self.connection.commit()
+    self.uncommitted = 0
+
+  def close(self):
+    self.commit()
+    self.connection.close()
+
+def file_hash(path: str):
+  h = hashlib.sha1()
+  with open(path, "rb") as f:
+    for block in iter(lambda: f.read(1 << 20), b""):
+      h.update(block)
+  return h.hexdigest()
+
+def read_raw_response_file(path: str):
+  with open(path, "rb") as f:
+    return json.loads(gzip.decompress(f.read()).decode('utf-8'))
+
+def import_raw_response_shards(store: RawResponseStore, directory: str = RAW_RESPONSE_DIRECTORY):
+  # raw_responses/ is the copy of the raw responses tracked in git, one gz of json per SHARD_SIZE
+  # wsdc ids, and the store is a local index of it that CI keeps in actions/cache. Only shards
+  # whose file differs from the one the store last matched are loaded, which on a fresh checkout
+  # is all of them and with a store from the last run's cache none. Dancers a loaded shard no
+  # longer has are dropped, and shards changed in the store but not written yet are left alone.
+  files = {}
+  if os.path.isdir(directory):
+    for name in os.listdir(directory):
+      if name.endswith(".json.gz"):
+        files[int(name.split(".")[0])] = os.path.join(directory, name)
+  shard_hashes = store.shard_hashes()
+  imported = 0
+  for shard in sorted(set(files) | set(shard_hashes)):
+    if shard in shard_hashes and shard_hashes[shard] is None:
+      continue
+    h = file_hash(files[shard]) if shard in files else None
+    if h is not None and shard_hashes.get(shard) == h:
+      continue
+    records = read_raw_response_file(files[shard]) if shard in files else {}
+    for wsdc_id in records:
+      store[wsdc_id] = records[wsdc_id]
+    for (wsdc_id, _) in list(store.shard_json_items(shard)):
+      if wsdc_id not in records:
+        del store[wsdc_id]
+    store.set_shard_hash(shard, h)
+    imported += 1
+  store.commit()
+  if imported > 0:
+    print("Imported {} raw response shards from {}".format(imported, directory))
+  return store
+
+def export_raw_response_shards(store: RawResponseStore, directory: str = RAW_RESPONSE_DIRECTORY):
+  # Rewrites only the shards with a record changed since they were last read or written. Each is
+  # json sorted by wsdc id, streamed record by record, and its gzip header carries no timestamp,
+  # so a shard only shows up in a commit when one of its responses did. Returns the number of
+  # shards written.
+  os.makedirs(directory, exist_ok=True)
+  written = 0
+  for (shard, h) in sorted(store.shard_hashes().items()):
+    if h is not None:
+      continue
+    path = shard_path(directory, shard)
+    temporary_file = path + ".tmp"
+    with open(temporary_file, "wb") as f:
+      with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+        separator = b"{"
+        for (wsdc_id, response_json) in store.shard_json_items(shard):
+          gz.write(separator + json.dumps(wsdc_id).encode('utf-8') + b": " + response_json)
+          separator = b", "
+        if separator == b", ":
+          gz.write(b"}")
+    if separator == b"{":
+      # Every dancer of the shard was dropped
+      os.remove(temporary_file)
+      if os.path.exists(path):
+        os.remove(path)
+      store.set_shard_hash(shard, None)
+    else:
+      os.replace(temporary_file, path)
+      store.set_shard_hash(shard, file_hash(path))
+    written += 1
+  store.commit()
+  return written
+
+def import_raw_response_file(store: RawResponseStore, raw_response_file: str):
+  # One time import from raw_responses.json.gz, the single file the raw responses were kept in
+  # before raw_responses/. Every shard is marked changed so the next export writes all of them.
+  raw_response_dancers = read_raw_response_file(raw_response_file)
+  for wsdc_id in raw_response_dancers:
+    store[wsdc_id] = raw_response_dancers[wsdc_id]
+    store.mark_changed(wsdc_id)
+  store.commit()
+  print("Imported {} raw responses from {}".format(len(raw_response_dancers), raw_response_file))
+  return store
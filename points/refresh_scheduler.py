@@ -0,0 +1,111 @@
+import json
+import datetime
+import re
+
+# A dancer is always rechecked at least this often, however long they have been unchanged. Dancers
+# who attended a recently finished event are rechecked first, but that is matched on the events
+# already in their stored record, so a dancer's first placement at a new event is only picked up
+# when their backoff runs out: up to MAX_BACKOFF_RUNS weekly runs late. A lower cap shortens that
+# lag at the cost of more refresh requests, which DEFAULT_REFRESH_REQUEST_BUDGET still caps.
+MAX_BACKOFF_RUNS = 4
+LIMIT_TO_DANCE_STYLE = 'West Coast Swing'
+
+# State kept between runs, in the raw store's SQLite file next to the responses it describes, which
+# CI keeps in actions/cache instead of committing it. Losing it only loses the backoff: every recent
+# dancer is then due, up to the request budget.
+#   refresh table: a row per checked dancer with the hash of their stored response when it was last
+#     checked, the date it last changed, the run it was last checked in and its unchanged runs since
+#   meta "refresh_run": number of the last run
+#   meta "refresh_last_run": iso datetime of the last run
+#   meta "refresh_events": [{"name", "end_date"}] from the last events page, which only lists upcoming events
+# Loaded as {"run", "last_run", "events", "dancers": {wsdc_id: {"hash", "last_changed",
+# "last_checked_run", "unchanged_runs"}}, "checked": set of wsdc_ids recorded this run}
+
+def load_refresh_state(store):
+  # Loading the state starts a new run
+  store.connection.execute("CREATE TABLE IF NOT EXISTS refresh (wsdc_id TEXT PRIMARY KEY, hash TEXT NOT NULL, last_changed TEXT NOT NULL, last_checked_run INTEGER NOT NULL, unchanged_runs INTEGER NOT NULL) WITHOUT ROWID")
+  dancers = {}
+  for (wsdc_id, h, last_changed, last_checked_run, unchanged_runs) in store.connection.execute("SELECT wsdc_id, hash, last_changed, last_checked_run, unchanged_runs FROM refresh"):
+    dancers[wsdc_id] = {"hash": h, "last_changed": last_changed, "last_checked_run": last_checked_run, "unchanged_runs": unchanged_runs}
+  return {
+    "run": int(store.get_meta("refresh_run") or 0) + 1,
+    "last_run": store.get_meta("refresh_last_run"),
+    "events": json.loads(store.get_meta("refresh_events") or "[]"),
+    "dancers": dancers,
+    "checked": set(),
+  }
+
+def save_refresh_state(store, state, upcoming_events):
+  # Only the dancers checked this run are written
+  rows = []
+  for wsdc_id in sorted(state["checked"]):
+    d = state["dancers"][wsdc_id]
+    rows.append((wsdc_id, d["hash"], d["last_changed"], d["last_checked_run"], d["unchanged_runs"]))
+  store.connection.executemany("INSERT OR REPLACE INTO refresh (wsdc_id, hash, last_changed, last_checked_run, unchanged_runs) VALUES (?, ?, ?, ?, ?)", rows)
+  store.set_meta("refresh_run", str(state["run"]))
+  store.set_meta("refresh_last_run", datetime.datetime.now().isoformat())
+  store.set_meta("refresh_events", json.dumps([{"name": e["name"], "end_date": e["end_date"]} for e in upcoming_events]))
+  store.commit()
+  state["checked"] = set()
+
+def _normalize_event_name(name: str):
+  return re.sub(r'[^a-z0-9]', '', name.lower())
+
+def _attended_event_names(raw_dancer):
+  names = set()
+  for role_key in ['leader', 'follower']:
+    placements = raw_dancer[role_key]['placements']
+    if placements is None or type(placements) is list or LIMIT_TO_DANCE_STYLE not in placements:
+      continue
+    for division in placements[LIMIT_TO_DANCE_STYLE].values():
+      for competition in division["competitions"]:
+        names.add(_normalize_event_name(competition["event"]["name"]))
+  return names
+
+def recently_finished_event_names(state, upcoming_events):
+  # The events page only lists upcoming events, so events that finished since the last run
+  # come from the snapshot saved by that run as well as the current page
+  now = datetime.datetime.now().isoformat()
+  last_run = state["last_run"] or now
+  return set([_normalize_event_name(e["name"]) for e in state["events"] + upcoming_events if last_run < e["end_date"] <= now])
+
+def schedule_refresh(candidates, raw_response_dancers, state, upcoming_events, request_budget: int):
+  # candidates is [(wsdc_id, max_placement_date)] for dancers inside the recency window.
+  # Dancers who have been to a recently finished event come first, then dancers whose backoff
+  # interval has elapsed, most overdue first. The result is capped at request_budget ids.
+  finished_event_names = recently_finished_event_names(state, upcoming_events)
+  attendees = []
+  due = []
+  for (wsdc_id, max_date) in candidates:
+    if len(finished_event_names & _attended_event_names(raw_response_dancers[str(wsdc_id)])) > 0:
+      attendees.append((max_date, wsdc_id))
+      continue
+    dancer_state = state["dancers"].get(str(wsdc_id))
+    if dancer_state is None:
+      due.append((MAX_BACKOFF_RUNS, max_date, wsdc_id))
+      continue
+    interval = min(2 ** dancer_state["unchanged_runs"], MAX_BACKOFF_RUNS)
+    overdue = state["run"] - dancer_state["last_checked_run"] - interval
+    if overdue >= 0:
+      due.append((overdue, max_date, wsdc_id))
+  attendees.sort(reverse=True)
+  due.sort(reverse=True)
+  scheduled = [a[1] for a in attendees] + [d[2] for d in due]
+  print("Scheduled {} of {} recent dancers for refresh ({} attended a recently finished event)".format(min(len(scheduled), request_budget), len(candidates), len(attendees)))
+  return scheduled[:request_budget]
+
+def record_refresh(state, wsdc_ids, raw_response_dancers):
+  # raw_response_dancers is the raw store, whose per record hash tells whether a response changed
+  today = datetime.date.today().isoformat()
+  for wsdc_id in wsdc_ids:
+    h = raw_response_dancers.get_hash(wsdc_id)
+    if h is None:
+      continue
+    state["checked"].add(str(wsdc_id))
+    dancer_state = state["dancers"].get(str(wsdc_id))
+    if dancer_state is None or dancer_state["hash"] != h:
+      state["dancers"][str(wsdc_id)] = {"hash": h, "last_changed": today, "last_checked_run": state["run"], "unchanged_runs": 0}
+    else:
+      dancer_state["last_checked_run"] = state["run"]
+      dancer_state["unchanged_runs"] += 1
+  return state
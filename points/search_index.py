@@ -0,0 +1,146 @@
+import bisect
+import os
+import re
+import unicodedata
+import msgpack
+
+SEARCH_INDEX_FORMAT_VERSION = 2
+SEARCH_PREFIX_LENGTH = 2
+SEARCH_RESULT_LIMIT = 100
+# Letters NFKD does not split into a base letter and a mark
+FOLDED_LETTERS = {"ø": "o", "æ": "ae", "œ": "oe", "ß": "ss", "ł": "l", "đ": "d", "ð": "d", "þ": "th", "ı": "i"}
+
+# The dancer search index, read by searchDancers in assets/js/index.js:
+#   {directory}/index.txt: {"version": 2, "prefix_length": 2, "shards": [prefix, ...]}
+#   {directory}/{shard name}.txt: {
+#     "version": 2,
+#     "tokens": [token, ...], sorted, every token starting with the shard's prefix
+#     "postings": [[dancer id, ...], ...], for each token, highest id first
+#     "names": {dancer id: name}, for every dancer in the postings
+#   }
+# Tokens are the folded words of a dancer's name plus their id. Prefixes shorter than the prefix
+# length have a shard too, whose only token is the prefix itself with every dancer that has a token
+# starting with it, so a query of only short words reads those. A shard is named by its prefix
+# when that is plain a-z0-9, otherwise by "_" and the hex of the prefix's utf-8 bytes. A query
+# only reads the shards of its own words, so its cost depends on how many dancers match, not
+# on how many dancers there are.
+
+def fold(text: str):
+  # Lower cased, with accents removed, the same as __foldSearchText in assets/js/index.js
+  text = unicodedata.normalize("NFKD", text.lower())
+  return "".join(FOLDED_LETTERS.get(c, c) for c in text if not unicodedata.category(c).startswith("M"))
+
+def tokenize(text: str):
+  # Runs of letters and numbers in the folded text
+  tokens = []
+  current = []
+  for c in fold(text):
+    if unicodedata.category(c)[0] in "LN":
+      current.append(c)
+    elif len(current) > 0:
+      tokens.append("".join(current))
+      current = []
+  if len(current) > 0:
+    tokens.append("".join(current))
+  return tokens
+
+def shard_name(prefix: str):
+  if re.fullmatch(r"[a-z0-9]+", prefix):
+    return prefix
+  return "_" + prefix.encode("utf-8").hex()
+
+def dancer_tokens(dancer_id, name: str):
+  return set(tokenize(name)) | {str(dancer_id)}
+
+class SearchIndexWriter:
+  # Collects postings as dancers stream past, highest id first, then writes each prefix shard and
+  # the shard list through the ArtifactWriter, removing any other files in the directory
+  def __init__(self, artifacts, directory: str):
+    self.artifacts = artifacts
+    self.directory = directory
+    os.makedirs(artifacts.path(directory), exist_ok=True)
+    self.postings = {} # token: [dancer id]
+    self.short_postings = {} # prefix shorter than SEARCH_PREFIX_LENGTH: [dancer id]
+    self.names = {}
+
+  def add_dancer(self, dancer):
+    self.names[dancer["id"]] = dancer["name"]
+    tokens = dancer_tokens(dancer["id"], dancer["name"])
+    for token in tokens:
+      if len(token) < SEARCH_PREFIX_LENGTH:
+        continue
+      self.postings.setdefault(token, []).append(dancer["id"])
+    for prefix in sorted(set(token[:length] for token in tokens for length in range(1, min(len(token), SEARCH_PREFIX_LENGTH - 1) + 1))):
+      self.short_postings.setdefault(prefix, []).append(dancer["id"])
+
+  def close(self):
+    shards = {prefix: [prefix] for prefix in self.short_postings}
+    for token in sorted(self.postings):
+      shards.setdefault(token[:SEARCH_PREFIX_LENGTH], []).append(token)
+    for (prefix, tokens) in shards.items():
+      if len(prefix) < SEARCH_PREFIX_LENGTH:
+        postings = [self.short_postings[prefix]]
+      else:
+        postings = [self.postings[token] for token in tokens]
+      self.artifacts.write_bytes("{}/{}.txt".format(self.directory, shard_name(prefix)), msgpack.packb({
+        "version": SEARCH_INDEX_FORMAT_VERSION,
+        "tokens": tokens,
+        "postings": postings,
+        "names": {dancer_id: self.names[dancer_id] for dancer_id in sorted(set(i for p in postings for i in p), reverse=True)},
+      }))
+    self.artifacts.write_bytes("{}/index.txt".format(self.directory), msgpack.packb({
+      "version": SEARCH_INDEX_FORMAT_VERSION,
+      "prefix_length": SEARCH_PREFIX_LENGTH,
+      "shards": sorted(shards),
+    }))
+    self.artifacts.remove_orphans(self.directory)
+    print("Wrote {} search tokens in {} shards".format(len(self.postings), len(shards)))
+
+class SearchIndexReader:
+  # Runs searches against a written index, loading each shard once
+  def __init__(self, directory: str):
+    self.directory = directory
+    with open(os.path.join(directory, "index.txt"), "rb") as f:
+      index = msgpack.unpackb(f.read(), strict_map_key=False)
+    self.prefix_length = index["prefix_length"]
+    self.shards = set(index["shards"])
+    self.loaded_shards = {}
+
+  def shard(self, prefix: str):
+    if prefix not in self.loaded_shards:
+      with open(os.path.join(self.directory, shard_name(prefix) + ".txt"), "rb") as f:
+        self.loaded_shards[prefix] = msgpack.unpackb(f.read(), strict_map_key=False)
+    return self.loaded_shards[prefix]
+
+  def search(self, query: str, limit: int = SEARCH_RESULT_LIMIT):
+    # [(dancer id, name)], highest id first, of dancers with a token starting with every word of
+    # the query. Words shorter than the prefix length only narrow down the other words' matches,
+    # unless every word is, when each is looked up in its own short prefix shard.
+    query_tokens = tokenize(query)
+    long_tokens = [t for t in query_tokens if len(t) >= self.prefix_length]
+    short_tokens = [t for t in query_tokens if len(t) < self.prefix_length]
+    lookup_tokens = long_tokens if len(long_tokens) > 0 else short_tokens
+    if len(lookup_tokens) == 0:
+      return []
+    matches = None
+    names = {}
+    for token in lookup_tokens:
+      prefix = token[:self.prefix_length]
+      if prefix not in self.shards:
+        return []
+      shard = self.shard(prefix)
+      names.update(shard["names"])
+      token_matches = set()
+      i = bisect.bisect_left(shard["tokens"], token)
+      while i < len(shard["tokens"]) and shard["tokens"][i].startswith(token):
+        token_matches.update(shard["postings"][i])
+        i += 1
+      matches = token_matches if matches is None else matches & token_matches
+    results = []
+    for dancer_id in sorted(matches, reverse=True):
+      tokens = dancer_tokens(dancer_id, names[dancer_id])
+      if all(any(t.startswith(short) for t in tokens) for short in short_tokens):
+        results.append((dancer_id, names[dancer_id]))
+        if len(results) >= limit:
+          break
+    return results
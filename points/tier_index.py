@@ -0,0 +1,62 @@
+# Tiers by the points first place was worth, (tier, competitors)
+TIERS_BY_FIRST_PLACE_POINTS = {
+  3: (1, "5 - 10"),
+  6: (2, "11 - 19"),
+  10: (3, "20 - 39"),
+  15: (4, "40 - 79"),
+  20: (5, "80 - 129"),
+  25: (6, "130+"),
+}
+TIER_NAMES = {tier: "Tier {}, {} competitors".format(tier, competitors) for (tier, competitors) in TIERS_BY_FIRST_PLACE_POINTS.values()}
+
+class TierIndex:
+  # First place points keyed by (event id, date, division, role), filled as placements are parsed.
+  # A later first place for the same key replaces an earlier one.
+  def __init__(self):
+    self.first_place_points = {}
+
+  def add(self, event_id, date: str, division, role, points):
+    self.first_place_points[(event_id, date, division, role)] = points
+
+  def add_entries(self, entries):
+    # entries is [[event id, date, division, role, points]], as placementsToList collects them
+    for (event_id, date, division, role, points) in entries:
+      self.first_place_points[(event_id, date, division, role)] = points
+
+  def __len__(self):
+    return len(self.first_place_points)
+
+  def tiers_by_event(self):
+    # {event id: {date: [(division, role, tier)]}}, skipping points that are not a tier
+    tiers = {}
+    for ((event_id, date, division, role), points) in self.first_place_points.items():
+      if points not in TIERS_BY_FIRST_PLACE_POINTS:
+        print("Invalid number of points: {} {} {} {} {}".format(points, event_id, date, division, role))
+        continue
+      tiers.setdefault(event_id, {}).setdefault(date, []).append((division, role, TIERS_BY_FIRST_PLACE_POINTS[points][0]))
+    return tiers
+
+  def annotate(self, events, divisions_map, roles_map):
+    # Replaces each event's dates with [{"date", "divisions": {division: {role: tier name}}}], in
+    # divisions_map then roles_map order, and adds a "tier_summary" of
+    # {"highest": highest tier or None, "counts": [number of tier 1 divisions, ..., tier 6]}.
+    # Only keys in the index are visited.
+    division_order = {division: i for (i, division) in enumerate(divisions_map)}
+    role_order = {role: i for (i, role) in enumerate(roles_map)}
+    tiers_by_event = self.tiers_by_event()
+    for event in events:
+      event_tiers = tiers_by_event.get(event["id"], {})
+      counts = [0] * len(TIER_NAMES)
+      event["dates"] = [{"date": d, "divisions": {}} for d in event["dates"]]
+      for date_object in event["dates"]:
+        date_tiers = sorted(event_tiers.get(date_object["date"], []), key=lambda t: (division_order[t[0]], role_order[t[1]]))
+        for (division, role, tier) in date_tiers:
+          date_object["divisions"].setdefault(divisions_map[division], {})[roles_map[role]] = TIER_NAMES[tier]
+          counts[tier - 1] += 1
+      highest = None
+      for tier in range(len(counts), 0, -1):
+        if counts[tier - 1] > 0:
+          highest = tier
+          break
+      event["tier_summary"] = {"highest": highest, "counts": counts}
+    return events
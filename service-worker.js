@@ -32,11 +32,47 @@ const PRECACHE_URLS = [
   './index.html'
 ];
 
+// Written by points/fetch.py, maps each generated asset to a hash of its contents.
+const MANIFEST_URL = './assets/manifest.json';
+
+// Copies assets whose hash is the same as in the previous precache's manifest, so an update
+// only downloads the assets that changed. Everything else, the pages included, is fetched.
+const precacheChangedResources = async (cache) => {
+  let manifest = null;
+  try {
+    manifest = await (await fetch(MANIFEST_URL, {cache: 'no-store'})).json();
+  } catch (e) {
+    return cache.addAll(PRECACHE_URLS);
+  }
+  const previousCacheName = (await caches.keys()).filter(name => name.startsWith('precache-') && name !== PRECACHE).pop();
+  const previousCache = previousCacheName ? await caches.open(previousCacheName) : null;
+  let previousFiles = {};
+  if (previousCache) {
+    const previousManifest = await previousCache.match(MANIFEST_URL);
+    if (previousManifest) {
+      previousFiles = (await previousManifest.json()).files;
+    }
+  }
+  const urlsToFetch = [];
+  await Promise.all(PRECACHE_URLS.map(async (url) => {
+    const file = url.replace(/^\.\//, '');
+    if (file in manifest.files && previousFiles[file] === manifest.files[file]) {
+      const previous = await previousCache.match(url);
+      if (previous) {
+        return cache.put(url, previous);
+      }
+    }
+    urlsToFetch.push(url);
+  }));
+  await cache.addAll(urlsToFetch);
+  await cache.put(MANIFEST_URL, new Response(JSON.stringify(manifest)));
+};
+
 // The install handler takes care of precaching the resources we always need.
 self.addEventListener('install', event => {
   event.waitUntil(
     caches.open(PRECACHE)
-      .then(cache => cache.addAll(PRECACHE_URLS))
+      .then(cache => precacheChangedResources(cache))
       .then(self.skipWaiting())
   );
 });